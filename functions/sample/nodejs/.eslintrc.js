@@ -12,5 +12,7 @@ module.exports = {
     },
     "rules": {
         "no-multiple-empty-lines": ["error", { "max": 2, "maxBOF": 1 }],
+        "no-shadow": "error",
+        "no-use-before-define": ["error", { "functions": false }],
     }
 }
@@ -1,5 +1,7 @@
+const crypto = require('crypto');
 const http = require('http');
 const url = require('url');
+const zlib = require('zlib');
 const Cloudant = require('@cloudant/cloudant');
 const port = process.env.PORT || 3000;
 
@@ -25,12 +27,105 @@ let db;
     db = await dbCloudantConnect();
 })();
 
+// Entity tag of a list of documents, derived from their ids and revisions and any extra value
+function revisionsEtag(docs, ...extra) {
+    const hash = crypto.createHash('sha1');
+    for (const doc of docs) {
+        hash.update(`${doc._id}:${doc._rev}\n`);
+    }
+    for (const value of extra) {
+        hash.update(`${value}\n`);
+    }
+    return `"${hash.digest('hex')}"`;
+}
+
+// Whether the If-None-Match header of a request holds an entity tag
+function etagMatches(req, etag) {
+    const header = req.headers['if-none-match'];
+    if (!header) {
+        return false;
+    }
+    return header.split(',').some((tag) => {
+        const candidate = tag.trim().replace(/^W\//, '');
+        return candidate === etag || candidate === '*';
+    });
+}
+
+// JSON bodies smaller than this are not worth compressing
+const COMPRESS_MIN_SIZE = 1024;
+
+// Content coding accepted by a client, brotli preferred, or null
+function negotiateEncoding(req) {
+    const quality = {};
+    for (const coding of (req.headers['accept-encoding'] || '').split(',')) {
+        const [name, ...params] = coding.trim().toLowerCase().split(';');
+        const q = params.map((param) => param.trim()).find((param) => param.startsWith('q='));
+        quality[name] = q ? parseFloat(q.slice(2)) : 1;
+    }
+    let best = null;
+    for (const name of ['br', 'gzip']) {
+        const q = name in quality ? quality[name] : (quality['*'] || 0);
+        if (q > 0 && (best === null || q > best.q)) {
+            best = { name, q };
+        }
+    }
+    return best ? best.name : null;
+}
+
+// Send a JSON body, compressed with the coding accepted by the client if large enough
+function sendJson(req, res, headers, json) {
+    const body = Buffer.from(json);
+    const encoding = body.length >= COMPRESS_MIN_SIZE ? negotiateEncoding(req) : null;
+    const sent = { 'Content-Type': 'application/json', Vary: 'Accept-Encoding', ...headers };
+    if (!encoding) {
+        res.writeHead(200, sent);
+        res.end(body);
+        return;
+    }
+    const compress = encoding === 'br'
+        ? (data, done) => zlib.brotliCompress(data, {
+            params: { [zlib.constants.BROTLI_PARAM_QUALITY]: 5 },
+        }, done)
+        : (data, done) => zlib.gzip(data, { level: 6 }, done);
+    compress(body, (err, compressed) => {
+        if (err) {
+            res.writeHead(200, sent);
+            res.end(body);
+            return;
+        }
+        // The compressed bytes differ from the JSON: its entity tag is only weakly equal
+        if (sent.ETag) {
+            sent.ETag = `W/${sent.ETag}`;
+        }
+        res.writeHead(200, { ...sent, 'Content-Encoding': encoding });
+        res.end(compressed);
+    });
+}
+
+// Dealer documents in the compact columnar form: field names and one array of values per field
+function columnsBody(docs, fields) {
+    const names = fields || [...new Set(docs.flatMap((doc) => Object.keys(doc)))];
+    return {
+        fields: names,
+        columns: names.map((name) => docs.map((doc) => doc[name] ?? null)),
+        count: docs.length,
+    };
+}
+
 // Create an HTTP server
 const server = http.createServer((req, res) => {
     if (req.method === 'GET' && req.url.startsWith('/api/dealership')) {
         // Parse the URL to extract query parameters
         const parsedUrl = url.parse(req.url, true);
         const { state, id } = parsedUrl.query;
+        // format=columns returns the compact columnar form, restricted to `fields` if given
+        const format = parsedUrl.query.format || 'documents';
+        const fields = parsedUrl.query.fields ? parsedUrl.query.fields.split(',') : null;
+        if (format !== 'documents' && format !== 'columns') {
+            res.writeHead(400, { 'Content-Type': 'application/json' });
+            res.end(JSON.stringify({ error: "'format' parameter must be 'documents' or 'columns'" }));
+            return;
+        }
 
         // Log the received ID for debugging
         console.log('Received request with ID:', id);
@@ -55,8 +150,17 @@ const server = http.createServer((req, res) => {
                 res.end(JSON.stringify({ error: 'An error occurred while fetching dealerships.' }));
             } else {
                 const dealerships = body.docs;
-                res.writeHead(200, { 'Content-Type': 'application/json' });
-                res.end(JSON.stringify(dealerships));
+                // Clients holding the same revisions only get the headers back
+                const etag = format === 'columns'
+                    ? revisionsEtag(dealerships, format, fields || '')
+                    : revisionsEtag(dealerships);
+                if (etagMatches(req, etag)) {
+                    res.writeHead(304, { ETag: etag, Vary: 'Accept-Encoding' });
+                    res.end();
+                    return;
+                }
+                const payload = format === 'columns' ? columnsBody(dealerships, fields) : dealerships;
+                sendJson(req, res, { ETag: etag }, JSON.stringify(payload));
             }
         });
     } else {
@@ -70,3 +174,5 @@ const server = http.createServer((req, res) => {
 server.listen(port, () => {
     console.log(`Server is running on port ${port}`);
 });
+
+module.exports = server;
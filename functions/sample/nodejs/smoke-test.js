@@ -0,0 +1,73 @@
+/**
+ * Smoke test of get-dealerships.js, with the Cloudant client stubbed.
+ *
+ * Usage: npm test
+ */
+const assert = require('assert');
+const http = require('http');
+const Module = require('module');
+
+const DEALERS = [
+    { _id: 'a', _rev: '1-a', id: 1, state: 'Texas', city: 'El Paso' },
+    { _id: 'b', _rev: '1-b', id: 2, state: 'Texas', city: 'Austin' },
+];
+
+// Serve the dealers above instead of connecting to Cloudant
+const loadModule = Module._load;
+Module._load = function load(request, ...args) {
+    if (request === '@cloudant/cloudant') {
+        return () => ({
+            use: () => ({
+                find: (query, done) => done(null, {
+                    docs: DEALERS.filter((doc) => !query.selector.state
+                        || doc.state === query.selector.state),
+                }),
+            }),
+        });
+    }
+    return loadModule.call(this, request, ...args);
+};
+
+process.env.PORT = '0';
+const server = require('./get-dealerships');
+
+// GET a path of the server, resolving to its status, headers and body
+function get(path, headers = {}) {
+    return new Promise((resolve, reject) => {
+        const { port } = server.address();
+        http.get({ port, path, headers }, (res) => {
+            let data = '';
+            res.on('data', (chunk) => { data += chunk; });
+            res.on('end', () => resolve({ status: res.statusCode, headers: res.headers, data }));
+        }).on('error', reject);
+    });
+}
+
+async function run() {
+    if (!server.listening) {
+        await new Promise((resolve) => server.once('listening', resolve));
+    }
+    const listed = await get('/api/dealership?state=Texas');
+    assert.strictEqual(listed.status, 200);
+    assert.deepStrictEqual(JSON.parse(listed.data).map((doc) => doc.id), [1, 2]);
+
+    const columns = await get('/api/dealership?format=columns&fields=id,city');
+    assert.strictEqual(columns.status, 200);
+    assert.deepStrictEqual(JSON.parse(columns.data), {
+        fields: ['id', 'city'], columns: [[1, 2], ['El Paso', 'Austin']], count: 2,
+    });
+
+    const revalidated = await get('/api/dealership', { 'If-None-Match': listed.headers.etag });
+    assert.strictEqual(revalidated.status, 304);
+
+    const invalid = await get('/api/dealership?format=xml');
+    assert.strictEqual(invalid.status, 400);
+}
+
+run().then(() => {
+    console.log('get-dealerships smoke test passed');
+    server.close();
+}, (err) => {
+    console.error(err);
+    process.exit(1);
+});
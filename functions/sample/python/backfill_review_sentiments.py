@@ -0,0 +1,39 @@
+"""
+Module: backfill_review_sentiments.py
+
+Score the reviews stored before reviews.py computed sentiment at write time.
+
+Every review without a sentiment is marked pending and scored the same way the
+sentiment workers of reviews.py score new reviews, which also counts it in its
+dealership summary. Reviews that already have a label are left alone.
+
+Usage:
+    NLU_API_KEY=... NLU_URL=... python backfill_review_sentiments.py
+"""
+from ibm_cloud_sdk_core import ApiException
+import requests
+from reviews import NLU_API_KEY, NLU_URL, PENDING, score_review, service
+from rebuild_review_summaries import iter_reviews
+
+def main():
+    """Mark and score every review that has no sentiment yet."""
+    if not (NLU_API_KEY and NLU_URL):
+        print("NLU_API_KEY and NLU_URL must be set to score review sentiments")
+        return
+    scored = failed = 0
+    for review in iter_reviews():
+        if 'review' not in review or review.get('sentiment') not in (None, PENDING):
+            continue
+        try:
+            if review.get('sentiment') is None:
+                review['sentiment'] = PENDING
+                service.put_document(db='reviews', doc_id=review['_id'], document=review)
+            score_review(review['_id'])
+            scored += 1
+        except (ApiException, requests.exceptions.RequestException, KeyError) as exception:
+            print(f"Could not score review {review['_id']}: {exception}")
+            failed += 1
+    print(f"Scored {scored} reviews, {failed} failed")
+
+if __name__ == '__main__':
+    main()
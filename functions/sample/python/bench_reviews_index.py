@@ -0,0 +1,109 @@
+"""
+Module: bench_reviews_index.py
+
+Benchmark the get_reviews queries against a local CouchDB standing in for Cloudant,
+with and without the JSON indexes declared in reviews.py.
+
+The reviews of cloudant/data/reviews-full.json are repeated, spread over many
+dealerships, up to the requested number of documents. Every query shape is then
+timed once answered by a full scan and once answered by its index.
+
+Usage:
+    docker run -d -p 5984:5984 -e COUCHDB_USER=admin -e COUCHDB_PASSWORD=pass couchdb:3
+    python bench_reviews_index.py --url http://127.0.0.1:5984 --docs 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from ibmcloudant.cloudant_v1 import BulkDocs, CloudantV1, IndexDefinition, IndexField
+from ibm_cloud_sdk_core import ApiException
+from ibm_cloud_sdk_core.authenticators import BasicAuthenticator
+from reviews import REVIEW_INDEXES, review_query
+
+REVIEWS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', '..', 'cloudant', 'data', 'reviews-full.json')
+
+def parse_args():
+    """Read the command line options."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5984', help='CouchDB URL')
+    parser.add_argument('--username', default='admin', help='CouchDB admin user')
+    parser.add_argument('--password', default='pass', help='CouchDB admin password')
+    parser.add_argument('--db', default='reviews_bench', help='Scratch database name')
+    parser.add_argument('--docs', type=int, default=1000000, help='Number of reviews to load')
+    parser.add_argument('--dealerships', type=int, default=10000,
+                        help='Number of distinct dealerships')
+    parser.add_argument('--batch', type=int, default=10000, help='Documents per _bulk_docs call')
+    parser.add_argument('--queries', type=int, default=50, help='Queries timed per case')
+    return parser.parse_args()
+
+def load_reviews(service, args):
+    """Recreate the scratch database and fill it with scaled sample reviews."""
+    try:
+        service.delete_database(db=args.db)
+    except ApiException:
+        pass
+    service.put_database(db=args.db)
+
+    with open(REVIEWS_FILE, encoding='utf-8') as reviews_file:
+        samples = json.load(reviews_file)['reviews']
+
+    started = time.monotonic()
+    for first in range(0, args.docs, args.batch):
+        docs = []
+        for i in range(first, min(first + args.batch, args.docs)):
+            doc = dict(samples[i % len(samples)])
+            doc['id'] = i + 1
+            doc['dealership'] = random.randint(1, args.dealerships)
+            doc['time'] = f"2023-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:{i % 60:02d}"
+            docs.append(doc)
+        service.post_bulk_docs(db=args.db, bulk_docs=BulkDocs(docs=docs))
+    elapsed = time.monotonic() - started
+    print(f"Loaded {args.docs} reviews in {elapsed:.1f}s ({args.docs / elapsed:.0f} docs/s)")
+
+def time_queries(service, args, name, indexed):
+    """Return the latencies in milliseconds of one query shape."""
+    latencies = []
+    for _ in range(args.queries):
+        query = review_query(name, random.randint(1, args.dealerships), 'desc')
+        if not indexed:
+            del query['use_index']
+            query.pop('sort', None)
+        started = time.monotonic()
+        service.post_find(db=args.db, limit=25, **query).get_result()
+        latencies.append((time.monotonic() - started) * 1000)
+    return latencies
+
+def report(label, latencies):
+    """Print the median and 95th percentile of a set of latencies."""
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    print(f"{label:<40} median {statistics.median(latencies):9.1f} ms   p95 {p95:9.1f} ms")
+
+def main():
+    """Load the data, then time each query before and after indexing."""
+    args = parse_args()
+    service = CloudantV1(authenticator=BasicAuthenticator(args.username, args.password))
+    service.set_service_url(args.url)
+    service.set_http_config({'timeout': 600})
+
+    load_reviews(service, args)
+
+    # Without an index, only the unsorted query can run, as a scan of all documents
+    report('dealership (full scan)', time_queries(service, args, 'dealership', False))
+
+    for name, (ddoc, index_name, fields) in REVIEW_INDEXES.items():
+        started = time.monotonic()
+        service.post_index(
+            db=args.db, ddoc=ddoc, name=index_name, type='json',
+            index=IndexDefinition(fields=[IndexField(**{field: 'asc'}) for field in fields]))
+        # The first query waits for the index to be built
+        service.post_find(db=args.db, limit=1, **review_query(name, 1)).get_result()
+        print(f"Built index {index_name} in {time.monotonic() - started:.1f}s")
+        report(f'{name} (index {index_name})', time_queries(service, args, name, True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Module: rebuild_review_summaries.py
+
+Recompute every dealership summary of reviews.py from the reviews database.
+
+post_review keeps the summaries up to date as reviews arrive; this script builds
+them for reviews stored before summaries existed, or repairs them after a failed
+update. It reads the reviews database once, page by page.
+
+Usage:
+    python rebuild_review_summaries.py
+"""
+from ibm_cloud_sdk_core import ApiException
+from reviews import SUMMARY_DB, add_to_summary, empty_summary, service, summary_id
+
+PAGE_SIZE = 1000
+
+def iter_reviews():
+    """Yield every review document, reading the database one page at a time."""
+    start_key = None
+    while True:
+        page = service.post_all_docs(
+            db='reviews', include_docs=True, limit=PAGE_SIZE + 1, start_key=start_key,
+        ).get_result()['rows']
+        for row in page[:PAGE_SIZE]:
+            if not row['id'].startswith('_design/'):
+                yield row['doc']
+        if len(page) <= PAGE_SIZE:
+            return
+        start_key = page[PAGE_SIZE]['id']
+
+def main():
+    """Aggregate all reviews per dealership and overwrite the summary documents."""
+    summaries = {}
+    for review in iter_reviews():
+        if 'dealership' not in review:
+            continue
+        dealership_id = review['dealership']
+        if dealership_id not in summaries:
+            summaries[dealership_id] = empty_summary(dealership_id)
+        add_to_summary(summaries[dealership_id], review)
+
+    for dealership_id, summary in summaries.items():
+        try:
+            current = service.get_document(db=SUMMARY_DB, doc_id=summary_id(dealership_id))
+            summary['_rev'] = current.get_result()['_rev']
+        except ApiException as api_exception:
+            if api_exception.code != 404:
+                raise
+        service.put_document(db=SUMMARY_DB, doc_id=summary['_id'], document=summary)
+    print(f"Rebuilt {len(summaries)} dealership summaries")
+
+if __name__ == '__main__':
+    main()
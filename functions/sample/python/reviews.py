@@ -4,9 +4,22 @@ Module: reviews.py
 This module defines a Flask application for managing dealership reviews using Cloudant.
 """
 
-from ibmcloudant.cloudant_v1 import CloudantV1
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import requests
+from ibmcloudant.cloudant_v1 import BulkDocs, CloudantV1, IndexDefinition, IndexField
+from ibm_cloud_sdk_core import ApiException
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from flask import Flask, jsonify, request, abort
+try:
+    import brotli
+except ImportError:  # responses are then only compressed with gzip
+    brotli = None
 
 # Add your Cloudant service credentials here
 CLOUDANT_USERNAME = 'fa7eeb90-af89-4edb-84d5-37062403e29e-bluemix'
@@ -23,13 +36,229 @@ service.set_service_url(CLOUDANT_URL)
 
 app = Flask(__name__)
 
+# JSON responses smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def negotiate_encoding():
+    """Return the content coding to compress a response with: 'br', 'gzip' or None."""
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(supported)
+
+@app.after_request
+def compress_response(response):
+    """
+    Compress JSON responses with brotli or gzip, as accepted by the client.
+
+    The entity tag of a compressed response is made weak, since its bytes differ from
+    the uncompressed representation; If-None-Match uses the weak comparison, so
+    revalidation works the same whatever the encoding.
+    """
+    if response.mimetype != 'application/json' or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+    encoding = negotiate_encoding() if len(data) >= COMPRESS_MIN_SIZE else None
+    if encoding is None:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+# JSON indexes backing the queries of get_reviews:
+# query name -> (design document, index name, indexed fields)
+REVIEW_INDEXES = {
+    'dealership': ('reviews-by-dealership', 'dealership', ['dealership']),
+    'dealership_time': ('reviews-by-dealership-time', 'dealership-time', ['dealership', 'time']),
+}
+
+# Names of the queries that `explain` confirmed are answered from their index
+indexed_queries = set()
+indexes_lock = threading.Lock()
+
+# Seconds between two attempts to set up indexes that are still missing
+INDEX_CHECK_INTERVAL = 60
+index_check = {'checked_at': None, 'lock': threading.Lock()}
+
+def review_query(name, dealership_id, direction='asc'):
+    """
+    Build the post_find arguments of one of the get_reviews queries.
+
+    Args:
+        name: A key of REVIEW_INDEXES.
+        dealership_id: The dealership whose reviews are selected.
+        direction: 'asc' or 'desc', used by the time-ordered query.
+
+    Returns:
+        dict: The selector, sort and use_index arguments of the query.
+    """
+    ddoc, index_name, fields = REVIEW_INDEXES[name]
+    query = {
+        'selector': {'dealership': dealership_id},
+        'use_index': [ddoc, index_name],
+    }
+    if len(fields) > 1:
+        # Sorting on every indexed field lets the dealership+time index serve the order
+        query['sort'] = [{field: direction} for field in fields]
+    return query
+
+def ensure_indexes():
+    """
+    Create the indexes used by get_reviews and check that each query uses one.
+
+    Every query is run through `explain`; a query the database would answer by
+    scanning all documents is left out of `indexed_queries`, and get_reviews
+    refuses to serve it.
+
+    Returns:
+        set: The names of the queries that are backed by an index.
+    """
+    confirmed = set()
+    for name, (ddoc, index_name, fields) in REVIEW_INDEXES.items():
+        try:
+            service.post_index(
+                db='reviews',
+                ddoc=ddoc,
+                name=index_name,
+                type='json',
+                index=IndexDefinition(fields=[IndexField(**{field: 'asc'}) for field in fields]),
+            )
+            plan = service.post_explain(db='reviews', **review_query(name, 0)).get_result()
+        except ApiException as api_exception:
+            app.logger.error('Could not set up index %s: %s', index_name, api_exception)
+            continue
+        except requests.exceptions.RequestException as request_exception:
+            # The database is unreachable: no query can be confirmed
+            app.logger.error('Could not reach the reviews database: %s', request_exception)
+            break
+        if plan.get('index', {}).get('type') == 'json':
+            confirmed.add(name)
+        else:
+            app.logger.error('Query %s is not served by index %s', name, index_name)
+    with indexes_lock:
+        indexed_queries.clear()
+        indexed_queries.update(confirmed)
+    return confirmed
+
+@app.before_request
+def check_indexes():
+    """
+    Set up the indexes before the first request is served.
+
+    While some query is still not backed by an index, the check is retried at most
+    once every INDEX_CHECK_INTERVAL seconds.
+    """
+    with index_check['lock']:
+        checked_at = index_check['checked_at']
+        if checked_at is not None and (
+                len(indexed_queries) == len(REVIEW_INDEXES)
+                or time.monotonic() - checked_at < INDEX_CHECK_INTERVAL):
+            return
+        index_check['checked_at'] = time.monotonic()
+        ensure_indexes()
+
+# Page size used when the caller does not pass 'limit', and the largest one accepted
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
+
+# Accepted values of the 'sort' parameter: query name and direction
+SORT_ORDERS = {
+    None: ('dealership', 'asc'),
+    'time': ('dealership_time', 'asc'),
+    '-time': ('dealership_time', 'desc'),
+}
+
+def parse_page_args(args):
+    """
+    Validate the paging parameters of get_reviews.
+
+    Args:
+        args: The query parameters of the request.
+
+    Returns:
+        tuple: The page size, and the name and direction of the query to run.
+
+    Raises:
+        ValueError: With a message for the caller if a parameter is invalid.
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError as value_error:
+        raise ValueError("'limit' parameter must be an integer") from value_error
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"'limit' parameter must be between 1 and {MAX_PAGE_SIZE}")
+
+    sort = args.get('sort')
+    if sort not in SORT_ORDERS:
+        raise ValueError("'sort' parameter must be 'time' or '-time'")
+    query_name, direction = SORT_ORDERS[sort]
+    return limit, query_name, direction
+
+# Fields get_reviews always reads, to derive the entity tag of its response
+REVISION_FIELDS = ['_id', '_rev']
+
+# Response formats of get_reviews: a JSON array of documents, or compact columns
+RESPONSE_FORMATS = ('documents', 'columns')
+
+def columns_body(docs, fields=None):
+    """
+    Return documents in the compact columnar form: the field names, one list of
+    values per field, with null for documents without the field, and the number of
+    documents.
+
+    Args:
+        docs: The documents.
+        fields: The fields to return (default is every field found, in order of appearance).
+    """
+    if fields is None:
+        fields = list(dict.fromkeys(field for doc in docs for field in doc))
+    return {'fields': fields, 'columns': [[doc.get(field) for doc in docs] for field in fields],
+            'count': len(docs)}
+
+def revisions_etag(docs, *extra):
+    """Return an entity tag derived from the ids and revisions of documents."""
+    digest = hashlib.sha1()
+    for doc in docs:
+        digest.update(f"{doc.get('_id')}:{doc.get('_rev')}\n".encode('utf-8'))
+    for value in extra:
+        digest.update(f"{value}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def conditional(response, etag):
+    """Tag a response, and turn it into an empty 304 if the client holds that version."""
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
 @app.route('/api/get_reviews', methods=['GET'])
 def get_reviews():
     """
-    Get reviews for a dealership.
+    Get one page of reviews for a dealership.
+
+    Query parameters:
+        id: The dealership id (required).
+        limit: Number of reviews per page, 1 to MAX_PAGE_SIZE (default DEFAULT_PAGE_SIZE).
+        bookmark: The value of the X-Bookmark header of the previous page.
+        fields: Comma-separated list of the document fields to return.
+        format: 'documents' for a JSON array of reviews (the default), or 'columns'
+            for an object with the field names, one list of values per field and the
+            bookmark of the next page (see columns_body).
+        sort: 'time' for oldest first or '-time' for newest first. Only reviews
+            with a 'time' field are returned when sorting.
 
     Returns:
-        JSON response containing review data.
+        JSON response containing review data. When more reviews may follow, the
+        X-Bookmark response header holds the bookmark of the next page. The ETag
+        header is derived from the revisions of the reviews returned; a request whose
+        If-None-Match holds it gets an empty 304 response.
     """
     dealership_id = request.args.get('id')
 
@@ -43,30 +272,333 @@ def get_reviews():
     except ValueError:
         return jsonify({"error": "'id' parameter must be an integer"}), 400
 
+    try:
+        limit, query_name, direction = parse_page_args(request.args)
+    except ValueError as value_error:
+        return jsonify({"error": str(value_error)}), 400
+    response_format = request.args.get('format', 'documents')
+    if response_format not in RESPONSE_FORMATS:
+        return jsonify({"error": "'format' parameter must be 'documents' or 'columns'"}), 400
+
+    # Refuse queries that would scan the whole reviews database
+    if query_name not in indexed_queries:
+        return jsonify({"error": "Reviews index is not available"}), 503
+
     # Define the query based on the 'dealership' ID
-    selector = {
-        'dealership': dealership_id
-    }
+    query = review_query(query_name, dealership_id, direction)
+    query['limit'] = limit
+    if request.args.get('bookmark'):
+        query['bookmark'] = request.args['bookmark']
+    fields = None
+    if request.args.get('fields'):
+        fields = [field for field in request.args['fields'].split(',') if field]
+        query['fields'] = fields + [field for field in REVISION_FIELDS if field not in fields]
 
     # Execute the query using the find method
     result = service.post_find(
         db='reviews',
-        selector=selector,
+        **query,
     ).get_result()
 
     # Create a list to store the documents
     data_list = result['docs']
+    bookmark = result.get('bookmark') if len(data_list) == limit else None
+    etag = revisions_etag(data_list, bookmark, response_format)
+    if fields is not None:
+        data_list = [{field: doc[field] for field in fields if field in doc}
+                     for doc in data_list]
+
+    # Return the data as JSON, with the bookmark of the next page if it may not be empty
+    if response_format == 'columns':
+        response = jsonify(dict(columns_body(data_list, fields), bookmark=bookmark))
+    else:
+        response = jsonify(data_list)
+    if bookmark:
+        response.headers['X-Bookmark'] = bookmark
+    return conditional(response, etag)
+
+# Database holding one incrementally maintained summary document per dealership
+SUMMARY_DB = 'review_summaries'
+SUMMARY_RETRIES = 5
+SENTIMENT_LABELS = ('positive', 'neutral', 'negative')
+TOP_COUNT = 5
+
+def summary_id(dealership_id):
+    """Return the id of the summary document of a dealership."""
+    return f'dealer:{dealership_id}'
+
+def empty_summary(dealership_id):
+    """Return the summary of a dealership without any review."""
+    return {
+        '_id': summary_id(dealership_id),
+        'dealership': dealership_id,
+        'review_count': 0,
+        'purchase_count': 0,
+        'sentiments': {},
+        'makes': {},
+        'models': {},
+        'latest_time': None,
+    }
+
+def add_sentiment(summary, label):
+    """Count one review sentiment in a dealership summary; pending labels are skipped."""
+    if label in SENTIMENT_LABELS:
+        summary['sentiments'][label] = summary['sentiments'].get(label, 0) + 1
+
+def add_to_summary(summary, review):
+    """
+    Account for one new review in a dealership summary.
+
+    Args:
+        summary: The summary document, updated in place.
+        review: The review document.
+    """
+    summary['review_count'] += 1
+    if review.get('purchase'):
+        summary['purchase_count'] += 1
+    add_sentiment(summary, review.get('sentiment'))
+    make = review.get('car_make')
+    if make:
+        summary['makes'][make] = summary['makes'].get(make, 0) + 1
+        if review.get('car_model'):
+            model = f"{make} {review['car_model']}"
+            summary['models'][model] = summary['models'].get(model, 0) + 1
+    review_time = review.get('time')
+    if review_time and (summary['latest_time'] is None or review_time > summary['latest_time']):
+        summary['latest_time'] = review_time
+
+def create_summary_db():
+    """Create the summary database unless another writer already did."""
+    try:
+        service.put_database(db=SUMMARY_DB)
+    except ApiException as api_exception:
+        if api_exception.code != 412:
+            raise
+
+def update_summary(dealership_id, change):
+    """
+    Apply a change to the summary document of a dealership.
+
+    The document is read, changed and written back with its revision; when another
+    writer got there first, the update is retried on the new revision.
+
+    Args:
+        dealership_id: The dealership whose summary changes.
+        change: Function updating the summary dictionary in place.
+
+    Returns:
+        dict: The updated summary, or None if it could not be written.
+    """
+    for _ in range(SUMMARY_RETRIES):
+        try:
+            summary = service.get_document(
+                db=SUMMARY_DB, doc_id=summary_id(dealership_id)).get_result()
+        except ApiException as api_exception:
+            if api_exception.code != 404:
+                app.logger.error('Could not read summary %s: %s', dealership_id, api_exception)
+                return None
+            summary = empty_summary(dealership_id)
+        change(summary)
+        try:
+            service.put_document(db=SUMMARY_DB, doc_id=summary['_id'], document=summary)
+            return summary
+        except ApiException as api_exception:
+            if api_exception.code == 404:
+                # First summary ever written: create the database and try again
+                create_summary_db()
+            elif api_exception.code != 409:
+                app.logger.error('Could not write summary %s: %s', dealership_id, api_exception)
+                return None
+    app.logger.error('Gave up updating summary %s after %d conflicts',
+                     dealership_id, SUMMARY_RETRIES)
+    return None
+
+def top_counts(counts):
+    """Return the TOP_COUNT most frequent entries of a counter as [name, count] pairs."""
+    return [list(item) for item in
+            sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:TOP_COUNT]]
 
-    # Return the data as JSON
-    return jsonify(data_list)
+@app.route('/api/get_review_summary', methods=['GET'])
+def get_review_summary():
+    """
+    Get the precomputed review statistics of a dealership.
+
+    The statistics are read from a single summary document, so the cost does not
+    depend on how many reviews the dealership has.
+
+    Returns:
+        JSON response with the review count, purchase ratio, sentiment counts,
+        top makes and models, and the time of the most recent review, tagged with
+        the revision of the summary document.
+    """
+    try:
+        dealership_id = int(request.args['id'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "'id' parameter must be an integer"}), 400
+
+    try:
+        summary = service.get_document(
+            db=SUMMARY_DB, doc_id=summary_id(dealership_id)).get_result()
+    except ApiException as api_exception:
+        if api_exception.code != 404:
+            raise
+        summary = empty_summary(dealership_id)
+
+    review_count = summary['review_count']
+    response = jsonify({
+        'dealership': dealership_id,
+        'review_count': review_count,
+        'purchase_ratio': summary['purchase_count'] / review_count if review_count else 0.0,
+        'sentiments': {label: summary['sentiments'].get(label, 0) for label in SENTIMENT_LABELS},
+        'top_makes': top_counts(summary['makes']),
+        'top_models': top_counts(summary['models']),
+        'latest_time': summary['latest_time'],
+    })
+    # A dealership without reviews has no summary document, hence no revision
+    return conditional(response, revisions_etag([summary]))
+
+# Watson Natural Language Understanding, used to score reviews once, as they are posted.
+# Without NLU_API_KEY and NLU_URL the sentiment workers are not started, and posted
+# reviews stay pending until the service is restarted with them.
+NLU_API_KEY = os.environ.get('NLU_API_KEY', '')
+NLU_URL = os.environ.get('NLU_URL', '')
+NLU_VERSION = '2022-04-07'
+NLU_TIMEOUT = 10
+
+# Sentiment stored on a review until the worker has scored it
+PENDING = 'pending'
+SENTIMENT_WORKERS = 2
+SENTIMENT_ATTEMPTS = 3
+SENTIMENT_RETRY_DELAY = 5
+# Index listing the reviews still waiting for their sentiment
+PENDING_INDEX = ('reviews-by-sentiment', 'sentiment')
+PENDING_PAGE_SIZE = 200
+
+# Ids of the reviews to score, with the number of failed attempts so far
+sentiment_queue = queue.Queue()
+sentiment_workers = {'started': False, 'lock': threading.Lock()}
+
+def score_sentiment(text):
+    """
+    Ask NLU for the document sentiment of a review text.
+
+    Returns:
+        str: 'positive', 'neutral' or 'negative'.
+
+    Raises:
+        requests.exceptions.RequestException: If NLU cannot be reached or refuses the text.
+    """
+    response = requests.post(
+        f"{NLU_URL.rstrip('/')}/v1/analyze",
+        params={'version': NLU_VERSION},
+        json={'text': text, 'features': {'sentiment': {}}},
+        auth=('apikey', NLU_API_KEY),
+        timeout=NLU_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json()['sentiment']['document']['label']
+
+def score_review(doc_id):
+    """
+    Score a pending review, store the label on it and count it in its dealership summary.
+
+    Reviews that are no longer pending, because another worker got to them first,
+    are left alone.
+    """
+    label = None
+    for _ in range(SUMMARY_RETRIES):
+        review = service.get_document(db='reviews', doc_id=doc_id).get_result()
+        if review.get('sentiment') != PENDING:
+            return
+        if label is None:
+            label = score_sentiment(review['review'])
+        review['sentiment'] = label
+        try:
+            service.put_document(db='reviews', doc_id=doc_id, document=review)
+            break
+        except ApiException as api_exception:
+            if api_exception.code != 409:
+                raise
+    else:
+        app.logger.error('Gave up storing the sentiment of review %s after %d conflicts',
+                         doc_id, SUMMARY_RETRIES)
+        return
+    update_summary(review['dealership'], lambda summary: add_sentiment(summary, label))
+
+def sentiment_worker():
+    """Score the queued reviews one after the other, retrying failures later."""
+    while True:
+        doc_id, attempts = sentiment_queue.get()
+        try:
+            score_review(doc_id)
+        except Exception as exception:  # pylint: disable=broad-exception-caught
+            # Any failure, down to a malformed review, must not end the worker thread
+            attempts += 1
+            if attempts < SENTIMENT_ATTEMPTS:
+                # Retry later without holding up the reviews queued behind this one
+                threading.Timer(SENTIMENT_RETRY_DELAY * attempts, sentiment_queue.put,
+                                [(doc_id, attempts)]).start()
+            else:
+                # The review stays pending and is queued again when the service restarts
+                app.logger.error('Could not score review %s: %r', doc_id, exception)
+        finally:
+            sentiment_queue.task_done()
+
+def requeue_pending():
+    """Queue the reviews a previous run of the service accepted but did not score."""
+    ddoc, index_name = PENDING_INDEX
+    try:
+        service.post_index(
+            db='reviews',
+            ddoc=ddoc,
+            name=index_name,
+            type='json',
+            index=IndexDefinition(fields=[IndexField(sentiment='asc')]),
+        )
+        bookmark = None
+        while True:
+            result = service.post_find(
+                db='reviews', selector={'sentiment': PENDING}, fields=['_id'],
+                use_index=[ddoc, index_name], limit=PENDING_PAGE_SIZE, bookmark=bookmark,
+            ).get_result()
+            for doc in result['docs']:
+                sentiment_queue.put((doc['_id'], 0))
+            if len(result['docs']) < PENDING_PAGE_SIZE:
+                return
+            bookmark = result['bookmark']
+    except (ApiException, requests.exceptions.RequestException) as exception:
+        app.logger.error('Could not list the pending reviews: %s', exception)
+
+@app.before_request
+def start_sentiment_workers():
+    """Start the sentiment worker threads with the first request."""
+    with sentiment_workers['lock']:
+        if sentiment_workers['started']:
+            return
+        sentiment_workers['started'] = True
+    if not (NLU_API_KEY and NLU_URL):
+        app.logger.error('NLU_API_KEY and NLU_URL must be set to score review sentiments; '
+                         'the sentiment workers are not started')
+        return
+    for number in range(SENTIMENT_WORKERS):
+        threading.Thread(target=sentiment_worker, name=f'sentiment-{number}',
+                         daemon=True).start()
+    threading.Thread(target=requeue_pending, name='sentiment-requeue', daemon=True).start()
+
+# Fields every posted review must have
+REQUIRED_FIELDS = ['name', 'dealership', 'review',
+                   'purchase', 'purchase_date', 'car_make', 'car_model', 'car_year']
 
 @app.route('/api/post_review', methods=['POST'])
 def post_review():
     """
     Post a review for a dealership.
 
+    The review is stored with a "pending" sentiment and queued for the sentiment
+    workers, which replace it with the NLU label.
+
     Returns:
-        JSON response indicating success or error.
+        JSON response indicating success, with the id of the stored review, or error.
     """
     if not request.json:
         abort(400, description='Invalid JSON data')
@@ -75,19 +607,190 @@ def post_review():
     review_data = request.json
 
     # Validate that the required fields are present in the review data
-    required_fields = ['name', 'dealership', 'review',
-    'purchase', 'purchase_date', 'car_make', 'car_model', 'car_year']
-    for field in required_fields:
+    for field in REQUIRED_FIELDS:
         if field not in review_data:
             abort(400, description=f'Missing required field: {field}')
 
-    # Save the review data as a new document in the Cloudant database
-    service.post_document(
+    # Save the review data as a new document in the Cloudant database; its sentiment
+    # is computed once, in the background, instead of on every read
+    review_data['sentiment'] = PENDING
+    result = service.post_document(
         db='reviews',
         document=review_data,
-    )
+    ).get_result()
+    sentiment_queue.put((result['id'], 0))
+
+    # Account for the review in the summary of its dealership
+    update_summary(review_data['dealership'],
+                   lambda summary: add_to_summary(summary, review_data))
+
+    return jsonify({"message": "Review posted successfully", "id": result['id']}), 201
+
+
+# Reviews written per _bulk_docs call by post_reviews
+BULK_BATCH_SIZE = 500
+
+def iter_posted_reviews():
+    """
+    Yield the reviews of a post_reviews request with their position in it.
+
+    NDJSON bodies (Content-Type application/x-ndjson) are read line by line as they
+    arrive; any other body must be a JSON array.
+
+    Yields:
+        tuple: The position of the review, and the parsed review or None if that
+        line is not valid JSON.
+
+    Raises:
+        ValueError: If a non-NDJSON body is not a JSON array.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        index = 0
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError:
+                yield index, None
+            index += 1
+        return
+    reviews = request.get_json(silent=True)
+    if not isinstance(reviews, list):
+        raise ValueError('Body must be a JSON array or NDJSON')
+    yield from enumerate(reviews)
+
+def review_error(review):
+    """Return why a posted review cannot be stored, or None if it is valid."""
+    if not isinstance(review, dict):
+        return 'Review must be a JSON object'
+    missing = [field for field in REQUIRED_FIELDS if field not in review]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    return None
+
+def add_all_to_summary(summary, reviews):
+    """Account for several new reviews in a dealership summary."""
+    for review in reviews:
+        add_to_summary(summary, review)
+
+def write_batch(batch, report):
+    """
+    Store a batch of valid reviews with one _bulk_docs call.
+
+    Args:
+        batch: List of (position, review) pairs.
+        report: The post_reviews report, updated with the outcome of every review.
+    """
+    try:
+        results = service.post_bulk_docs(
+            db='reviews', bulk_docs=BulkDocs(docs=[review for _, review in batch]),
+        ).get_result()
+    except (ApiException, requests.exceptions.RequestException) as exception:
+        for index, _ in batch:
+            report['errors'].append({'index': index, 'error': f'Batch not written: {exception}'})
+        return
+
+    stored = {}
+    for (index, review), result in zip(batch, results):
+        if result.get('ok'):
+            report['accepted'] += 1
+            stored.setdefault(review['dealership'], []).append(review)
+            if review['sentiment'] == PENDING:
+                sentiment_queue.put((result['id'], 0))
+        else:
+            report['errors'].append({
+                'index': index, 'id': result.get('id'),
+                'error': result.get('error'), 'reason': result.get('reason'),
+            })
+
+    # One summary update per dealership of the batch rather than one per review
+    for dealership_id, reviews in stored.items():
+        update_summary(dealership_id,
+                       lambda summary, reviews=reviews: add_all_to_summary(summary, reviews))
+
+@app.route('/api/post_reviews', methods=['POST'])
+def post_reviews():
+    """
+    Post many reviews at once.
+
+    The body is a JSON array of reviews, or one review per line with the
+    application/x-ndjson content type. Reviews are validated like in post_review and
+    written in batches of BULK_BATCH_SIZE; invalid or rejected reviews are reported
+    without stopping the others. Reviews posted with a sentiment label keep it, the
+    others are queued for the sentiment workers.
+
+    Returns:
+        JSON response with the number of reviews received and accepted, and one
+        error per review that was not stored, identified by its position in the body.
+        The status is 201 when every review was stored and 200 otherwise.
+    """
+    report = {'received': 0, 'accepted': 0, 'errors': []}
+    batch = []
+    try:
+        for index, review in iter_posted_reviews():
+            report['received'] += 1
+            error = review_error(review)
+            if error:
+                report['errors'].append({'index': index, 'error': error})
+                continue
+            if review.get('sentiment') not in SENTIMENT_LABELS:
+                review['sentiment'] = PENDING
+            batch.append((index, review))
+            if len(batch) == BULK_BATCH_SIZE:
+                write_batch(batch, report)
+                batch = []
+    except ValueError as value_error:
+        return jsonify({"error": str(value_error)}), 400
+    if batch:
+        write_batch(batch, report)
+    return jsonify(report), 201 if not report['errors'] else 200
+
+# Changes returned per get_review_changes call, at most
+MAX_CHANGES = 1000
+
+@app.route('/api/get_review_changes', methods=['GET'])
+def get_review_changes():
+    """
+    List the reviews written or deleted since an update sequence of the database.
+
+    Services keeping their own copy of the reviews, like the search index of the
+    Django app, call this repeatedly with the last_seq of the previous call to follow
+    the database without reading it all again.
+
+    Query parameters:
+        since: Update sequence to start after (default "0", the beginning).
+        limit: Maximum number of changes to return (at most MAX_CHANGES).
+
+    Returns:
+        JSON response with one result per changed review (its id, whether it was
+        deleted, and its current document otherwise), the sequence to pass as
+        `since` next time, and the number of changes still pending after it.
+    """
+    since = request.args.get('since', '0')
+    try:
+        limit = min(max(int(request.args.get('limit', MAX_CHANGES)), 1), MAX_CHANGES)
+    except ValueError:
+        return jsonify({"error": "'limit' parameter must be an integer"}), 400
+
+    try:
+        changes = service.post_changes(
+            db='reviews', since=since, limit=limit, include_docs=True,
+        ).get_result()
+    except ApiException as api_exception:
+        if api_exception.code != 400:
+            raise
+        return jsonify({"error": "'since' parameter is not a valid update sequence"}), 400
 
-    return jsonify({"message": "Review posted successfully"}), 201
+    results = []
+    for change in changes['results']:
+        if change['id'].startswith('_design/'):
+            continue
+        deleted = change.get('deleted', False)
+        results.append({'id': change['id'], 'deleted': deleted,
+                        'doc': None if deleted else change.get('doc')})
+    return jsonify({'results': results, 'last_seq': changes['last_seq'],
+                    'pending': changes.get('pending', 0)})
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,425 @@
+"""
+Module: test_reviews.py
+
+Tests of the endpoints and workers of reviews.py, with the Cloudant service stubbed.
+
+Usage:
+    python -m unittest test_reviews
+"""
+import json
+import queue
+import threading
+import time
+import unittest
+from unittest import mock
+import requests
+from ibm_cloud_sdk_core import ApiException
+import reviews
+
+VALID_REVIEW = {
+    'name': 'Berkly Shepley', 'dealership': 15, 'review': 'Total grid-enabled service-desk',
+    'purchase': True, 'purchase_date': '07/11/2020', 'car_make': 'Audi',
+    'car_model': 'A6', 'car_year': 2010,
+}
+
+
+def review(**fields):
+    """Return a valid review, with some fields replaced."""
+    return dict(VALID_REVIEW, **fields)
+
+
+def bulk_results(bulk_docs, rejected=()):
+    """Return the _bulk_docs results of a batch, with errors for the `rejected` names."""
+    results = []
+    for number, doc in enumerate(bulk_docs.docs):
+        if doc['name'] in rejected:
+            results.append({'id': f'doc-{number}', 'error': 'forbidden', 'reason': 'Rejected'})
+        else:
+            results.append({'id': f"{doc['name']}-id", 'ok': True, 'rev': '1-a'})
+    return results
+
+
+class PostReviewsTests(unittest.TestCase):
+    """post_reviews validates every review, writes them in batches and reports each failure."""
+
+    def setUp(self):
+        self.service = mock.Mock()
+        self.service.post_bulk_docs.side_effect = lambda db, bulk_docs: mock.Mock(
+            get_result=mock.Mock(return_value=bulk_results(bulk_docs)))
+        self.summary_updates = []
+        self.queue = queue.Queue()
+        patches = [
+            mock.patch.object(reviews, 'service', self.service),
+            mock.patch.object(reviews, 'sentiment_queue', self.queue),
+            mock.patch.object(reviews, 'update_summary',
+                              lambda dealership, change: self.summary_updates.append(dealership)),
+            # No sentiment worker threads nor index setup in tests
+            mock.patch.dict(reviews.sentiment_workers, {'started': True}),
+            mock.patch.dict(reviews.index_check, {'checked_at': time.monotonic()}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = reviews.app.test_client()
+
+    def post_ndjson(self, lines):
+        """Post lines of NDJSON and return the status and the report."""
+        response = self.client.post('/api/post_reviews', data='\n'.join(lines) + '\n',
+                                    content_type='application/x-ndjson')
+        return response.status_code, response.get_json()
+
+    def test_all_stored(self):
+        """Valid reviews are all stored and queued for scoring."""
+        status, report = self.post_ndjson([json.dumps(review(name=f'R{number}'))
+                                           for number in range(3)])
+        self.assertEqual(status, 201)
+        self.assertEqual(report, {'received': 3, 'accepted': 3, 'errors': []})
+        self.assertEqual(self.queue.qsize(), 3)
+
+    def test_bad_line_is_reported_and_the_others_stored(self):
+        """A line that is not JSON is reported by position; blank lines are skipped."""
+        status, report = self.post_ndjson([json.dumps(review(name='A')), '{"name": "B",',
+                                           '', json.dumps(review(name='C'))])
+        self.assertEqual(status, 200)
+        self.assertEqual(report['received'], 3)
+        self.assertEqual(report['accepted'], 2)
+        self.assertEqual(report['errors'], [{'index': 1, 'error': 'Review must be a JSON object'}])
+
+    def test_missing_fields_are_listed(self):
+        """Reviews lacking required fields, or not objects, are reported and not written."""
+        incomplete = review(name='A')
+        del incomplete['car_year']
+        del incomplete['purchase_date']
+        status, report = self.post_ndjson([json.dumps(incomplete), json.dumps([1, 2])])
+        self.assertEqual(status, 200)
+        self.assertEqual(report['accepted'], 0)
+        self.assertEqual(report['errors'], [
+            {'index': 0, 'error': 'Missing required fields: purchase_date, car_year'},
+            {'index': 1, 'error': 'Review must be a JSON object'},
+        ])
+        self.service.post_bulk_docs.assert_not_called()
+
+    def test_reviews_are_written_in_batches(self):
+        """Reviews are written BULK_BATCH_SIZE at a time."""
+        with mock.patch.object(reviews, 'BULK_BATCH_SIZE', 2):
+            status, report = self.post_ndjson([json.dumps(review(name=f'R{number}'))
+                                               for number in range(5)])
+        self.assertEqual(status, 201)
+        self.assertEqual(report['accepted'], 5)
+        batches = [call.kwargs['bulk_docs'].docs
+                   for call in self.service.post_bulk_docs.call_args_list]
+        self.assertEqual([[doc['name'] for doc in docs] for docs in batches],
+                         [['R0', 'R1'], ['R2', 'R3'], ['R4']])
+        # One summary update per dealership and batch
+        self.assertEqual(self.summary_updates, [15, 15, 15])
+
+    def test_posted_sentiment_labels_are_kept(self):
+        """Known labels are kept; other reviews are stored pending and queued."""
+        self.post_ndjson([json.dumps(review(name='A', sentiment='negative')),
+                          json.dumps(review(name='B', sentiment='sarcastic'))])
+        docs = self.service.post_bulk_docs.call_args.kwargs['bulk_docs'].docs
+        self.assertEqual([doc['sentiment'] for doc in docs], ['negative', reviews.PENDING])
+        self.assertEqual(self.queue.get_nowait(), ('B-id', 0))
+        self.assertTrue(self.queue.empty())
+
+    def test_rejected_reviews_are_reported_with_their_position(self):
+        """Reviews the database rejects are reported with their position."""
+        self.service.post_bulk_docs.side_effect = lambda db, bulk_docs: mock.Mock(
+            get_result=mock.Mock(return_value=bulk_results(bulk_docs, rejected=('B',))))
+        status, report = self.post_ndjson([json.dumps(review(name=name)) for name in 'ABC'])
+        self.assertEqual(status, 200)
+        self.assertEqual(report['accepted'], 2)
+        self.assertEqual(report['errors'], [
+            {'index': 1, 'id': 'doc-1', 'error': 'forbidden', 'reason': 'Rejected'}])
+
+    def test_failed_batch_reports_each_of_its_reviews(self):
+        """A batch the database could not write reports every review of it."""
+        self.service.post_bulk_docs.side_effect = ApiException(500, message='Unavailable')
+        with mock.patch.object(reviews, 'BULK_BATCH_SIZE', 2):
+            status, report = self.post_ndjson([json.dumps(review(name=name)) for name in 'ABC'])
+        self.assertEqual(status, 200)
+        self.assertEqual(report['accepted'], 0)
+        self.assertEqual([error['index'] for error in report['errors']], [0, 1, 2])
+        self.assertEqual(self.summary_updates, [])
+
+    def test_json_array_body(self):
+        """A JSON array body is accepted too."""
+        response = self.client.post('/api/post_reviews',
+                                    json=[review(name='A'), {'name': 'B'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['accepted'], 1)
+
+    def test_body_that_is_neither_an_array_nor_ndjson(self):
+        """Any other body is refused."""
+        response = self.client.post('/api/post_reviews', json=review())
+        self.assertEqual(response.status_code, 400)
+
+
+
+class ServiceTestCase(unittest.TestCase):
+    """Base of the tests run against a stubbed Cloudant service, with every index in place."""
+
+    def setUp(self):
+        self.service = mock.Mock()
+        self.queue = queue.Queue()
+        patches = [
+            mock.patch.object(reviews, 'service', self.service),
+            mock.patch.object(reviews, 'sentiment_queue', self.queue),
+            mock.patch.object(reviews, 'indexed_queries', set(reviews.REVIEW_INDEXES)),
+            mock.patch.dict(reviews.sentiment_workers, {'started': True}),
+            mock.patch.dict(reviews.index_check, {'checked_at': time.monotonic()}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = reviews.app.test_client()
+
+
+def stored_review(number):
+    """Return a stored review document."""
+    return review(_id=f'r{number}', _rev='1-a', name=f'R{number}')
+
+
+class GetReviewsPageTests(ServiceTestCase):
+    """get_reviews returns one page of reviews, with the bookmark of the next one."""
+
+    def setUp(self):
+        super().setUp()
+        self.docs = [stored_review(number) for number in range(3)]
+        self.service.post_find.side_effect = lambda db, **query: mock.Mock(
+            get_result=mock.Mock(return_value={'docs': self.docs[:query['limit']],
+                                               'bookmark': 'next-page'}))
+
+    def get(self, query):
+        """Request a page and return the response and the query sent to the database."""
+        response = self.client.get(f'/api/get_reviews?{query}')
+        sent = self.service.post_find.call_args.kwargs if self.service.post_find.called else None
+        return response, sent
+
+    def test_default_page(self):
+        """Without parameters, a page of DEFAULT_PAGE_SIZE reviews of the dealership."""
+        response, sent = self.get('id=15')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sent['selector'], {'dealership': 15})
+        self.assertEqual(sent['limit'], reviews.DEFAULT_PAGE_SIZE)
+        self.assertEqual(sent['use_index'], ['reviews-by-dealership', 'dealership'])
+        self.assertEqual(len(response.get_json()), 3)
+        # A short page is the last one
+        self.assertNotIn('X-Bookmark', response.headers)
+
+    def test_full_page_gives_the_bookmark_of_the_next(self):
+        """A full page carries the bookmark, which the next request passes on."""
+        response, _ = self.get('id=15&limit=2')
+        self.assertEqual(response.headers['X-Bookmark'], 'next-page')
+        _, sent = self.get('id=15&limit=2&bookmark=next-page')
+        self.assertEqual(sent['bookmark'], 'next-page')
+
+    def test_fields(self):
+        """Only the requested fields are returned; the revisions are read for the ETag."""
+        response, sent = self.get('id=15&fields=name,review')
+        self.assertEqual(sent['fields'], ['name', 'review', '_id', '_rev'])
+        self.assertEqual(response.get_json()[0], {'name': 'R0', 'review': VALID_REVIEW['review']})
+
+    def test_columns_format(self):
+        """The columns format lists each field once, with the count and the bookmark."""
+        response, _ = self.get('id=15&limit=2&fields=name,car_year&format=columns')
+        self.assertEqual(response.get_json(), {
+            'fields': ['name', 'car_year'], 'columns': [['R0', 'R1'], [2010, 2010]],
+            'count': 2, 'bookmark': 'next-page'})
+        response, _ = self.get('id=15&format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_sorted_by_time(self):
+        """Time-ordered pages use the dealership and time index, in either direction."""
+        _, sent = self.get('id=15&sort=-time')
+        self.assertEqual(sent['sort'], [{'dealership': 'desc'}, {'time': 'desc'}])
+        self.assertEqual(sent['use_index'], ['reviews-by-dealership-time', 'dealership-time'])
+
+    def test_invalid_parameters(self):
+        """Bad ids, page sizes and sort orders are refused without a query."""
+        for query in ('', 'id=x', 'id=15&limit=0', 'id=15&limit=many',
+                      f'id=15&limit={reviews.MAX_PAGE_SIZE + 1}', 'id=15&sort=name'):
+            response, _ = self.get(query)
+            self.assertEqual(response.status_code, 400, query)
+        self.service.post_find.assert_not_called()
+
+
+
+def explained(index_type):
+    """Return a post_explain response naming the type of the index a query would use."""
+    return mock.Mock(get_result=mock.Mock(return_value={'index': {'type': index_type}}))
+
+
+class ReviewIndexTests(ServiceTestCase):
+    """Only the queries that explain shows to be served by an index are answered."""
+
+    def test_every_index_confirmed(self):
+        """Both indexes are created and both queries confirmed."""
+        self.service.post_explain.return_value = explained('json')
+        self.assertEqual(reviews.ensure_indexes(), {'dealership', 'dealership_time'})
+        self.assertEqual({call.kwargs['ddoc'] for call in self.service.post_index.call_args_list},
+                         {'reviews-by-dealership', 'reviews-by-dealership-time'})
+        self.assertEqual(reviews.indexed_queries, {'dealership', 'dealership_time'})
+
+    def test_query_scanning_every_document_is_refused(self):
+        """A query explain would answer from all documents is not served."""
+        self.service.post_explain.side_effect = lambda db, **query: explained(
+            'json' if 'sort' not in query else 'special')
+        self.assertEqual(reviews.ensure_indexes(), {'dealership'})
+        self.service.post_find.return_value = mock.Mock(
+            get_result=mock.Mock(return_value={'docs': []}))
+        self.assertEqual(self.client.get('/api/get_reviews?id=15&sort=time').status_code, 503)
+        self.assertEqual(self.client.get('/api/get_reviews?id=15').status_code, 200)
+
+    def test_failed_index_does_not_stop_the_others(self):
+        """An index the database refuses leaves the other queries confirmed."""
+        self.service.post_explain.return_value = explained('json')
+        self.service.post_index.side_effect = [ApiException(400, message='Bad index'), None]
+        self.assertEqual(reviews.ensure_indexes(), {'dealership_time'})
+
+    def test_unreachable_database_confirms_nothing(self):
+        """When the database cannot be reached, no query is confirmed."""
+        self.service.post_index.side_effect = requests.exceptions.ConnectionError()
+        self.assertEqual(reviews.ensure_indexes(), set())
+        self.assertEqual(self.service.post_index.call_count, 1)
+
+    def test_missing_indexes_are_checked_again_after_the_interval(self):
+        """Requests retry the index setup, at most once every INDEX_CHECK_INTERVAL."""
+        reviews.indexed_queries.clear()
+        self.service.get_document.side_effect = ApiException(404, message='Not found')
+        with mock.patch.object(reviews, 'ensure_indexes') as ensure_indexes:
+            self.client.get('/api/get_review_summary?id=15')
+            ensure_indexes.assert_not_called()
+            reviews.index_check['checked_at'] -= reviews.INDEX_CHECK_INTERVAL + 1
+            self.client.get('/api/get_review_summary?id=15')
+            ensure_indexes.assert_called_once_with()
+
+
+
+def document(doc):
+    """Return a get_document response holding a copy of a document."""
+    return mock.Mock(get_result=mock.Mock(return_value=json.loads(json.dumps(doc))))
+
+
+class UpdateSummaryTests(ServiceTestCase):
+    """Summary updates are read-modify-write, retried when another writer got there first."""
+
+    @staticmethod
+    def count_review(summary):
+        """Account for one purchase review of an Audi A6 in a summary."""
+        reviews.add_to_summary(summary, review(time='2026-10-01T10:00:00'))
+
+    def test_first_review_of_a_dealership(self):
+        """Without a summary document, one is started from the empty summary."""
+        self.service.get_document.side_effect = ApiException(404, message='Not found')
+        summary = reviews.update_summary(15, self.count_review)
+        self.assertEqual(summary['_id'], 'dealer:15')
+        self.assertEqual((summary['review_count'], summary['purchase_count']), (1, 1))
+        self.assertEqual(summary['models'], {'Audi A6': 1})
+        self.assertEqual(summary['latest_time'], '2026-10-01T10:00:00')
+
+    def test_conflict_is_retried_on_the_new_revision(self):
+        """After a conflict, the change is applied again to the document now stored."""
+        first = dict(reviews.empty_summary(15), _rev='1-a')
+        second = dict(first, _rev='2-b', review_count=4, purchase_count=2)
+        self.service.get_document.side_effect = [document(first), document(second)]
+        self.service.put_document.side_effect = [ApiException(409, message='Conflict'), None]
+        summary = reviews.update_summary(15, self.count_review)
+        self.assertEqual((summary['_rev'], summary['review_count']), ('2-b', 5))
+        self.assertEqual(self.service.put_document.call_count, 2)
+
+    def test_missing_database_is_created(self):
+        """The summary database is created by the first write, which is then retried."""
+        self.service.get_document.side_effect = ApiException(404, message='Not found')
+        self.service.put_document.side_effect = [ApiException(404, message='No database'), None]
+        self.assertIsNotNone(reviews.update_summary(15, self.count_review))
+        self.service.put_database.assert_called_once_with(db=reviews.SUMMARY_DB)
+
+    def test_gives_up_after_repeated_conflicts(self):
+        """Conflicts on every attempt give up after SUMMARY_RETRIES writes."""
+        self.service.get_document.side_effect = lambda db, doc_id: document(
+            reviews.empty_summary(15))
+        self.service.put_document.side_effect = ApiException(409, message='Conflict')
+        self.assertIsNone(reviews.update_summary(15, self.count_review))
+        self.assertEqual(self.service.put_document.call_count, reviews.SUMMARY_RETRIES)
+
+    def test_summary_endpoint(self):
+        """get_review_summary derives the ratio, sentiments and top cars from the summary."""
+        summary = reviews.empty_summary(15)
+        for label in ('positive', 'positive', 'negative'):
+            self.count_review(summary)
+            reviews.add_sentiment(summary, label)
+        self.service.get_document.return_value = document(dict(summary, _rev='3-c'))
+        body = self.client.get('/api/get_review_summary?id=15').get_json()
+        self.assertEqual(body['review_count'], 3)
+        self.assertEqual(body['purchase_ratio'], 1.0)
+        self.assertEqual(body['sentiments'], {'positive': 2, 'neutral': 0, 'negative': 1})
+        self.assertEqual(body['top_models'], [['Audi A6', 3]])
+
+
+
+class SentimentWorkerTests(ServiceTestCase):
+    """Pending reviews are scored once in the background, and found again after a restart."""
+
+    def test_pending_reviews_are_requeued_page_by_page(self):
+        """requeue_pending queues every pending review, following the bookmarks."""
+        pages = [{'docs': [{'_id': 'r0'}, {'_id': 'r1'}], 'bookmark': 'page-2'},
+                 {'docs': [{'_id': 'r2'}], 'bookmark': 'page-3'}]
+        self.service.post_find.side_effect = [
+            mock.Mock(get_result=mock.Mock(return_value=page)) for page in pages]
+        with mock.patch.object(reviews, 'PENDING_PAGE_SIZE', 2):
+            reviews.requeue_pending()
+        self.assertEqual([self.queue.get_nowait() for _ in range(3)],
+                         [('r0', 0), ('r1', 0), ('r2', 0)])
+        self.assertTrue(self.queue.empty())
+        finds = self.service.post_find.call_args_list
+        self.assertEqual([call.kwargs['bookmark'] for call in finds], [None, 'page-2'])
+        self.assertEqual(finds[0].kwargs['selector'], {'sentiment': reviews.PENDING})
+        self.assertEqual(self.service.post_index.call_args.kwargs['ddoc'],
+                         reviews.PENDING_INDEX[0])
+
+    def test_requeue_survives_an_unavailable_database(self):
+        """requeue_pending only logs when the pending reviews cannot be listed."""
+        self.service.post_find.side_effect = requests.exceptions.ConnectionError()
+        reviews.requeue_pending()
+        self.assertTrue(self.queue.empty())
+
+    def test_pending_review_is_scored_and_counted(self):
+        """The label is stored on the review and counted in its dealership summary."""
+        self.service.get_document.return_value = document(
+            dict(stored_review(0), sentiment=reviews.PENDING))
+        with mock.patch.object(reviews, 'score_sentiment', return_value='negative'), \
+                mock.patch.object(reviews, 'update_summary') as update_summary:
+            reviews.score_review('r0')
+        self.assertEqual(self.service.put_document.call_args.kwargs['document']['sentiment'],
+                         'negative')
+        summary = reviews.empty_summary(15)
+        update_summary.call_args.args[1](summary)
+        self.assertEqual(summary['sentiments'], {'negative': 1})
+
+    def test_review_already_scored_is_left_alone(self):
+        """A review another worker scored first is neither scored nor counted again."""
+        self.service.get_document.return_value = document(
+            dict(stored_review(0), sentiment='positive'))
+        with mock.patch.object(reviews, 'score_sentiment') as score_sentiment:
+            reviews.score_review('r0')
+        score_sentiment.assert_not_called()
+        self.service.put_document.assert_not_called()
+
+    def test_failures_are_retried_later_then_given_up(self):
+        """A failed review is queued again after a delay, up to SENTIMENT_ATTEMPTS times."""
+        with mock.patch.object(reviews, 'score_review', side_effect=KeyError('review')), \
+                mock.patch.object(reviews.threading, 'Timer') as timer:
+            worker = threading.Thread(target=reviews.sentiment_worker, daemon=True)
+            worker.start()
+            self.queue.put(('r0', 0))
+            self.queue.put(('r1', reviews.SENTIMENT_ATTEMPTS - 1))
+            self.queue.join()
+        # The worker is still running, and only the first review is retried
+        self.assertTrue(worker.is_alive())
+        timer.assert_called_once_with(reviews.SENTIMENT_RETRY_DELAY, self.queue.put,
+                                      [('r0', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
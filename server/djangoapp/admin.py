@@ -11,6 +11,10 @@ class CarModelInline(admin.StackedInline):
 # CarModelAdmin class
 class CarModelAdmin(admin.ModelAdmin):
     list_display = ['make', 'name', 'dealer_id', 'type', 'year']  # Fixed 'model_type' to 'type' here
+    # Read the makes of the listed cars in the same query
+    list_select_related = ['make']
+    # Filtered lists skip counting the whole inventory as well
+    show_full_result_count = False
     list_filter = ['type', 'make', 'dealer_id', 'year']
     search_fields = ['make__name', 'name']
 
@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class DjangoappConfig(AppConfig):
     name = 'djangoapp'
+
+    def ready(self):
+        # Car catalogs cached for the add review page follow admin changes to cars and makes
+        from .catalog import invalidate_car_catalog
+        from .db import check_connections, configure_sqlite
+        from .models import CarMake, CarModel
+        for model in (CarMake, CarModel):
+            for action, signal in (('save', post_save), ('delete', post_delete)):
+                signal.connect(invalidate_car_catalog, sender=model,
+                               dispatch_uid=f'car-catalog-{action}-{model.__name__}')
+        # Database profile of settings.DATABASE_PROFILE
+        connection_created.connect(configure_sqlite, dispatch_uid='configure-sqlite')
+        request_started.connect(check_connections, dispatch_uid='check-connections')
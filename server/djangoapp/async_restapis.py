@@ -0,0 +1,386 @@
+"""
+Module: async_restapis
+
+Async counterparts of the dealership and review service calls of `restapis`, for
+the views served under ASGI (uvicorn).
+
+While a sync worker waits on the dealership or review service it cannot serve
+anybody else. These coroutines use one ``httpx.AsyncClient`` per event loop, so a
+uvicorn worker keeps a single pool of keep-alive connections and serves other
+requests while the services respond.
+
+Functions:
+- get_client(): Return the pooled async HTTP client of the running event loop.
+- get_request(url, api_key=False, **kwargs): Make HTTP GET requests to the API.
+- iter_request(url, api_key=False, response_headers=None, **kwargs): Make an HTTP GET
+  request and yield the elements of its JSON array body as they arrive.
+- post_request(url, json_payload, **kwargs): Make HTTP POST requests to the API.
+- get_dealers_from_cf(url, **kwargs): Get a list of dealerships from the function.
+- get_dealer_index(url, stale_while_revalidate=False): Get the dealer list and its indexes
+  from the local dealership store, loading it with the async client when needed.
+- get_dealer_by_id(url, dealer_id): Get a specific dealership by ID.
+- get_nearest_dealers(url, lat, long, k=5, radius=None): Get the dealerships closest to
+  a location.
+- get_dealer_reviews_from_cf(url, dealer_id, limit=None, **kwargs): Get reviews for a
+  specific dealership from the cloud function.
+- get_dealer_reviews_page_from_cf(url, dealer_id, page_size=None, bookmark=None, sort=None):
+  Get one page of reviews for a specific dealership, with the bookmark of the next page.
+- get_dealer_review_summary(url, dealer_id): Get the precomputed review statistics of a
+  dealership.
+Usage:
+- Await these functions from async views; the sync ones in `restapis` remain for
+  management commands and other sync code.
+"""
+import asyncio
+import threading
+import weakref
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from .models import CarDealer, DealerReview
+from .restapis import (JSONArrayDecoder, REVIEW_FIELDS, dealer_store, objects_from_body,
+                       score_reviews)
+from .validator_cache import validator_cache
+
+# One client per event loop: a client and its connections cannot be shared between loops
+_clients = weakref.WeakKeyDictionary()
+# Per event loop, the locks serialising dealer list loads of each service URL
+_load_locks = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+def get_client():
+    """
+    Return the async HTTP client of the running event loop, creating it on first use.
+
+    Under uvicorn each worker runs one event loop, so every request of the worker
+    shares this client and its pool of up to ``settings.RESTAPI_ASYNC_MAX_CONNECTIONS``
+    connections. Connection failures are retried ``settings.RESTAPI_GET_RETRIES``
+    times; nothing has been sent at that point, so this is safe for POSTs too.
+
+    The client accepts gzip and, with the ``brotli`` package installed, brotli
+    compressed responses, and decodes them transparently.
+
+    Returns:
+        httpx.AsyncClient: The shared client.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _clients.get(loop)
+        if client is None:
+            transport = httpx.AsyncHTTPTransport(
+                retries=settings.RESTAPI_GET_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=settings.RESTAPI_ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=(
+                        settings.RESTAPI_POOL_HOSTS * settings.RESTAPI_POOL_SIZE),
+                ),
+            )
+            client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(settings.RESTAPI_READ_TIMEOUT,
+                                      connect=settings.RESTAPI_CONNECT_TIMEOUT),
+            )
+            _clients[loop] = client
+        return client
+
+def _load_lock(key):
+    """Return the asyncio lock serialising loads of one dealerships service URL."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        return _load_locks.setdefault(loop, {}).setdefault(key, asyncio.Lock())
+
+async def get_request(url, api_key=False, **kwargs):
+    """
+    Make an HTTP GET request to the specified URL.
+
+    Args:
+        url (str): The URL to send the GET request to.
+        api_key (str, optional): An API key for authentication (default is False).
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Returns:
+        dict or None: The decoded JSON response if the request is successful, or None
+        if an error occurs. Tagged responses are revalidated like in ``restapis``; on a
+        304 the body parsed last time is returned, which callers must not modify.
+    """
+    auth = ('apikey', api_key) if api_key else None
+    headers = {'Content-Type': 'application/json'}
+    headers.update(validator_cache.request_headers(url, kwargs))
+    try:
+        response = await get_client().get(url, headers=headers, params=kwargs, auth=auth)
+    except httpx.HTTPError as http_error:
+        print("Network exception occurred:", str(http_error))
+        return None
+
+    status_code = response.status_code
+    print("With status {} ".format(status_code))
+    if status_code == 304:
+        cached = validator_cache.not_modified(url, kwargs)
+        if cached is not None:
+            return cached.body
+    if status_code != 200:
+        print("Failed to fetch data. Status code:", status_code)
+        return None
+    json_data = response.json()
+    validator_cache.store(url, kwargs, response.headers.get('etag'), response.headers,
+                          json_data)
+    return json_data
+
+async def iter_request(url, api_key=False, response_headers=None, **kwargs):
+    """
+    Make an HTTP GET request and yield the elements of its JSON array body as they arrive.
+
+    Args:
+        url (str): The URL to send the GET request to.
+        api_key (str, optional): An API key for authentication (default is False).
+        response_headers (dict, optional): Filled with the response headers, under
+            lowercase names, once they have been received.
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Yields:
+        object: Each element of the JSON array returned by the URL. Nothing is yielded
+        if the request fails or does not return status 200. A tagged body read to the
+        end is revalidated next time, and on a 304 its elements are yielded again.
+    """
+    auth = ('apikey', api_key) if api_key else None
+    headers = {'Content-Type': 'application/json'}
+    headers.update(validator_cache.request_headers(url, kwargs))
+    try:
+        async with get_client().stream('GET', url, headers=headers,
+                                       params=kwargs, auth=auth) as response:
+            status_code = response.status_code
+            print("With status {} ".format(status_code))
+            cached = validator_cache.not_modified(url, kwargs) if status_code == 304 else None
+            if response_headers is not None:
+                if cached is not None:
+                    response_headers.update(cached.headers)
+                response_headers.update(response.headers.items())
+            if cached is not None:
+                for element in cached.body:
+                    yield element
+                return
+            if status_code != 200:
+                print("Failed to fetch data. Status code:", status_code)
+                return
+            # Keep the elements of a tagged body, to reuse them when it is not modified
+            etag = response.headers.get('etag')
+            elements = [] if etag else None
+            decoder = JSONArrayDecoder()
+            async for chunk in response.aiter_bytes(settings.RESTAPI_STREAM_CHUNK_SIZE):
+                for element in decoder.feed(chunk):
+                    if elements is not None:
+                        elements.append(element)
+                    yield element
+                if decoder.finished:
+                    break
+            else:
+                for element in decoder.feed(b'', final=True):
+                    if elements is not None:
+                        elements.append(element)
+                    yield element
+            # Only a body read to the end is kept
+            validator_cache.store(url, kwargs, etag, response.headers, elements)
+    except (ValueError, httpx.HTTPError) as stream_exception:
+        print("An error occurred while streaming the response:", str(stream_exception))
+
+async def post_request(url, json_payload, **kwargs):
+    """
+    Make an HTTP POST request to the specified URL with the review of a JSON payload.
+
+    Args:
+        url (str): The URL to send the POST request to.
+        json_payload (dict): A dictionary holding the review to post under 'review'.
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Returns:
+        httpx.Response or None: The response of the server, or None if it could not
+        be reached.
+    """
+    try:
+        response = await get_client().post(url, params=kwargs, json=json_payload['review'])
+        response.raise_for_status()
+    except httpx.HTTPStatusError as status_error:
+        print("An error occurred while making POST request:", str(status_error))
+        return status_error.response
+    except httpx.HTTPError as http_error:
+        print("An error occurred while making POST request:", str(http_error))
+        return None
+    return response
+
+async def _read_documents(url, max_documents=None, response_headers=None, **kwargs):
+    """Read up to `max_documents` elements of a JSON array response, then close it."""
+    documents = iter_request(url, response_headers=response_headers, **kwargs)
+    results = []
+    try:
+        async for document in documents:
+            results.append(document)
+            if max_documents is not None and len(results) >= max_documents:
+                break
+    finally:
+        await documents.aclose()
+    return results
+
+async def get_dealers_from_cf(url, **kwargs):
+    """
+    Retrieve the list of dealers from a cloud function.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Returns:
+        list: A list containing CarDealer objects, empty if the request fails.
+    """
+    if settings.RESTAPI_RESPONSE_FORMAT == 'columns':
+        body = await get_request(url, format='columns', fields=','.join(CarDealer.__slots__),
+                                 **kwargs)
+        return objects_from_body(CarDealer, body)
+    return CarDealer.from_dicts(await _read_documents(url, **kwargs))
+
+async def get_dealer_index(url, stale_while_revalidate=False):
+    """
+    Return the dealer list of a service with its indexes, from the local dealership store.
+
+    This is the async counterpart of ``dealer_store.index``: a copy the store can serve
+    is returned at once, otherwise one coroutine per event loop loads the list with the
+    async client while the others wait for its result.
+
+    Args:
+        url (str): The dealerships service URL.
+        stale_while_revalidate (bool, optional): Serve a copy past its TTL right away
+            and refresh it in the background (default is False).
+
+    Returns:
+        DealerIndex: The dealers and their lookup dictionaries, empty if no usable
+        copy could be loaded.
+    """
+    index = dealer_store.peek(url, stale_while_revalidate)
+    if index is not None:
+        return index
+
+    key = url.split('?', 1)[0]
+    async with _load_lock(key):
+        # Another request may have loaded the list while we were waiting
+        index = dealer_store.peek(url)
+        if index is not None:
+            return index
+        return dealer_store.install(url, await get_dealers_from_cf(key))
+
+async def get_dealer_by_id(url, dealer_id):
+    """
+    Retrieve a dealer by ID from the local dealership store.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        dealer_id (int): The ID of the dealer to retrieve.
+
+    Returns:
+        list: A list holding the CarDealer object with the given ID, or an empty list.
+    """
+    index = await get_dealer_index(url)
+    dealer = index.by_id.get(int(dealer_id))
+    return [dealer] if dealer is not None else []
+
+async def get_nearest_dealers(url, lat, long, k=5, radius=None):
+    """
+    Retrieve the dealers closest to a location from the local dealership store.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        lat (float): Latitude of the location, in degrees.
+        long (float): Longitude of the location, in degrees.
+        k (int, optional): Maximum number of dealers to return (default is 5).
+        radius (float, optional): Only return dealers within this many kilometres.
+
+    Returns:
+        list: Up to `k` (CarDealer, distance in km) pairs, closest first.
+    """
+    index = await get_dealer_index(url)
+    return index.geo.nearest(lat, long, k, radius)
+
+def _score_reviews_in_thread(results):
+    """Run score_reviews in a thread of the default executor, then release its connections."""
+    try:
+        return score_reviews(results)
+    finally:
+        # The thread is not a request thread: nothing else closes its database
+        # connection (of the sentiment cache) once it is too old or broken
+        close_old_connections()
+
+async def _score_reviews(results):
+    """Set the sentiment of the reviews stored without one."""
+    if any(review_obj.sentiment is None for review_obj in results):
+        # The sentiment cache and the NLU client are synchronous, and scoring may take
+        # up to SENTIMENT_DEADLINE. Django 3.1 runs every thread-sensitive sync_to_async
+        # call of a worker in one thread, so scoring there would hold up the sessions,
+        # the middleware and the rendering of every other request meanwhile.
+        return await sync_to_async(_score_reviews_in_thread, thread_sensitive=False)(results)
+    return results
+
+async def get_dealer_reviews_from_cf(url, dealer_id, limit=None, **kwargs):
+    """
+    Retrieve the reviews of a dealer from a cloud function.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        dealer_id (int): The ID of the dealer whose reviews are requested.
+        limit (int, optional): Maximum number of reviews to read (default is all of them).
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Returns:
+        list: A list containing DealerReview objects with their sentiment set.
+    """
+    documents = await _read_documents(url, limit, id=dealer_id, dealerId=dealer_id, **kwargs)
+    return await _score_reviews(DealerReview.from_dicts(documents))
+
+async def get_dealer_reviews_page_from_cf(url, dealer_id, page_size=None, bookmark=None,
+                                          sort=None):
+    """
+    Retrieve one page of the reviews of a dealer from a cloud function.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        dealer_id (int): The ID of the dealer whose reviews are requested.
+        page_size (int, optional): Number of reviews per page
+            (default is ``settings.REVIEWS_PAGE_SIZE``).
+        bookmark (str, optional): Bookmark returned with the previous page.
+        sort (str, optional): 'time' for oldest first or '-time' for newest first.
+
+    Returns:
+        tuple: The list of DealerReview objects of the page, and the bookmark of the next
+        page or None when this is the last one.
+    """
+    params = {
+        'limit': page_size or settings.REVIEWS_PAGE_SIZE,
+        'fields': ','.join(REVIEW_FIELDS),
+    }
+    if bookmark:
+        params['bookmark'] = bookmark
+    if sort:
+        params['sort'] = sort
+
+    if settings.RESTAPI_RESPONSE_FORMAT == 'columns':
+        body = await get_request(url, id=dealer_id, dealerId=dealer_id, format='columns',
+                                 **params)
+        bookmark = body.get('bookmark') if isinstance(body, dict) else None
+        return await _score_reviews(objects_from_body(DealerReview, body)), bookmark
+
+    response_headers = {}
+    documents = await _read_documents(url, response_headers=response_headers,
+                                      id=dealer_id, dealerId=dealer_id, **params)
+    reviews = await _score_reviews(DealerReview.from_dicts(documents))
+    return reviews, response_headers.get('x-bookmark')
+
+async def get_dealer_review_summary(url, dealer_id):
+    """
+    Retrieve the precomputed review summary of a dealer from the cloud function.
+
+    Args:
+        url (str): The URL of the review summary endpoint.
+        dealer_id (int): The ID of the dealer.
+
+    Returns:
+        dict or None: The summary, or None if the request fails.
+    """
+    return await get_request(url, id=dealer_id)
@@ -0,0 +1,142 @@
+"""
+Module: catalog
+
+The cars a dealership sells, as listed on its add review page.
+
+The page used to list every car in the database and read the make of each one
+with a query of its own. The catalog of a dealer is now read with one query on
+the ``carmodel_dealer_idx`` index: the cars with its ``dealer_id``, plus the cars
+not tied to any dealer, joined to their make and limited to the columns the page
+shows. It is kept as plain tuples in the Django cache named by
+``settings.CAR_CATALOG_CACHE_ALIAS``, a per-worker cache by default, so that
+showing the page or posting a review usually costs a single primary key lookup:
+the one of the catalog generation.
+
+Any save or deletion of a car or a make (in the admin site or elsewhere, see
+``DjangoappConfig.ready``) replaces the catalog generation, which is part of every
+key, so every dealer's catalog is read again on next use. The generation is kept
+in the cache named by ``settings.CAR_CATALOG_GENERATION_CACHE_ALIAS``, a database
+cache shared by every worker: an admin change reaches all of them, not only the
+one that served it. Being written on the connection of the change, it also
+changes within the same transaction.
+
+Usage:
+    from .catalog import car_catalog
+    cars = car_catalog.cars(dealer_id)
+    car = car_catalog.get_car(dealer_id, car_id)
+"""
+import threading
+import uuid
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from .models import CarModel
+
+# What the add review page needs to know about a car
+CatalogCar = namedtuple('CatalogCar', ['id', 'make', 'make_description', 'name', 'year'])
+
+GENERATION_KEY = 'car-catalog-generation'
+
+
+def catalog_queryset(dealer_id):
+    """
+    Return the cars sold by a dealer: those with its ``dealer_id`` and those with none.
+
+    The make is joined in the same query, and only the columns of a CatalogCar are
+    read, as tuples: building model instances took most of the time on large catalogs.
+    """
+    return (CarModel.objects
+            .filter(Q(dealer_id=dealer_id) | Q(dealer_id__isnull=True))
+            .order_by('id')
+            .values_list('id', 'make__name', 'make__description', 'name', 'year'))
+
+
+class CarCatalog:
+    """
+    Per-dealer car catalogs in a Django cache, with hit and miss counters.
+
+    Args:
+        alias (str, optional): Name of the Django cache holding the catalogs
+            (default is ``settings.CAR_CATALOG_CACHE_ALIAS``).
+        ttl (float, optional): Seconds a catalog is kept
+            (default is ``settings.CAR_CATALOG_TTL``).
+        generation_alias (str, optional): Name of the Django cache holding the
+            generation (default is ``settings.CAR_CATALOG_GENERATION_CACHE_ALIAS``).
+    """
+
+    def __init__(self, alias=None, ttl=None, generation_alias=None):
+        self._alias = alias
+        self._ttl = ttl
+        self._generation_alias = generation_alias
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @property
+    def cache(self):
+        """The Django cache holding the catalogs."""
+        return caches[self._alias or settings.CAR_CATALOG_CACHE_ALIAS]
+
+    @property
+    def generations(self):
+        """The Django cache holding the catalog generation, shared by the workers."""
+        return caches[self._generation_alias or settings.CAR_CATALOG_GENERATION_CACHE_ALIAS]
+
+    def _count(self, name):
+        """Increment one of the counters."""
+        with self._lock:
+            self._counters[name] += 1
+
+    def cars(self, dealer_id):
+        """
+        Return the catalog of a dealer.
+
+        Args:
+            dealer_id (int): The ID of the dealer.
+
+        Returns:
+            list: CatalogCar tuples, in the order the cars were added.
+        """
+        try:
+            generation = self.generations.get(GENERATION_KEY, 0)
+        except Exception as exception:
+            # Without the generation a cached catalog may be stale: read it afresh
+            print('An error occurred while reading the car catalog generation:', str(exception))
+            generation = None
+        key = f"car-catalog:{generation}:{int(dealer_id)}"
+        cars = self.cache.get(key) if generation is not None else None
+        if cars is not None:
+            self._count("hits")
+            return cars
+        self._count("misses")
+        cars = [CatalogCar(car_id, make or '', make_description or '', name, year)
+                for car_id, make, make_description, name, year in catalog_queryset(dealer_id)]
+        if generation is not None:
+            self.cache.set(key, cars, self._ttl or settings.CAR_CATALOG_TTL)
+        return cars
+
+    def get_car(self, dealer_id, car_id):
+        """Return the CatalogCar with the given ID in a dealer's catalog, or None."""
+        car_id = int(car_id)
+        return next((car for car in self.cars(dealer_id) if car.id == car_id), None)
+
+    def invalidate(self):
+        """Drop the catalog of every dealer, in every worker."""
+        # A new random generation rather than an increment: the database cache
+        # increments with a read and a write, which concurrent changes could interleave
+        self.generations.set(GENERATION_KEY, uuid.uuid4().hex, None)
+        self._count("invalidations")
+
+    def stats(self):
+        """Return a snapshot of the hit, miss and invalidation counters."""
+        with self._lock:
+            return dict(self._counters)
+
+
+# Process-wide catalog used by the views
+car_catalog = CarCatalog()
+
+
+def invalidate_car_catalog(sender, **kwargs):
+    """Signal receiver dropping the catalogs when a car or a make is saved or deleted."""
+    car_catalog.invalidate()
@@ -0,0 +1,168 @@
+"""
+Module: circuit_breaker
+
+Circuit breaker shielding the views from a degraded remote dependency.
+
+The breaker watches the outcome and latency of the calls made through it over a
+rolling window. Once enough of them fail or are slow, it opens: calls are refused
+at once, and callers fall back to a default, instead of each of them waiting out a
+timeout. After a cool-down it lets a few probe calls through (half-open); their
+success closes it again, a failure opens it for another cool-down.
+
+Usage:
+    from .circuit_breaker import CircuitBreaker
+    breaker = CircuitBreaker('nlu')
+    if breaker.allow():
+        started = time.monotonic()
+        try:
+            result = call()
+        except Exception:
+            breaker.record(False, time.monotonic() - started)
+            raise
+        breaker.record(True, time.monotonic() - started)
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker with a time-based rolling window.
+
+    A call is bad when it fails or takes longer than ``slow_call`` seconds. The
+    breaker opens when, among at least ``min_calls`` calls of the last ``window``
+    seconds, the share of bad calls reaches ``failure_rate``.
+
+    Args:
+        name (str): Name of the protected dependency, used in log messages.
+        window (float): Seconds of history the rates are computed on.
+        min_calls (int): Calls needed in the window before the breaker may open.
+        failure_rate (float): Share of bad calls opening the breaker, from 0 to 1.
+        slow_call (float): Seconds past which a successful call still counts as bad.
+        open_seconds (float): Seconds the breaker stays open before probing.
+        probes (int): Calls let through at once while half-open.
+        clock (callable, optional): Monotonic clock (default is ``time.monotonic``).
+    """
+
+    def __init__(self, name, window=30, min_calls=10, failure_rate=0.5, slow_call=2.0,
+                 open_seconds=30, probes=1, clock=time.monotonic):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (time, bad, latency) of the calls of the window, oldest first
+        self._calls = deque()
+        self._state = CLOSED
+        self._opened_at = None
+        self._probes_running = 0
+        self._counters = {"short_circuited": 0, "opened": 0}
+
+    def _trim(self, now):
+        """Forget the calls older than the window."""
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _open(self, now):
+        """Open the breaker; called with the lock held."""
+        self._state = OPEN
+        self._opened_at = now
+        self._probes_running = 0
+        self._counters["opened"] += 1
+        print(f"Circuit breaker {self.name} opened for {self.open_seconds}s")
+
+    @property
+    def state(self):
+        """"closed", "open" or "half_open"."""
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        Return whether a call may be made now.
+
+        While half-open, a True answer reserves one of the probes, so the caller must
+        report the call with `record`.
+        """
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+                self._state = HALF_OPEN
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_running < self.probes:
+                self._probes_running += 1
+                return True
+            self._counters["short_circuited"] += 1
+            return False
+
+    def record(self, ok, latency):
+        """
+        Report the outcome of a call let through by `allow`.
+
+        Args:
+            ok (bool): Whether the call succeeded.
+            latency (float): Seconds the call took.
+        """
+        now = self._clock()
+        bad = not ok or latency > self.slow_call
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_running = max(self._probes_running - 1, 0)
+                if bad:
+                    self._open(now)
+                else:
+                    # The dependency recovered: start over with a clean window
+                    self._state = CLOSED
+                    self._calls.clear()
+                    print(f"Circuit breaker {self.name} closed")
+                return
+            if self._state == OPEN:
+                # A call started before the breaker opened
+                return
+            self._calls.append((now, bad, latency))
+            self._trim(now)
+            if len(self._calls) >= self.min_calls:
+                bad_calls = sum(1 for _, call_bad, _ in self._calls if call_bad)
+                if bad_calls >= self.failure_rate * len(self._calls):
+                    self._open(now)
+
+    def release(self):
+        """
+        Report a call let through by `allow` that says nothing of the dependency's
+        health, such as one the caller cut short or gave up on. It frees its probe,
+        if any, and is left out of the window.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_running = max(self._probes_running - 1, 0)
+
+    def stats(self):
+        """Return the state, the rates of the window and the short-circuit counters."""
+        state = self.state
+        with self._lock:
+            self._trim(self._clock())
+            calls = len(self._calls)
+            failures = sum(1 for _, bad, _ in self._calls if bad)
+            latency = sum(call_latency for _, _, call_latency in self._calls)
+            return dict(self._counters, state=state, calls=calls,
+                        failure_rate=failures / calls if calls else 0.0,
+                        mean_latency=latency / calls if calls else 0.0)
+
+    def reset(self):
+        """Close the breaker and forget every call."""
+        with self._lock:
+            self._state = CLOSED
+            self._calls.clear()
+            self._opened_at = None
+            self._probes_running = 0
@@ -0,0 +1,53 @@
+"""
+Module: db
+
+Connection setup of the database profiles of ``settings.DATABASE_PROFILE``.
+
+- `configure_sqlite` runs ``settings.SQLITE_PRAGMAS`` on every new SQLite connection
+  of the "sqlite-wal" profile. In WAL mode, readers and the writer no longer block
+  each other; only writers still wait for one another, up to the ``timeout`` of
+  the database OPTIONS.
+- `check_connections` gives persistent connections (``CONN_MAX_AGE``) a health check
+  when a request starts: a connection the server dropped, say on a database
+  restart or a PgBouncer reload, is closed and reopened by the request instead of
+  failing it. Django 3.1 has no ``CONN_HEALTH_CHECKS`` setting to do this. The
+  check is a ``SELECT 1`` round trip, so it is off by default and, when on, runs
+  at most once every ``settings.DATABASE_HEALTH_CHECK_INTERVAL`` seconds per
+  connection. Connections on which an error occurred are already probed by
+  Django's ``close_old_connections``.
+
+Both are signal receivers connected by ``DjangoappConfig.ready``.
+"""
+import time
+from django.conf import settings
+from django.db import connections
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Run the profile's pragmas on a new SQLite connection."""
+    if connection.vendor != 'sqlite' or settings.DATABASE_PROFILE != 'sqlite-wal':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def check_connections(**kwargs):
+    """Close the persistent connections that are no longer usable, as a request starts."""
+    if not settings.DATABASE_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict['CONN_MAX_AGE']:
+            continue
+        # A connection inside a transaction (a test case for instance) is left alone
+        if connection.in_atomic_block:
+            continue
+        now = time.monotonic()
+        checked_at = getattr(connection, 'health_checked_at', None)
+        if checked_at is not None and now - checked_at < settings.DATABASE_HEALTH_CHECK_INTERVAL:
+            continue
+        if connection.is_usable():
+            connection.health_checked_at = now
+        else:
+            connection.close()
+            connection.health_checked_at = None
@@ -0,0 +1,265 @@
+"""
+Module: dealer_store
+
+In-process, read-through store for the dealership list.
+
+Dealerships hardly ever change, yet every page used to fetch them again from the
+dealerships service. The store keeps the last list returned by the service,
+indexed by dealer ``id`` and by state code ``st``, and reloads it once it is older
+than ``settings.DEALER_STORE_TTL`` seconds. Loads are single-flight: when the
+cache is cold or expired, one thread fetches from upstream while the others wait
+for its result instead of issuing their own requests. Each loaded list also gets
+a `geo.DealerGeoIndex` for nearest-dealer queries, and a content version that
+changes whenever the list does, for the caches and entity tags of the pages
+showing it. A reload returning the same list, as when the service answers
+304 Not Modified, keeps the indexes already built and only renews their TTL.
+
+In stale-while-revalidate mode, a list past its TTL is served immediately while
+one background thread refreshes it, and the last good copy keeps being served
+while upstream fails, up to ``settings.DEALER_STORE_HARD_TTL`` seconds. No copy
+older than the hard TTL is ever served.
+
+Usage:
+    from .restapis import dealer_store
+    dealer = dealer_store.get_by_id(url, 15)
+"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from django.conf import settings
+from .geo import DealerGeoIndex
+
+# One loaded copy of the dealer list with its indexes
+DealerIndex = namedtuple('DealerIndex',
+                         ['dealers', 'by_id', 'by_state', 'geo', 'version', 'loaded_at'])
+
+EMPTY_INDEX = DealerIndex(dealers=[], by_id={}, by_state={}, geo=DealerGeoIndex([]),
+                          version='', loaded_at=0.0)
+
+
+def dealer_version(dealer):
+    """Return the fields of a dealer as a tuple, which changes whenever the dealer does."""
+    return tuple(getattr(dealer, field) for field in dealer.__slots__)
+
+
+def list_version(dealers):
+    """Return a hash of the content of a dealer list."""
+    digest = hashlib.sha256()
+    for dealer in dealers:
+        digest.update(repr(dealer_version(dealer)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_index(dealers, loaded_at, version=None):
+    """
+    Index a list of dealers by id, by state code and by location.
+
+    Args:
+        dealers (list): CarDealer objects.
+        loaded_at (float): ``time.monotonic()`` value of the load.
+        version (str, optional): `list_version` of the dealers, if already computed.
+
+    Returns:
+        DealerIndex: The dealers and their lookup dictionaries.
+    """
+    by_id = {}
+    by_state = {}
+    for dealer in dealers:
+        by_id[int(dealer.id)] = dealer
+        by_state.setdefault(str(dealer.st).upper(), []).append(dealer)
+    return DealerIndex(dealers=dealers, by_id=by_id, by_state=by_state,
+                       geo=DealerGeoIndex(dealers), version=version or list_version(dealers),
+                       loaded_at=loaded_at)
+
+
+class DealerStore:
+    """
+    TTL-refreshed dealer list with id and state indexes, one per service URL.
+
+    Args:
+        loader (callable): Function taking the service URL and returning the full
+            list of CarDealer objects (an empty list on failure).
+        ttl (float, optional): Seconds before a loaded list is refreshed
+            (default is ``settings.DEALER_STORE_TTL``).
+        hard_ttl (float, optional): Seconds after which a list is never served again
+            (default is ``settings.DEALER_STORE_HARD_TTL``).
+    """
+
+    def __init__(self, loader, ttl=None, hard_ttl=None):
+        self._loader = loader
+        self._ttl = ttl
+        self._hard_ttl = hard_ttl
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._load_locks = {}
+        self._counters = {"hits": 0, "loads": 0, "unchanged_loads": 0, "failed_loads": 0,
+                          "stale_served": 0, "background_refreshes": 0}
+
+    @property
+    def ttl(self):
+        """Seconds a loaded list stays fresh."""
+        return self._ttl or settings.DEALER_STORE_TTL
+
+    @property
+    def hard_ttl(self):
+        """Seconds a loaded list may be served at all."""
+        return self._hard_ttl or settings.DEALER_STORE_HARD_TTL
+
+    @staticmethod
+    def age(index):
+        """Return the age in seconds of a loaded index, or None for an empty one."""
+        if not index.loaded_at:
+            return None
+        return time.monotonic() - index.loaded_at
+
+    @staticmethod
+    def _key(url):
+        """Identify a service by its URL without any query string."""
+        return url.split('?', 1)[0]
+
+    def _is_fresh(self, index, now):
+        """Tell whether a loaded index is still within its TTL."""
+        return index is not None and now - index.loaded_at < self.ttl
+
+    def _is_usable(self, index, now):
+        """Tell whether a loaded index is still within its hard TTL."""
+        return index is not None and now - index.loaded_at < self.hard_ttl
+
+    def _count(self, name):
+        """Increment one of the counters."""
+        with self._lock:
+            self._counters[name] += 1
+
+    def _load_lock(self, key):
+        """Return the lock serialising loads of one service URL."""
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def peek(self, url, stale_while_revalidate=False):
+        """
+        Return the index of a service if it can be served without waiting for upstream.
+
+        Args:
+            url (str): The dealerships service URL.
+            stale_while_revalidate (bool, optional): Also return a copy past its TTL,
+                starting a background refresh (default is False).
+
+        Returns:
+            DealerIndex or None: The loaded index, or None if it must be loaded first.
+        """
+        key = self._key(url)
+        index = self._indexes.get(key)
+        now = time.monotonic()
+        if self._is_fresh(index, now):
+            self._count("hits")
+            return index
+        if stale_while_revalidate and self._is_usable(index, now):
+            self._count("stale_served")
+            self._refresh_in_background(key)
+            return index
+        return None
+
+    def index(self, url, stale_while_revalidate=False):
+        """
+        Return the current index for a service, loading it if needed.
+
+        Args:
+            url (str): The dealerships service URL.
+            stale_while_revalidate (bool, optional): Serve a copy past its TTL right away
+                and refresh it in the background instead of waiting for upstream
+                (default is False).
+
+        Returns:
+            DealerIndex: The freshest index available. If a reload fails, the
+            previous copy keeps being served until it reaches the hard TTL; with no
+            usable copy at all the index is empty.
+        """
+        index = self.peek(url, stale_while_revalidate)
+        if index is not None:
+            return index
+
+        key = self._key(url)
+        with self._load_lock(key):
+            # Another thread may have loaded the list while we were waiting
+            index = self.peek(url)
+            if index is not None:
+                return index
+            return self.install(url, self._loader(key))
+
+    def install(self, url, dealers):
+        """
+        Store a freshly loaded dealer list, for loads made outside the store.
+
+        Args:
+            url (str): The dealerships service URL.
+            dealers (list): The CarDealer objects returned by the service; an empty
+                list counts as a failed load and keeps the previous copy.
+
+        Returns:
+            DealerIndex: The index to serve, which is empty if there is no usable copy.
+        """
+        index = self._store(self._key(url), dealers)
+        if self._is_usable(index, time.monotonic()):
+            return index
+        return EMPTY_INDEX
+
+    def _store(self, key, dealers):
+        """Index and keep a loaded dealer list; return the index now held for the key."""
+        version = list_version(dealers) if dealers else None
+        with self._lock:
+            current = self._indexes.get(key)
+            if dealers and current is not None and current.version == version:
+                # Same list as before (typically a 304 from the service): keep its indexes
+                self._indexes[key] = current._replace(loaded_at=time.monotonic())
+                self._counters["unchanged_loads"] += 1
+            elif dealers:
+                self._indexes[key] = build_index(dealers, time.monotonic(), version)
+                self._counters["loads"] += 1
+            else:
+                self._counters["failed_loads"] += 1
+            return self._indexes.get(key)
+
+    def _refresh_in_background(self, key):
+        """Start a background reload unless one is already running for this service."""
+        load_lock = self._load_lock(key)
+        if not load_lock.acquire(blocking=False):
+            return
+
+        def refresh():
+            try:
+                self._store(key, self._loader(key))
+            finally:
+                load_lock.release()
+
+        self._count("background_refreshes")
+        threading.Thread(target=refresh, name='dealer-store-refresh', daemon=True).start()
+
+    def get_all(self, url, stale_while_revalidate=False):
+        """Return every dealer of a service."""
+        return self.index(url, stale_while_revalidate).dealers
+
+    def get_by_id(self, url, dealer_id):
+        """Return the dealer with the given id, or None."""
+        return self.index(url).by_id.get(int(dealer_id))
+
+    def get_by_state(self, url, state):
+        """Return the dealers in the given state code (for example "TX")."""
+        return list(self.index(url).by_state.get(str(state).upper(), []))
+
+    def get_nearest(self, url, lat, long, k=5, radius=None):
+        """Return up to `k` (dealer, distance in km) pairs closest to a point."""
+        return self.index(url).geo.nearest(lat, long, k, radius)
+
+    def stats(self):
+        """Return a snapshot of the hit, load, unchanged load and stale-serving counters."""
+        with self._lock:
+            return dict(self._counters)
+
+    def invalidate(self, url=None):
+        """Drop the loaded list of one service, or of every service."""
+        with self._lock:
+            if url is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(self._key(url), None)
@@ -0,0 +1,109 @@
+"""
+Module: fragment_cache
+
+Cache of rendered template fragments, keyed by a content version.
+
+The dealer table of the index page and the dealer information and review cards of
+the dealer page do not depend on who is looking at them, and change only when the
+dealer list or a dealer's reviews do. Views render them once per version of their
+content (for instance the review count and latest review time of a dealer), store
+the HTML in the Django cache named by ``settings.FRAGMENT_CACHE_ALIAS`` and embed it
+in the page around the user-specific parts, such as the navbar.
+
+Each fragment belongs to a scope, like a dealer id. `invalidate` drops every
+fragment of a scope at once by bumping the generation stored for it, which is part
+of every key.
+
+Usage:
+    from .fragment_cache import fragment_cache
+    key = fragment_cache.key('dealer_reviews', dealer_id, version)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = fragment_cache.set(key, render_to_string(template_name, context))
+    fragment_cache.invalidate('dealer_reviews', dealer_id)
+"""
+import hashlib
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.safestring import mark_safe
+
+
+class FragmentCache:
+    """
+    Rendered fragments in a Django cache, with hit and miss counters.
+
+    Args:
+        alias (str, optional): Name of the Django cache holding the fragments
+            (default is ``settings.FRAGMENT_CACHE_ALIAS``).
+        ttl (float, optional): Seconds a rendered fragment is kept
+            (default is ``settings.FRAGMENT_CACHE_TTL``).
+    """
+
+    def __init__(self, alias=None, ttl=None):
+        self._alias = alias
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @property
+    def cache(self):
+        """The Django cache holding the fragments."""
+        return caches[self._alias or settings.FRAGMENT_CACHE_ALIAS]
+
+    @staticmethod
+    def _generation_key(name, scope):
+        """Return the cache key of the generation of a scope."""
+        return f"fragment-generation:{name}:{scope}"
+
+    def _count(self, name):
+        """Increment one of the counters."""
+        with self._lock:
+            self._counters[name] += 1
+
+    def key(self, name, scope, version):
+        """
+        Return the cache key of one version of a fragment.
+
+        Args:
+            name (str): Name of the fragment, such as "dealer_reviews".
+            scope: What the fragment is about, such as a dealer id.
+            version: Any value, with a stable ``repr``, that changes whenever the
+                content of the fragment does.
+
+        Returns:
+            str: The key, which also serves as an entity tag of the fragment.
+        """
+        generation = self.cache.get(self._generation_key(name, scope), 0)
+        digest = hashlib.sha256(repr(version).encode('utf-8')).hexdigest()[:32]
+        return f"fragment:{name}:{scope}:{generation}:{digest}"
+
+    def get(self, key):
+        """Return the rendered fragment stored under a key, or None."""
+        html = self.cache.get(key)
+        self._count("hits" if html is not None else "misses")
+        return mark_safe(html) if html is not None else None
+
+    def set(self, key, html):
+        """Store a rendered fragment under a key and return it, ready to embed."""
+        self.cache.set(key, str(html), self._ttl or settings.FRAGMENT_CACHE_TTL)
+        return mark_safe(html)
+
+    def invalidate(self, name, scope):
+        """Drop every cached version of the fragments of a scope."""
+        generation_key = self._generation_key(name, scope)
+        try:
+            self.cache.incr(generation_key)
+        except ValueError:
+            # incr only works on existing keys; the generation is 0 when absent
+            self.cache.set(generation_key, 1, None)
+        self._count("invalidations")
+
+    def stats(self):
+        """Return a snapshot of the hit, miss and invalidation counters."""
+        with self._lock:
+            return dict(self._counters)
+
+
+# Process-wide fragment cache used by the views
+fragment_cache = FragmentCache()
@@ -0,0 +1,185 @@
+"""
+Module: geo
+
+In-memory spatial index answering "dealers near me" queries over the dealer list.
+
+Dealers are bucketed into a latitude/longitude grid and stored sorted by cell, so
+that the dealers of a run of cells in one grid row are one contiguous slice of
+NumPy arrays. A query looks at a box of cells around the query point, computes
+haversine distances for that box only, and grows the box until no dealer outside
+it can be closer than the k-th dealer found.
+
+Usage:
+    from .geo import DealerGeoIndex
+    geo_index = DealerGeoIndex(dealers)
+    for dealer, distance_km in geo_index.nearest(32.78, -96.8, k=5, radius=100):
+        ...
+"""
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Average number of dealers per grid cell aimed for when sizing the grid
+DEALERS_PER_CELL = 8
+MIN_CELL_DEGREES = 0.01
+MAX_CELL_DEGREES = 10.0
+
+
+def haversine_km(lat, long, lats, longs):
+    """
+    Return the great-circle distances in kilometres from one point to many.
+
+    Args:
+        lat (float): Latitude of the origin, in degrees.
+        long (float): Longitude of the origin, in degrees.
+        lats (numpy.ndarray): Latitudes of the destinations, in degrees.
+        longs (numpy.ndarray): Longitudes of the destinations, in degrees.
+
+    Returns:
+        numpy.ndarray: The distance to every destination.
+    """
+    lat, long = math.radians(lat), math.radians(long)
+    lats, longs = np.radians(lats), np.radians(longs)
+    half_chord = (np.sin((lats - lat) / 2) ** 2
+                  + math.cos(lat) * np.cos(lats) * np.sin((longs - long) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(half_chord, 1.0)))
+
+
+class DealerGeoIndex:
+    """
+    Grid index of dealers by location.
+
+    Dealers whose ``lat`` or ``long`` is missing or not a number are left out.
+
+    Args:
+        dealers (list): CarDealer objects.
+        cell_degrees (float, optional): Size of a grid cell in degrees (default is
+            chosen from the number of dealers and the area they cover), rounded down
+            to a divisor of 360.
+    """
+
+    def __init__(self, dealers, cell_degrees=None):
+        located = []
+        for dealer in dealers:
+            try:
+                lat, long = float(dealer.lat), float(dealer.long)
+            except (TypeError, ValueError):
+                continue
+            if -90 <= lat <= 90 and -180 <= long <= 180:
+                located.append((dealer, lat, long))
+
+        lats = np.array([lat for _, lat, _ in located], dtype=float)
+        longs = np.array([long for _, _, long in located], dtype=float)
+        # Whole columns around the globe: wrapping columns at the antimeridian must
+        # cover as many degrees as it does elsewhere for the distance bound to hold
+        self._cols = int(math.ceil(360 / (cell_degrees or self._cell_size(lats, longs))))
+        self.cell_degrees = 360 / self._cols
+        self._rows = int(math.ceil(180 / self.cell_degrees))
+
+        keys = self._row(lats) * self._cols + self._col(longs)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._lats = lats[order]
+        self._longs = longs[order]
+        self._dealers = [located[i][0] for i in order]
+
+    def __len__(self):
+        return len(self._dealers)
+
+    @staticmethod
+    def _cell_size(lats, longs):
+        """Pick a cell size giving about DEALERS_PER_CELL dealers per occupied cell."""
+        if len(lats) < 2:
+            return MAX_CELL_DEGREES
+        area = max(np.ptp(lats), MIN_CELL_DEGREES) * max(np.ptp(longs), MIN_CELL_DEGREES)
+        size = math.sqrt(area * DEALERS_PER_CELL / len(lats))
+        return min(max(size, MIN_CELL_DEGREES), MAX_CELL_DEGREES)
+
+    def _row(self, lats):
+        """Return the grid row of latitudes."""
+        return np.minimum(((lats + 90) // self.cell_degrees).astype(np.int64), self._rows - 1)
+
+    def _col(self, longs):
+        """Return the grid column of longitudes."""
+        return np.minimum(((longs + 180) // self.cell_degrees).astype(np.int64), self._cols - 1)
+
+    def _box_slices(self, row, col, reach):
+        """Return the index ranges of the dealers in the cells within `reach` of a cell."""
+        first_row, last_row = max(row - reach, 0), min(row + reach, self._rows - 1)
+        if 2 * reach + 1 >= self._cols:
+            col_ranges = [(0, self._cols - 1)]
+        else:
+            first_col, last_col = col - reach, col + reach
+            # Longitude wraps around at the antimeridian
+            if first_col < 0:
+                col_ranges = [(first_col + self._cols, self._cols - 1), (0, last_col)]
+            elif last_col >= self._cols:
+                col_ranges = [(first_col, self._cols - 1), (0, last_col - self._cols)]
+            else:
+                col_ranges = [(first_col, last_col)]
+
+        rows = np.arange(first_row, last_row + 1) * self._cols
+        lows = np.concatenate([rows + first for first, _ in col_ranges])
+        highs = np.concatenate([rows + last for _, last in col_ranges])
+        starts = np.searchsorted(self._keys, lows, side='left')
+        ends = np.searchsorted(self._keys, highs, side='right')
+        return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+    def _outside_bound_km(self, lat, long, row, col, reach):
+        """Return a lower bound of the distance to any dealer outside the box of cells."""
+        bound = math.inf
+        # Every point outside the rows of the box is at least this far in latitude
+        if row - reach > 0:
+            bound = min(bound, lat - ((row - reach) * self.cell_degrees - 90))
+        if row + reach < self._rows - 1:
+            bound = min(bound, (row + reach + 1) * self.cell_degrees - 90 - lat)
+        # Every point outside the columns of the box is beyond a meridian this far away
+        if 2 * reach + 1 < self._cols:
+            west = long - ((col - reach) * self.cell_degrees - 180)
+            east = (col + reach + 1) * self.cell_degrees - 180 - long
+            angle = math.radians(min(west, east, 90))
+            bound = min(bound, math.degrees(
+                math.asin(min(math.cos(math.radians(lat)) * math.sin(angle), 1.0))))
+        return math.radians(bound) * EARTH_RADIUS_KM if bound != math.inf else math.inf
+
+    def nearest(self, lat, long, k=5, radius=None):
+        """
+        Return the dealers closest to a point.
+
+        Args:
+            lat (float): Latitude of the point, in degrees.
+            long (float): Longitude of the point, in degrees.
+            k (int, optional): Maximum number of dealers to return (default is 5).
+            radius (float, optional): Only return dealers within this many kilometres.
+
+        Returns:
+            list: Up to `k` (CarDealer, distance in km) pairs, closest first.
+        """
+        if not self._dealers or k < 1:
+            return []
+        row = int(self._row(np.array([lat]))[0])
+        col = int(self._col(np.array([long]))[0])
+        reach = 1
+        while True:
+            slices = self._box_slices(row, col, reach)
+            if slices:
+                indexes = np.concatenate([np.arange(start, end) for start, end in slices])
+            else:
+                indexes = np.empty(0, dtype=np.int64)
+            distances = haversine_km(lat, long, self._lats[indexes], self._longs[indexes])
+            bound = self._outside_bound_km(lat, long, row, col, reach)
+            limit = bound if radius is None else min(bound, radius)
+            if np.count_nonzero(distances <= limit) >= k or (
+                    radius is not None and bound >= radius) or bound == math.inf:
+                break
+            reach *= 2
+
+        if radius is not None:
+            within = distances <= radius
+            indexes, distances = indexes[within], distances[within]
+        if len(distances) > k:
+            closest = np.argpartition(distances, k - 1)[:k]
+            indexes, distances = indexes[closest], distances[closest]
+        order = np.argsort(distances, kind='stable')
+        return [(self._dealers[indexes[i]], float(distances[i])) for i in order]
@@ -0,0 +1,236 @@
+"""
+Management command: bench_asgi
+
+Load-test the remote-data views under a sync (WSGI) worker and under an async
+(ASGI) worker, one worker each, against a local stub of the dealership and review
+services that answers after a fixed delay.
+
+A gunicorn sync worker holds a request for as long as the services take to
+answer, so its throughput is capped at about one page per upstream round trip.
+A uvicorn worker awaits the services and keeps serving other requests meanwhile,
+so its throughput grows with the number of concurrent clients.
+
+With --unscored, the stub serves reviews stored without a sentiment, with a text
+of their own on every request so that neither the sentiment cache nor the page
+cache has them, and also stands in for NLU. Every dealer page then scores its reviews, which the async
+worker must do without holding up the other requests.
+
+Usage:
+    python manage.py bench_asgi --concurrency 1 10 50 100 --duration 5 --latency 0.2
+    python manage.py bench_asgi --unscored --nlu-latency 0.5
+"""
+import asyncio
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+DATA_DIR = Path(settings.BASE_DIR).parent / 'cloudant' / 'data'
+
+# Servers compared, with the command line starting one worker on a given port
+DEPLOYMENTS = (
+    ('sync (gunicorn, sync worker)',
+     ['-m', 'gunicorn', 'djangobackend.wsgi', '--workers', '1', '--timeout', '120',
+      '--bind', '127.0.0.1:{port}']),
+    ('async (uvicorn)',
+     ['-m', 'uvicorn', 'djangobackend.asgi:application', '--workers', '1',
+      '--no-access-log', '--port', '{port}']),
+)
+
+
+def make_stub_handler(latency, unscored=False, nlu_latency=None):
+    """Build a request handler that imitates the dealership, review and NLU services."""
+    with open(DATA_DIR / 'dealerships.json', encoding='utf-8') as dealerships_file:
+        dealerships = json.load(dealerships_file)['dealerships']
+    with open(DATA_DIR / 'reviews-full.json', encoding='utf-8') as reviews_file:
+        # Unless unscored, reviews are stored with their sentiment and no NLU call is made
+        reviews = [dict(review, sentiment=None if unscored else 'positive')
+                   for review in json.load(reviews_file)['reviews']]
+    served = itertools.count()
+    summaries = itertools.count()
+
+    class StubServicesHandler(BaseHTTPRequestHandler):
+        """Answer the dealership, review, summary and NLU endpoints after a delay."""
+
+        protocol_version = 'HTTP/1.1'
+
+        def send_json(self, result):
+            """Send a JSON response."""
+            body = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The caller gave up waiting, as an NLU call past its timeout does
+                pass
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Handle a service call."""
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            time.sleep(latency)
+            if url.path.startswith('/api/dealerships'):
+                result = dealerships
+            elif url.path == '/api/get_reviews':
+                dealer_id = int(query['id'][0])
+                result = [review for review in reviews if review['dealership'] == dealer_id]
+                if unscored:
+                    # New texts every time, so that the sentiment cache never has them
+                    number = next(served)
+                    result = [dict(review, review=f"{review['review']} ({number})")
+                              for review in result]
+            elif url.path == '/api/get_review_summary':
+                result = {'dealership': int(query['id'][0]), 'review_count': 0}
+                if unscored:
+                    # A new version of the reviews, so that the page is not cached either
+                    result['version'] = next(summaries)
+            else:
+                result = {'error': 'not found'}
+            self.send_json(result)
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """Handle an NLU analyze call."""
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency if nlu_latency is None else nlu_latency)
+            self.send_json({'sentiment': {'document': {'label': 'positive', 'score': 0.5}}})
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            """Keep the benchmark output readable."""
+
+    return StubServicesHandler
+
+
+def free_port():
+    """Return a TCP port nobody listens on."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def wait_until_listening(port, process, timeout=30):
+    """Wait for a started server to accept connections."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f"Server exited with status {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f"Server did not listen on port {port} within {timeout}s")
+
+
+async def run_load(url, concurrency, duration):
+    """
+    Request a URL from `concurrency` clients in a loop for `duration` seconds.
+
+    Returns:
+        tuple: The latencies of the successful requests, the number of errors, and the
+        seconds until the last request finished.
+    """
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    # The project only allows the "localhost" host name
+    async with httpx.AsyncClient(limits=limits, timeout=120,
+                                 headers={'Host': 'localhost'}) as client:
+        started_at = time.monotonic()
+        stop_at = started_at + duration
+
+        async def client_loop():
+            nonlocal errors
+            while time.monotonic() < stop_at:
+                started = time.monotonic()
+                try:
+                    response = await client.get(url)
+                    if response.status_code == 200:
+                        latencies.append(time.monotonic() - started)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        # Requests still queued at the end of the window count, so does their wait
+        elapsed = time.monotonic() - started_at
+    return latencies, errors, elapsed
+
+
+class Command(BaseCommand):
+    """Compare the capacity of one sync worker and one async worker."""
+
+    help = "Load-test the dealer views under a sync WSGI worker and an async ASGI worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100],
+                            help='Numbers of concurrent clients to test')
+        parser.add_argument('--duration', type=float, default=5,
+                            help='Seconds of load per concurrency level')
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Stub service response time in seconds')
+        parser.add_argument('--path', default='/djangoapp/dealer/15/',
+                            help='Page requested by the clients')
+        parser.add_argument('--unscored', action='store_true',
+                            help='Serve reviews without a sentiment, scored through a stub NLU')
+        parser.add_argument('--nlu-latency', type=float, default=None,
+                            help='Stub NLU response time in seconds (default is --latency)')
+
+    def handle(self, *args, **options):
+        stub = ThreadingHTTPServer(('127.0.0.1', 0), make_stub_handler(
+            options['latency'], options['unscored'], options['nlu_latency']))
+        stub.daemon_threads = True
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+        self.stdout.write(f"Stub services on {stub_url}, {options['latency']}s per call")
+
+        env = dict(os.environ, DEALERSHIPS_SERVICE_URL=stub_url, REVIEWS_SERVICE_URL=stub_url,
+                   NLU_URL=stub_url, NLU_API_KEY='', SENTIMENT_BACKEND='nlu')
+        try:
+            for name, command in DEPLOYMENTS:
+                self.bench_deployment(name, command, env, options)
+        finally:
+            stub.shutdown()
+
+    def bench_deployment(self, name, command, env, options):
+        """Start one server, load it at every concurrency level, then stop it."""
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable] + [part.format(port=port) for part in command],
+            cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_listening(port, process)
+            url = f"http://127.0.0.1:{port}{options['path']}"
+            # Load the dealer list once so every level measures the same work
+            asyncio.run(run_load(url, 1, 0.1))
+            self.stdout.write(name)
+            for concurrency in options['concurrency']:
+                latencies, errors, elapsed = asyncio.run(
+                    run_load(url, concurrency, options['duration']))
+                if len(latencies) < 2:
+                    self.stdout.write(f"  {concurrency:>4} clients: {len(latencies)} requests, "
+                                      f"{errors} errors")
+                    continue
+                p95 = statistics.quantiles(latencies, n=20)[-1]
+                self.stdout.write(
+                    f"  {concurrency:>4} clients: {len(latencies) / elapsed:8.1f} req/s"
+                    f"   median {statistics.median(latencies) * 1000:7.0f} ms"
+                    f"   p95 {p95 * 1000:7.0f} ms   errors {errors}")
+        finally:
+            process.terminate()
+            process.wait()
@@ -0,0 +1,128 @@
+"""
+Management command: bench_auth_concurrency
+
+Measure registration and login under concurrent workers on the configured database.
+
+Each worker process, like a gunicorn worker, registers users through the
+registration view and then logs them in, which writes a user row and session
+rows. The command reports throughput, latency percentiles and "database is
+locked" failures. Run it once per database profile to compare them:
+
+    DATABASE_PROFILE=sqlite python manage.py bench_auth_concurrency --workers 4
+    DATABASE_PROFILE=sqlite-wal python manage.py bench_auth_concurrency --workers 4
+    DATABASE_PROFILE=postgres python manage.py bench_auth_concurrency --workers 4
+
+Password hashing would otherwise take most of the time of every request, so the
+benchmark uses a fast hasher unless --real-hasher is given. The users and
+sessions it creates are deleted at the end.
+"""
+import multiprocessing
+import statistics
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.test import Client
+from django.test.utils import override_settings
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+PASSWORD = 'bench-password'
+
+
+def run_worker(worker, users, prefix, fast_hasher):
+    """
+    Register and log in users from one worker process.
+
+    Returns:
+        dict: Latencies in seconds of the registrations and logins by outcome,
+        and the session keys created.
+    """
+    # Connections inherited from the parent process must not be shared
+    connections.close_all()
+    results = {"register": [], "login": [], "errors": 0, "sessions": []}
+    hashers = override_settings(PASSWORD_HASHERS=FAST_HASHERS) if fast_hasher else None
+    if hashers is not None:
+        hashers.enable()
+    try:
+        for i in range(users):
+            username = f"{prefix}-{worker}-{i}"
+            client = Client()
+            try:
+                started = time.perf_counter()
+                client.post('/djangoapp/registration/', {
+                    'username': username, 'psw': PASSWORD,
+                    'firstname': 'Bench', 'lastname': str(i),
+                }, HTTP_HOST='localhost')
+                results["register"].append(time.perf_counter() - started)
+                results["sessions"].append(client.session.session_key)
+
+                client = Client()
+                started = time.perf_counter()
+                client.login(username=username, password=PASSWORD)
+                results["login"].append(time.perf_counter() - started)
+                results["sessions"].append(client.session.session_key)
+            except OperationalError as operational_error:
+                print("Request failed:", str(operational_error))
+                results["errors"] += 1
+    finally:
+        if hashers is not None:
+            hashers.disable()
+        connections.close_all()
+    return results
+
+
+def percentile(values, share):
+    """Return the value below which `share` of the values fall."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(share * len(values)), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    """Benchmark concurrent registrations and logins on the configured database."""
+
+    help = "Measure registration and login throughput with concurrent worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Users registered and logged in by each worker')
+        parser.add_argument('--real-hasher', action='store_true',
+                            help='Hash passwords with the configured hasher')
+
+    def handle(self, *args, **options):
+        prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        workers = options['workers']
+        # Forked workers start from a process holding no database connection
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(run_worker, worker, options['users'], prefix,
+                                       not options['real_hasher'])
+                       for worker in range(workers)]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+
+        database = connections['default']
+        self.stdout.write(f"{settings.DATABASE_PROFILE} ({database.settings_dict['NAME']}), "
+                          f"{workers} workers x {options['users']} users in {elapsed:.2f}s")
+        for operation in ("register", "login"):
+            latencies = [latency for result in results for latency in result[operation]]
+            if not latencies:
+                continue
+            self.stdout.write(
+                f"  {operation:<8} {len(latencies) / elapsed:8.1f}/s   "
+                f"p50 {statistics.median(latencies) * 1000:7.1f} ms   "
+                f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms   "
+                f"max {max(latencies) * 1000:7.1f} ms")
+        self.stdout.write(f"  failures {sum(result['errors'] for result in results)}")
+
+        Session.objects.filter(session_key__in=[
+            key for result in results for key in result["sessions"] if key]).delete()
+        User.objects.filter(username__startswith=f"{prefix}-").delete()
@@ -0,0 +1,134 @@
+"""
+Management command: bench_car_queries
+
+Time the CarModel admin list filters and the add review catalog query on a large
+inventory, without and with the indexes of the ``0003_carmodel_indexes`` migration.
+
+The requested number of cars is seeded into the configured database (SQLite or
+PostgreSQL), spread over the makes, dealers, types and years. Every query is timed
+once with only the foreign key index the table used to have, and once with the
+CarModel indexes. Everything runs in a transaction that is rolled back at the end,
+so the database is left as it was.
+
+Usage:
+    python manage.py bench_car_queries --cars 1000000
+"""
+import random
+import statistics
+import time
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.test import RequestFactory
+from djangoapp.catalog import catalog_queryset
+from djangoapp.models import CarMake, CarModel
+
+# The only index CarModel had before the migration: the one of its foreign key
+FOREIGN_KEY_INDEX = models.Index(fields=['make'], name='carmodel_bench_make_idx')
+DEALERS = 50
+MAKES = 40
+YEARS = (1995, 2026)
+
+
+def seed(count, batch_size=20000):
+    """Insert `count` cars, one in twenty tied to no dealer."""
+    CarMake.objects.bulk_create(
+        [CarMake(name=f"Bench make {i}", description="Seeded") for i in range(MAKES)])
+    # Read back: bulk_create does not set the primary keys on every database
+    makes = list(CarMake.objects.filter(description="Seeded", name__startswith="Bench make "))
+    types = [choice for choice, _ in CarModel.TYPE_CHOICES]
+    rng = random.Random(42)
+    for start in range(0, count, batch_size):
+        CarModel.objects.bulk_create([
+            CarModel(make=rng.choice(makes), name=f"Model {i % 500}",
+                     dealer_id=None if i % 20 == 0 else rng.randint(1, DEALERS),
+                     type=rng.choice(types), year=rng.randint(*YEARS))
+            for i in range(start, min(start + batch_size, count))
+        ], batch_size=batch_size)
+    return makes
+
+
+def set_indexes(drop, create):
+    """
+    Drop and create CarModel indexes.
+
+    The SQL is run directly: the SQLite schema editor refuses to run within the
+    benchmark transaction, which index changes do not need.
+    """
+    editor = connection.schema_editor()
+    with connection.cursor() as cursor:
+        for index in drop:
+            cursor.execute(str(index.remove_sql(CarModel, editor)))
+        for index in create:
+            cursor.execute(str(index.create_sql(CarModel, editor)))
+        if connection.vendor in ('sqlite', 'postgresql'):
+            # Let the planner know about the new indexes
+            cursor.execute('ANALYZE')
+
+
+def median_time(function, repeat):
+    """Return the median duration of `repeat` runs of a function, in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+class Command(BaseCommand):
+    """Benchmark CarModel lookups with and without the CarModel indexes."""
+
+    help = "Seed many cars and time the admin list filters and the catalog query"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cars', type=int, default=1000000, help='Number of cars to seed')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per query; the median is reported')
+
+    def queries(self, make):
+        """Return the (name, function) pairs of the queries to time."""
+        model_admin = admin.site._registry[CarModel]  # pylint: disable=protected-access
+        superuser = User(username='bench', is_staff=True, is_superuser=True)
+        factory = RequestFactory()
+
+        def changelist(**params):
+            request = factory.get('/admin/djangoapp/carmodel/', params)
+            request.user = superuser
+            return lambda: model_admin.changelist_view(request).render()
+
+        return [
+            ("admin list", changelist()),
+            ("admin dealer_id filter", changelist(dealer_id=7)),
+            ("admin make filter", changelist(make__id__exact=make.id)),
+            ("admin make + year filters", changelist(make__id__exact=make.id, year=2015)),
+            ("admin type filter", changelist(type__exact='SUV')),
+            ("admin type + year filters", changelist(type__exact='SUV', year=2015)),
+            ("catalog of a dealer", lambda: list(catalog_queryset(7))),
+        ]
+
+    def time_queries(self, make, repeat):
+        """Return the median time of every query, by name."""
+        return {name: median_time(function, repeat) for name, function in self.queries(make)}
+
+    def handle(self, *args, **options):
+        indexes = CarModel._meta.indexes  # pylint: disable=protected-access
+        with transaction.atomic():
+            started = time.monotonic()
+            makes = seed(options['cars'])
+            self.stdout.write(f"Seeded {options['cars']} cars on {connection.vendor} "
+                              f"in {time.monotonic() - started:.1f}s")
+
+            # Before: only the index of the make foreign key
+            set_indexes(drop=indexes, create=[FOREIGN_KEY_INDEX])
+            before = self.time_queries(makes[0], options['repeat'])
+            # After: the CarModel indexes
+            set_indexes(drop=[FOREIGN_KEY_INDEX], create=indexes)
+            after = self.time_queries(makes[0], options['repeat'])
+
+            for name, before_ms in before.items():
+                self.stdout.write(f"{name:<28} before {before_ms:9.1f} ms   "
+                                  f"after {after[name]:9.1f} ms   "
+                                  f"({before_ms / after[name]:5.1f}x)")
+            transaction.set_rollback(True)
@@ -0,0 +1,128 @@
+"""
+Management command: bench_geo
+
+Benchmark nearest-dealer queries of the grid index against linear scans.
+
+Synthetic dealers are scattered around the sample dealerships of
+cloudant/data/dealerships.json, so the set is as clustered as real dealers are.
+Every query is answered by the grid index, by a NumPy scan computing the distance
+to every dealer, and, for the smaller sets, by a pure Python scan.
+
+Usage:
+    python manage.py bench_geo --dealers 1000 10000 100000 --queries 2000
+"""
+import heapq
+import json
+import math
+import random
+import statistics
+import time
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from djangoapp.geo import EARTH_RADIUS_KM, DealerGeoIndex, haversine_km
+from djangoapp.models import CarDealer
+
+DATA_DIR = Path(settings.BASE_DIR).parent / 'cloudant' / 'data'
+
+# Largest set scanned in pure Python; beyond it that scan takes too long to repeat
+MAX_PYTHON_SCAN = 10000
+
+
+def make_dealers(count, seed):
+    """Scatter `count` dealers within about 100 km of the sample dealerships."""
+    with open(DATA_DIR / 'dealerships.json', encoding='utf-8') as dealerships_file:
+        samples = json.load(dealerships_file)['dealerships']
+    rng = random.Random(seed)
+    dealers = []
+    for i in range(count):
+        sample = samples[i % len(samples)]
+        dealers.append(CarDealer(
+            sample['address'], sample['city'], sample['full_name'], i + 1,
+            sample['lat'] + rng.gauss(0, 1), sample['long'] + rng.gauss(0, 1),
+            sample['short_name'], sample['st'], sample['zip']))
+    return dealers
+
+
+def python_nearest(dealers, lat, long, k):
+    """Linear scan computing the haversine distance to every dealer in Python."""
+    lat_r, long_r = math.radians(lat), math.radians(long)
+
+    def distance(dealer):
+        dealer_lat, dealer_long = math.radians(dealer.lat), math.radians(dealer.long)
+        half_chord = (math.sin((dealer_lat - lat_r) / 2) ** 2 + math.cos(lat_r)
+                      * math.cos(dealer_lat) * math.sin((dealer_long - long_r) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(half_chord))
+
+    return heapq.nsmallest(k, ((distance(dealer), dealer) for dealer in dealers),
+                           key=lambda pair: pair[0])
+
+
+def numpy_nearest(lats, longs, lat, long, k):
+    """Linear scan computing every distance with NumPy, then a partial sort."""
+    distances = haversine_km(lat, long, lats, longs)
+    closest = np.argpartition(distances, k - 1)[:k]
+    return closest[np.argsort(distances[closest])]
+
+
+def time_queries(function, queries):
+    """Return the latency in microseconds of every call of `function` on the queries."""
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        function(*query)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies
+
+
+class Command(BaseCommand):
+    """Compare the grid index with linear scans for k-nearest dealer queries."""
+
+    help = "Benchmark nearest-dealer queries of the geo index against linear scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dealers', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Numbers of dealers to index')
+        parser.add_argument('--queries', type=int, default=2000,
+                            help='Queries timed per case')
+        parser.add_argument('--k', type=int, default=5, help='Dealers returned per query')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed')
+
+    def report(self, label, latencies):
+        """Print the median and 95th percentile of a set of latencies."""
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        self.stdout.write(f"  {label:<14} median {statistics.median(latencies):10.1f} us"
+                          f"   p95 {p95:10.1f} us")
+
+    def handle(self, *args, **options):
+        k = options['k']
+        for count in options['dealers']:
+            dealers = make_dealers(count, options['seed'])
+            started = time.perf_counter()
+            index = DealerGeoIndex(dealers)
+            build = time.perf_counter() - started
+            self.stdout.write(f"{count} dealers: index built in {build * 1000:.1f} ms "
+                              f"({index.cell_degrees:.3f} degree cells)")
+
+            rng = random.Random(options['seed'])
+            queries = [(dealer.lat + rng.gauss(0, 0.5), dealer.long + rng.gauss(0, 0.5))
+                       for dealer in rng.choices(dealers, k=options['queries'])]
+            lats = np.array([dealer.lat for dealer in dealers])
+            longs = np.array([dealer.long for dealer in dealers])
+
+            # Both answers must agree before their speed means anything
+            for lat, long in queries[:100]:
+                expected = [dealers[i].id for i in numpy_nearest(lats, longs, lat, long, k)]
+                found = [dealer.id for dealer, _ in index.nearest(lat, long, k)]
+                if found != expected:
+                    self.stderr.write(f"Index and scan disagree at ({lat}, {long})")
+
+            self.report('grid index', time_queries(
+                lambda lat, long: index.nearest(lat, long, k), queries))
+            self.report('numpy scan', time_queries(
+                lambda lat, long: numpy_nearest(lats, longs, lat, long, k), queries))
+            if count <= MAX_PYTHON_SCAN:
+                self.report('python scan', time_queries(
+                    lambda lat, long: python_nearest(dealers, lat, long, k),
+                    queries[:max(options['queries'] // 10, 20)]))
@@ -0,0 +1,131 @@
+"""
+Management command: bench_models
+
+Measure the memory held by, and the construction time of, CarDealer and
+DealerReview objects built from parsed JSON, comparing the slotted classes and
+their ``from_dicts`` constructors with the previous ``__dict__``-based classes
+built field by field. The sample documents in ``cloudant/data`` are repeated
+(with fresh ids) up to the requested sizes.
+
+Usage:
+    python manage.py bench_models --sizes 10000 100000
+"""
+import json
+import time
+import tracemalloc
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from djangoapp.models import CarDealer, DealerReview
+
+DATA_DIR = settings.BASE_DIR.parent / 'cloudant' / 'data'
+
+
+class LegacyCarDealer:  # pylint: disable=too-few-public-methods
+    """CarDealer as it was before slots, for comparison."""
+
+    def __init__(self, address, city, full_name, id, lat, long, short_name, st, zip):  # pylint: disable=redefined-builtin
+        self.address = address
+        self.city = city
+        self.full_name = full_name
+        self.id = id
+        self.lat = lat
+        self.long = long
+        self.short_name = short_name
+        self.st = st
+        self.zip = zip
+
+
+class LegacyDealerReview:  # pylint: disable=too-few-public-methods
+    """DealerReview as it was before slots, for comparison."""
+
+    def __init__(self, dealership, name, purchase, review, car_make=None, car_model=None,
+                 car_year=None, purchase_date=None, sentiment="neutral"):
+        self.car_make = car_make
+        self.car_model = car_model
+        self.car_year = car_year
+        self.dealership = dealership
+        self.name = name
+        self.purchase = purchase
+        self.purchase_date = purchase_date
+        self.review = review
+        self.sentiment = sentiment
+
+
+def legacy_dealers(dealer_dicts):
+    """Build dealers field by field, as restapis used to."""
+    results = []
+    for dealer_dict in dealer_dicts:
+        results.append(LegacyCarDealer(
+            address=dealer_dict["address"], city=dealer_dict["city"],
+            full_name=dealer_dict["full_name"], id=dealer_dict["id"],
+            lat=dealer_dict["lat"], long=dealer_dict["long"],
+            short_name=dealer_dict["short_name"], st=dealer_dict["st"], zip=dealer_dict["zip"]))
+    return results
+
+
+def legacy_reviews(review_dicts):
+    """Build reviews field by field, as restapis used to."""
+    results = []
+    for review_dict in review_dicts:
+        results.append(LegacyDealerReview(
+            dealership=review_dict["dealership"], name=review_dict["name"],
+            purchase=review_dict["purchase"], review=review_dict["review"],
+            car_make=review_dict["car_make"], car_model=review_dict["car_model"],
+            car_year=review_dict["car_year"], purchase_date=review_dict["purchase_date"]))
+    return results
+
+
+def scale(documents, size):
+    """Repeat sample documents up to ``size`` entries, giving each a new id."""
+    scaled = []
+    for i in range(size):
+        document = dict(documents[i % len(documents)])
+        document["id"] = i + 1
+        scaled.append(document)
+    return scaled
+
+
+def measure(build, documents):
+    """Return (seconds, bytes held by the result) for one build."""
+    started = time.perf_counter()
+    objects = build(documents)
+    elapsed = time.perf_counter() - started
+    del objects
+
+    # Memory is traced on a separate run so tracing does not skew the timing
+    tracemalloc.start()
+    objects = build(documents)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return elapsed, held
+
+
+class Command(BaseCommand):
+    """Compare slotted model objects with the previous dict-based ones."""
+
+    help = "Benchmark memory and construction time of CarDealer and DealerReview objects"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000],
+                            help='Number of objects to build')
+
+    def handle(self, *args, **options):
+        with open(DATA_DIR / 'dealerships.json', encoding='utf-8') as dealerships_file:
+            dealers = json.load(dealerships_file)['dealerships']
+        with open(DATA_DIR / 'reviews-full.json', encoding='utf-8') as reviews_file:
+            reviews = json.load(reviews_file)['reviews']
+
+        cases = [
+            ("CarDealer", dealers, legacy_dealers, CarDealer.from_dicts),
+            ("DealerReview", reviews, legacy_reviews, DealerReview.from_dicts),
+        ]
+        for name, samples, legacy_build, build in cases:
+            for size in options['sizes']:
+                documents = scale(samples, size)
+                legacy_time, legacy_bytes = measure(legacy_build, documents)
+                new_time, new_bytes = measure(build, documents)
+                self.stdout.write(
+                    f"{name:<12} {size:>7}: "
+                    f"dict {legacy_bytes / size:6.0f} B/obj {legacy_time * 1000:8.1f} ms | "
+                    f"slots {new_bytes / size:6.0f} B/obj {new_time * 1000:8.1f} ms")
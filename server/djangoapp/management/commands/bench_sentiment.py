@@ -0,0 +1,111 @@
+"""
+Management command: bench_sentiment
+
+Benchmark review sentiment scoring against a local stub of the Watson NLU service.
+The stub answers every analyze call after a random delay, so the sequential loop
+used to pay the sum of all delays while the batched pipeline pays roughly the
+slowest one. A second batched pass over the same reviews shows the cost once
+their labels are in the sentiment cache.
+
+With --error-rate the stub answers that share of the calls with a 503, which shows
+the NLU circuit breaker opening and later pages no longer waiting on NLU.
+
+Usage:
+    python manage.py bench_sentiment --reviews 10 20 40 --min-latency 0.05 --max-latency 0.3
+    python manage.py bench_sentiment --reviews 20 20 20 --error-rate 0.8
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from djangoapp.nlu import nlu_client
+from djangoapp.restapis import analyze_review_sentiments, analyze_review_sentiments_batch
+from djangoapp.sentiment import get_sentiment_backend
+from djangoapp.sentiment_cache import sentiment_cache
+
+
+def make_stub_handler(min_latency, max_latency, error_rate=0.0):
+    """Build a request handler that imitates the NLU analyze endpoint."""
+
+    class StubNLUHandler(BaseHTTPRequestHandler):
+        """Answer every POST with a fixed sentiment, or an error, after a random delay."""
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """Handle an analyze call."""
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(random.uniform(min_latency, max_latency))
+            if random.random() < error_rate:
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = json.dumps({
+                "sentiment": {"document": {"score": 0.6, "label": "positive"}}
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            """Keep the benchmark output readable."""
+
+    return StubNLUHandler
+
+
+class Command(BaseCommand):
+    """Compare sequential and batched sentiment scoring against a stub NLU server."""
+
+    help = "Benchmark sequential vs batched review sentiment scoring against a stub NLU server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reviews', type=int, nargs='+', default=[10, 20, 40],
+                            help='Page sizes (number of reviews) to benchmark')
+        parser.add_argument('--min-latency', type=float, default=0.05,
+                            help='Minimum stub response time in seconds')
+        parser.add_argument('--max-latency', type=float, default=0.3,
+                            help='Maximum stub response time in seconds')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of the stub responses that are errors')
+
+    def handle(self, *args, **options):
+        handler = make_stub_handler(options['min_latency'], options['max_latency'],
+                                    options['error_rate'])
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stub_url = f"http://127.0.0.1:{server.server_address[1]}"
+        self.stdout.write(f"Stub NLU listening on {stub_url}")
+
+        try:
+            with override_settings(NLU_URL=stub_url, NLU_API_KEY=''):
+                for count in options['reviews']:
+                    run = uuid.uuid4().hex
+                    texts = [f"Review number {i} of run {run}" for i in range(count)]
+
+                    started = time.monotonic()
+                    for text in texts:
+                        analyze_review_sentiments(text)
+                    sequential = time.monotonic() - started
+
+                    started = time.monotonic()
+                    analyze_review_sentiments_batch(texts)
+                    batched = time.monotonic() - started
+
+                    started = time.monotonic()
+                    analyze_review_sentiments_batch(texts)
+                    cached = time.monotonic() - started
+
+                    self.stdout.write(
+                        f"{count:>5} reviews: sequential {sequential:.3f}s, "
+                        f"batched {batched:.3f}s ({sequential / batched:.1f}x), "
+                        f"cached {cached:.4f}s")
+        finally:
+            server.shutdown()
+        self.stdout.write(f"Sentiment cache: {sentiment_cache.stats()}")
+        self.stdout.write(f"NLU client: {nlu_client.metrics()}")
+        self.stdout.write(f"NLU circuit breaker: {get_sentiment_backend('nlu').breaker.stats()}")
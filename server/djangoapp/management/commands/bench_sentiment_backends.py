@@ -0,0 +1,100 @@
+"""
+Management command: bench_sentiment_backends
+
+Compare the local lexicon sentiment engine with Watson NLU: throughput in reviews
+per second, and agreement of the local labels with labels recorded from NLU.
+
+Labels are recorded once with --record, which scores the reviews of a file with
+the NLU backend (credentials from ``settings.NLU_API_KEY`` and ``settings.NLU_URL``)
+and writes them, with the NLU throughput, to a JSON file. Later runs read that file
+with --recorded and need no network. A dump of the reviews database works as a
+recording too, since the reviews service stores the NLU label of every review.
+
+Usage:
+    python manage.py bench_sentiment_backends --record nlu_labels.json
+    python manage.py bench_sentiment_backends --recorded nlu_labels.json --rows 100000
+"""
+import json
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from djangoapp.sentiment import get_sentiment_backend
+
+LABELS = ('positive', 'neutral', 'negative')
+REVIEWS_FILE = settings.BASE_DIR.parent / 'cloudant' / 'data' / 'reviews-full.json'
+
+
+def read_reviews(path):
+    """Return the review documents of a file: a list, or an object with a "reviews" list."""
+    with open(path, encoding='utf-8') as reviews_file:
+        data = json.load(reviews_file)
+    return data['reviews'] if isinstance(data, dict) else data
+
+
+class Command(BaseCommand):
+    """Benchmark the local sentiment engine against recorded NLU labels."""
+
+    help = "Compare throughput and label agreement of the local and NLU sentiment backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reviews', default=str(REVIEWS_FILE),
+                            help='JSON file of the reviews to score with --record')
+        parser.add_argument('--record', metavar='PATH',
+                            help='Score the reviews with NLU and write the labels to PATH')
+        parser.add_argument('--recorded', metavar='PATH',
+                            help='Reviews with their NLU label under "sentiment"')
+        parser.add_argument('--rows', type=int, default=100000,
+                            help='Reviews scored by the local engine for its throughput')
+
+    def record(self, options):
+        """Score the reviews with the NLU backend and save the labels."""
+        texts = [review['review'] for review in read_reviews(options['reviews'])]
+        started = time.perf_counter()
+        labels = get_sentiment_backend('nlu').labels(texts)
+        elapsed = time.perf_counter() - started
+        recorded = [{'review': text, 'sentiment': label}
+                    for text, label in zip(texts, labels) if label is not None]
+        with open(options['record'], 'w', encoding='utf-8') as record_file:
+            json.dump({'reviews_per_second': len(texts) / elapsed, 'reviews': recorded},
+                      record_file, indent=1)
+        self.stdout.write(f"NLU: {len(recorded)} of {len(texts)} reviews labelled, "
+                          f"{len(texts) / elapsed:,.1f} reviews/s")
+
+    def handle(self, *args, **options):
+        if options['record']:
+            self.record(options)
+            return
+
+        local = get_sentiment_backend('local')
+        texts = [review['review'] for review in read_reviews(options['reviews'])]
+        batch = [texts[i % len(texts)] for i in range(options['rows'])]
+        started = time.perf_counter()
+        local.labels(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"local: {len(batch)} reviews in {elapsed:.3f}s, "
+                          f"{len(batch) / elapsed:,.0f} reviews/s")
+
+        if not options['recorded']:
+            self.stdout.write("No --recorded NLU labels: agreement not measured")
+            return
+        with open(options['recorded'], encoding='utf-8') as recorded_file:
+            recorded = json.load(recorded_file)
+        if isinstance(recorded, dict) and 'reviews_per_second' in recorded:
+            self.stdout.write(f"NLU (recorded): {recorded['reviews_per_second']:,.1f} reviews/s")
+        reviews = [review for review in (recorded['reviews'] if isinstance(recorded, dict)
+                                         else recorded)
+                   if review.get('sentiment') in LABELS]
+        if not reviews:
+            raise CommandError(f"No labelled review in {options['recorded']}")
+
+        expected = [review['sentiment'] for review in reviews]
+        predicted = local.labels([review['review'] for review in reviews])
+        pairs = Counter(zip(expected, predicted))
+        agreed = sum(pairs[label, label] for label in LABELS)
+        self.stdout.write(f"Agreement with NLU: {agreed / len(reviews):.1%} "
+                          f"of {len(reviews)} reviews")
+        self.stdout.write("NLU \\ local " + ''.join(f"{label:>10}" for label in LABELS))
+        for nlu_label in LABELS:
+            self.stdout.write(f"{nlu_label:<12}" + ''.join(
+                f"{pairs[nlu_label, label]:>10}" for label in LABELS))
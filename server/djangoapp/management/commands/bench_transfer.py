@@ -0,0 +1,126 @@
+"""
+Management command: bench_transfer
+
+Measure the transfer size and the client decode time of the dealer list and of a
+review list, for each response format of the services (a JSON array of documents,
+or format=columns) and each content coding (none, gzip, brotli). The sample
+documents in ``cloudant/data`` are repeated (with fresh ids and revisions, like
+Cloudant documents) up to the requested number of rows.
+
+The decode time covers what restapis does with a response: decompress it, parse
+the JSON and build the model objects (see restapis.objects_from_body).
+
+Usage:
+    python manage.py bench_transfer --rows 100000
+"""
+import gzip
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from djangoapp.models import CarDealer, DealerReview
+from djangoapp.restapis import objects_from_body
+try:
+    import brotli
+except ImportError:  # brotli is then left out of the comparison
+    brotli = None
+
+DATA_DIR = settings.BASE_DIR.parent / 'cloudant' / 'data'
+
+# Compression settings of the services (see reviews.py and get-dealerships.js)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def scale(documents, size):
+    """Repeat sample documents up to ``size`` entries, with new ids and revisions."""
+    scaled = []
+    for i in range(size):
+        document = dict(documents[i % len(documents)])
+        document["id"] = i + 1
+        document["_id"] = f"{i + 1:032x}"
+        document["_rev"] = f"1-{i * 2654435761 % 2 ** 128:032x}"
+        scaled.append(document)
+    return scaled
+
+
+def documents_body(documents, fields):
+    """Encode documents as the services do by default: a JSON array of documents."""
+    return json.dumps([{field: document.get(field) for field in fields}
+                       for document in documents]).encode('utf-8')
+
+
+def columns_body(documents, fields):
+    """Encode documents as the services do for format=columns."""
+    return json.dumps({
+        "fields": list(fields),
+        "columns": [[document.get(field) for document in documents] for field in fields],
+        "count": len(documents),
+    }).encode('utf-8')
+
+
+def codings():
+    """Return the (name, compress, decompress) content codings to compare."""
+    results = [
+        ("identity", lambda data: data, lambda data: data),
+        ("gzip", lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL), gzip.decompress),
+    ]
+    if brotli is not None:
+        results.append(("br", lambda data: brotli.compress(data, quality=BROTLI_QUALITY),
+                        brotli.decompress))
+    return results
+
+
+def best_time(function, repeat):
+    """Return the fastest of ``repeat`` runs of a function, in seconds, and its result."""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Command(BaseCommand):
+    """Compare the response formats and content codings of the backend services."""
+
+    help = "Benchmark transfer size and decode time of the dealer and review lists"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000,
+                            help='Number of dealers and reviews in the lists')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per measurement; the fastest is reported')
+
+    def handle(self, *args, **options):
+        with open(DATA_DIR / 'dealerships.json', encoding='utf-8') as dealerships_file:
+            dealers = json.load(dealerships_file)['dealerships']
+        with open(DATA_DIR / 'reviews-full.json', encoding='utf-8') as reviews_file:
+            reviews = json.load(reviews_file)['reviews']
+
+        rows, repeat = options['rows'], options['repeat']
+        cases = [
+            ("CarDealer", CarDealer, scale(dealers, rows), CarDealer.__slots__),
+            ("DealerReview", DealerReview, scale(reviews, rows), DealerReview.FIELDS),
+        ]
+        if brotli is None:
+            self.stderr.write("brotli is not installed: only gzip is measured")
+        for name, model, documents, fields in cases:
+            self.stdout.write(f"{name} x {rows}")
+            for format_name, encode in (("documents", documents_body),
+                                        ("columns", columns_body)):
+                body = encode(documents, fields)
+                for coding, compress, decompress in codings():
+                    compress_time, sent = best_time(lambda: compress(body), repeat)
+
+                    def decode(sent=sent, decompress=decompress):
+                        return objects_from_body(model, json.loads(decompress(sent)))
+
+                    decode_time, objects = best_time(decode, repeat)
+                    assert len(objects) == rows
+                    self.stdout.write(
+                        f"  {format_name:<9} {coding:<8} "
+                        f"{len(sent) / 1024:9.0f} KiB ({len(sent) / len(body):6.1%}) "
+                        f"compress {compress_time * 1000:7.1f} ms "
+                        f"decode {decode_time * 1000:7.1f} ms")
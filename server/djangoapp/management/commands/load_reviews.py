@@ -0,0 +1,87 @@
+"""
+Management command: load_reviews
+
+Load reviews from a file through the bulk ingest endpoint of the reviews service.
+
+The file is either JSON (an array of reviews, or an object holding it under
+"reviews" like cloudant/data/reviews-full.json) or NDJSON with one review per
+line (.ndjson or .jsonl). Reviews are sent in batches, each one a single
+streamed request, and the throughput is reported in docs/sec.
+
+Usage:
+    python manage.py load_reviews ../cloudant/data/reviews-full.json
+    python manage.py load_reviews reviews.ndjson --url http://127.0.0.1:5000/api/post_reviews
+"""
+import json
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from djangoapp.restapis import post_reviews_bulk
+
+DEFAULT_URL = (
+    'https://oumaimatouil-5000.theiadocker-1-labs-prod-'
+    'theiak8s-4-tor01.proxy.cognitiveclass.ai/api/post_reviews')
+
+# Errors printed per batch; the others are only counted
+MAX_PRINTED_ERRORS = 10
+
+
+def iter_reviews_file(path):
+    """Yield the reviews of a JSON or NDJSON file."""
+    with open(path, encoding='utf-8') as reviews_file:
+        if path.endswith(('.ndjson', '.jsonl')):
+            for line in reviews_file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(reviews_file)
+    if isinstance(data, dict):
+        data = data.get('reviews', [])
+    yield from data
+
+
+class Command(BaseCommand):
+    """Bulk-load a file of reviews into the reviews service."""
+
+    help = "Load reviews from a JSON or NDJSON file through the bulk ingest endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSON or NDJSON file of reviews')
+        parser.add_argument('--url', default=DEFAULT_URL,
+                            help='URL of the post_reviews endpoint')
+        parser.add_argument('--batch', type=int, default=5000,
+                            help='Reviews sent per request')
+        parser.add_argument('--timeout', type=float, default=300,
+                            help='Seconds to wait for each batch to be stored')
+
+    def handle(self, *args, **options):
+        reviews = iter_reviews_file(options['path'])
+        received = accepted = failed = 0
+        started = time.monotonic()
+        while True:
+            try:
+                batch = list(islice(reviews, options['batch']))
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Could not read {options['path']}: {error}") from error
+            if not batch:
+                break
+
+            report = post_reviews_bulk(options['url'], batch, timeout=options['timeout'])
+            if report is None:
+                raise CommandError(f"Batch starting at review {received} was not accepted")
+            for error in report['errors'][:MAX_PRINTED_ERRORS]:
+                error['index'] += received
+                self.stderr.write(f"Review {error['index']}: {error.get('error')} "
+                                  f"{error.get('reason') or ''}".rstrip())
+            received += len(batch)
+            accepted += report['accepted']
+            failed += len(report['errors'])
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"{received} reviews sent, {accepted} stored, {failed} failed "
+                              f"({received / elapsed:.0f} docs/sec)")
+
+        elapsed = time.monotonic() - started
+        rate = received / elapsed if elapsed else 0.0
+        self.stdout.write(f"Loaded {accepted} of {received} reviews in {elapsed:.2f}s "
+                          f"({rate:.0f} docs/sec)")
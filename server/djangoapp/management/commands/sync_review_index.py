@@ -0,0 +1,64 @@
+"""
+Management command: sync_review_index
+
+Bring the review search index up to date with the reviews database.
+
+The changes made to the reviews database since the last run are read from the
+get_review_changes endpoint of the reviews service and applied to the local
+index (see djangoapp.search). Run it from cron, or keep it running with --follow.
+
+Usage:
+    python manage.py sync_review_index
+    python manage.py sync_review_index --follow --interval 10
+    python manage.py sync_review_index --rebuild
+"""
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from djangoapp.search import reset_review_index, sync_review_index
+
+
+class Command(BaseCommand):
+    """Apply the latest changes of the reviews database to the search index."""
+
+    help = "Bring the review search index up to date with the reviews database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=f"{settings.REVIEWS_SERVICE_URL}/api/get_review_changes",
+                            help='URL of the get_review_changes endpoint')
+        parser.add_argument('--dealers-url',
+                            default=f"{settings.DEALERSHIPS_SERVICE_URL}/api/dealerships/",
+                            help='URL of the dealerships service')
+        parser.add_argument('--batch', type=int, default=settings.REVIEW_INDEX_SYNC_BATCH,
+                            help='Changes read per request')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Empty the index and read the whole database again')
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep syncing until interrupted')
+        parser.add_argument('--interval', type=float, default=30,
+                            help='Seconds between two syncs with --follow')
+
+    def sync(self, options):
+        """Run one sync and report it; return whether the change feed could be read."""
+        started = time.monotonic()
+        read = sync_review_index(options['url'], options['dealers_url'], options['batch'])
+        if read is None:
+            self.stderr.write(f"Could not read the change feed at {options['url']}")
+            return False
+        self.stdout.write(f"Applied {read} changes in {time.monotonic() - started:.2f}s")
+        return True
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            reset_review_index()
+            self.stdout.write("Emptied the review search index")
+        if not options['follow']:
+            if not self.sync(options):
+                raise CommandError("The review search index was not brought up to date")
+            return
+        try:
+            while True:
+                self.sync(options)
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,99 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+# Full-text index over the review text and car of ReviewDocument (see djangoapp.search).
+# On SQLite it is an FTS5 table kept in step with ReviewDocument by triggers; on
+# PostgreSQL a generated tsvector column with a GIN index.
+SQLITE_INDEX = [
+    """CREATE VIRTUAL TABLE djangoapp_reviewdocument_fts USING fts5(
+        review, car_make, car_model,
+        content='djangoapp_reviewdocument', content_rowid='id',
+        tokenize='porter unicode61')""",
+    """CREATE TRIGGER djangoapp_reviewdocument_fts_insert
+        AFTER INSERT ON djangoapp_reviewdocument BEGIN
+        INSERT INTO djangoapp_reviewdocument_fts(rowid, review, car_make, car_model)
+        VALUES (new.id, new.review, new.car_make, new.car_model);
+        END""",
+    """CREATE TRIGGER djangoapp_reviewdocument_fts_delete
+        AFTER DELETE ON djangoapp_reviewdocument BEGIN
+        INSERT INTO djangoapp_reviewdocument_fts(djangoapp_reviewdocument_fts, rowid,
+                                                 review, car_make, car_model)
+        VALUES ('delete', old.id, old.review, old.car_make, old.car_model);
+        END""",
+    """CREATE TRIGGER djangoapp_reviewdocument_fts_update
+        AFTER UPDATE OF review, car_make, car_model ON djangoapp_reviewdocument BEGIN
+        INSERT INTO djangoapp_reviewdocument_fts(djangoapp_reviewdocument_fts, rowid,
+                                                 review, car_make, car_model)
+        VALUES ('delete', old.id, old.review, old.car_make, old.car_model);
+        INSERT INTO djangoapp_reviewdocument_fts(rowid, review, car_make, car_model)
+        VALUES (new.id, new.review, new.car_make, new.car_model);
+        END""",
+]
+SQLITE_DROP_INDEX = [
+    "DROP TRIGGER djangoapp_reviewdocument_fts_update",
+    "DROP TRIGGER djangoapp_reviewdocument_fts_delete",
+    "DROP TRIGGER djangoapp_reviewdocument_fts_insert",
+    "DROP TABLE djangoapp_reviewdocument_fts",
+]
+POSTGRESQL_INDEX = [
+    """ALTER TABLE djangoapp_reviewdocument ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', car_make || ' ' || car_model), 'A')
+            || setweight(to_tsvector('english', review), 'B')) STORED""",
+    """CREATE INDEX djangoapp_reviewdocument_search_vector
+        ON djangoapp_reviewdocument USING gin (search_vector)""",
+]
+POSTGRESQL_DROP_INDEX = [
+    "ALTER TABLE djangoapp_reviewdocument DROP COLUMN search_vector",
+]
+
+
+def run_for_vendor(sqlite_statements, postgresql_statements):
+    """Return a RunPython function executing the statements of the current database."""
+    def run(apps, schema_editor):
+        statements = {
+            'sqlite': sqlite_statements,
+            'postgresql': postgresql_statements,
+        }.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('review_id', models.CharField(max_length=64, unique=True)),
+                ('dealership', models.IntegerField(db_index=True)),
+                ('state', models.CharField(blank=True, db_index=True, max_length=2)),
+                ('sentiment', models.CharField(db_index=True, max_length=10, null=True)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('review', models.TextField()),
+                ('car_make', models.CharField(blank=True, max_length=50)),
+                ('car_model', models.CharField(blank=True, max_length=50)),
+                ('car_year', models.CharField(blank=True, max_length=10)),
+                ('purchase', models.BooleanField(default=False)),
+                ('time', models.CharField(blank=True, max_length=40)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReviewFeedPosition',
+            fields=[
+                ('feed', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('seq', models.TextField()),
+            ],
+        ),
+        migrations.RunPython(
+            run_for_vendor(SQLITE_INDEX, POSTGRESQL_INDEX),
+            run_for_vendor(SQLITE_DROP_INDEX, POSTGRESQL_DROP_INDEX),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoapp', '0002_review_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='carmodel',
+            name='make',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='djangoapp.carmake'),
+        ),
+        migrations.AddIndex(
+            model_name='carmodel',
+            index=models.Index(fields=['dealer_id'], name='carmodel_dealer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carmodel',
+            index=models.Index(fields=['make', 'year'], name='carmodel_make_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carmodel',
+            index=models.Index(fields=['type', 'year'], name='carmodel_type_year_idx'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+from itertools import starmap
+from operator import itemgetter
 from django.db import models
 from django.utils.timezone import now
 from datetime import datetime  # Remove the second 'datetime' here
@@ -14,7 +16,8 @@ class CarMake(models.Model):
 
 # Create a Car Model model
 class CarModel(models.Model):
-    make = models.ForeignKey(CarMake, null=True, on_delete=models.CASCADE)
+    # Indexed by the (make, year) index below, which also serves lookups on make alone
+    make = models.ForeignKey(CarMake, null=True, on_delete=models.CASCADE, db_index=False)
     dealer_id = models.IntegerField(null=True)  # Fixed typo here
     name = models.CharField(null=False, max_length=50)
     
@@ -61,11 +64,66 @@ class CarModel(models.Model):
     year = models.IntegerField(
         ('year'), choices=YEAR_CHOICES, default=datetime.now().year)
 
+    class Meta:
+        # The access paths of the add review catalog (dealer_id) and of the admin
+        # list filters (make, type and year)
+        indexes = [
+            models.Index(fields=['dealer_id'], name='carmodel_dealer_idx'),
+            models.Index(fields=['make', 'year'], name='carmodel_make_year_idx'),
+            models.Index(fields=['type', 'year'], name='carmodel_type_year_idx'),
+        ]
+
     def __str__(self):
         return self.name + ", " + str(self.year) + ", " + self.type
-        
+
+
+# Local copy of a review held for full-text search (see djangoapp.search)
+class ReviewDocument(models.Model):
+    # Document id of the review in the reviews database
+    review_id = models.CharField(max_length=64, unique=True)
+    dealership = models.IntegerField(db_index=True)
+    # State code of the dealership, copied from the dealer list when indexed
+    state = models.CharField(max_length=2, blank=True, db_index=True)
+    sentiment = models.CharField(max_length=10, null=True, db_index=True)
+    name = models.CharField(max_length=100, blank=True)
+    review = models.TextField()
+    car_make = models.CharField(max_length=50, blank=True)
+    car_model = models.CharField(max_length=50, blank=True)
+    car_year = models.CharField(max_length=10, blank=True)
+    purchase = models.BooleanField(default=False)
+    time = models.CharField(max_length=40, blank=True)
+
+    def __str__(self):
+        return "Reviewer: " + self.name + " Review: " + self.review
+
+
+# How far the search index has read the change feed of the reviews database
+class ReviewFeedPosition(models.Model):
+    feed = models.CharField(max_length=200, primary_key=True)
+    # Opaque update sequence to resume the feed from
+    seq = models.TextField()
+
+    def __str__(self):
+        return self.feed + " at " + self.seq[:20]
+
+
+def iter_rows_from_columns(body, names):
+    """Lazily yield, from a columnar response body, one tuple of the `names` values per row.
+
+    A columnar body holds the field names in ``fields``, one list of values per
+    field in ``columns`` and the number of rows in ``count`` (bodies without it have
+    as many rows as their columns). Fields the body lacks are None in every row.
+    """
+    columns = dict(zip(body["fields"], body["columns"]))
+    count = body.get("count")
+    if count is None:
+        count = len(body["columns"][0]) if body["columns"] else 0
+    return zip(*(columns.get(name) or [None] * count for name in names))
+
 
 class CarDealer:
+    # Slots instead of a per-instance __dict__: the whole dealer set is held per worker
+    __slots__ = ('address', 'city', 'full_name', 'id', 'lat', 'long', 'short_name', 'st', 'zip')
 
     def __init__(self, address, city, full_name, id, lat, long, short_name, st, zip):
         # Dealer address
@@ -90,7 +148,29 @@ class CarDealer:
     def __str__(self):
         return "Dealer name: " + self.full_name
 
+    @classmethod
+    def iter_from_dicts(cls, dealer_dicts):
+        """Lazily build CarDealer objects from an iterable of parsed dealer documents."""
+        fields = itemgetter(*cls.__slots__)
+        return starmap(cls, map(fields, dealer_dicts))
+
+    @classmethod
+    def from_dicts(cls, dealer_dicts):
+        """Build CarDealer objects from a parsed JSON list of dealer documents."""
+        return list(cls.iter_from_dicts(dealer_dicts))
+
+    @classmethod
+    def from_columns(cls, body):
+        """Build CarDealer objects from a columnar response body (format=columns)."""
+        return list(starmap(cls, iter_rows_from_columns(body, cls.__slots__)))
+
 class DealerReview:
+    __slots__ = ('car_make', 'car_model', 'car_year', 'dealership', 'name', 'purchase',
+                 'purchase_date', 'review', 'sentiment')
+    # Review document fields, in the order of the arguments of the constructor
+    FIELDS = ('dealership', 'name', 'purchase', 'review', 'car_make', 'car_model',
+              'car_year', 'purchase_date', 'sentiment')
+
     def __init__(self, dealership, name, purchase, review, car_make=None, car_model=None, car_year=None, purchase_date=None, sentiment="neutral"):
         self.car_make = car_make
         self.car_model = car_model
@@ -104,4 +184,30 @@ class DealerReview:
         self.sentiment = sentiment  # Watson NLU sentiment analysis of review
 
     def __str__(self):
-        return "Reviewer: " + self.name + " Review: " + self.review
\ No newline at end of file
+        return "Reviewer: " + self.name + " Review: " + self.review
+
+    @classmethod
+    def iter_from_dicts(cls, review_dicts):
+        """Lazily build DealerReview objects from an iterable of parsed review documents.
+
+        The car and purchase date fields may be missing and default to None. The
+        sentiment is the label stored by the reviews service, "pending" while it is
+        being computed, or None for reviews stored before labels were.
+        """
+        return (
+            cls(review_dict["dealership"], review_dict["name"], review_dict["purchase"],
+                review_dict["review"], review_dict.get("car_make"), review_dict.get("car_model"),
+                review_dict.get("car_year"), review_dict.get("purchase_date"),
+                review_dict.get("sentiment"))
+            for review_dict in review_dicts
+        )
+
+    @classmethod
+    def from_dicts(cls, review_dicts):
+        """Build DealerReview objects from a parsed JSON list of review documents."""
+        return list(cls.iter_from_dicts(review_dicts))
+
+    @classmethod
+    def from_columns(cls, body):
+        """Build DealerReview objects from a columnar response body (format=columns)."""
+        return list(starmap(cls, iter_rows_from_columns(body, cls.FIELDS)))
@@ -0,0 +1,156 @@
+"""
+Module: nlu
+
+Process-wide holder for the IBM Watson Natural Language Understanding client.
+
+Building a ``NaturalLanguageUnderstandingV1`` per review meant a fresh IAM token
+exchange and a fresh TLS handshake for every call. The holder builds the client
+once per process (and again only if the NLU settings change), keeps its
+``IAMAuthenticator`` so the token manager can reuse the token and refresh it
+ahead of expiry, and sends every call through one pooled keep-alive session.
+
+The SDK's ``analyze`` does not pass a ``timeout`` on to the request in every
+release (ibm-watson 5.2.2 drops it), and ``set_http_config`` would change the
+timeout of every thread sharing the client. The session instead applies the
+timeout set for the calling thread by `NLUClientHolder.call_timeout`.
+
+Usage:
+    from .nlu import nlu_client
+    with nlu_client.call_timeout(2.5):
+        nlu_client.get().analyze(...)
+    nlu_client.metrics()  # {'clients_built': 1, 'token_refreshes': 1, 'connections': 4}
+"""
+import threading
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from ibm_cloud_sdk_core.authenticators import IAMAuthenticator, NoAuthAuthenticator
+from ibm_watson import NaturalLanguageUnderstandingV1
+
+
+class CallTimeoutSession(requests.Session):
+    """Session sending each request with the timeout set for the calling thread, if any."""
+
+    def __init__(self, local):
+        super().__init__()
+        self._local = local
+
+    def request(self, method, url, **kwargs):  # pylint: disable=arguments-differ
+        timeout = getattr(self._local, 'timeout', None)
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        return super().request(method, url, **kwargs)
+
+
+class NLUClientHolder:
+    """
+    Thread-safe, lazily built NLU client shared by every thread of a worker.
+
+    The metrics exposed by `metrics` let us confirm that, under gunicorn, each
+    worker pays for the client, the token exchange and its connections once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._config = None
+        self._adapter = None
+        self._counters = {"clients_built": 0, "token_refreshes": 0}
+        self._local = threading.local()
+
+    @staticmethod
+    def _current_config():
+        """Return the settings the client depends on."""
+        return (settings.NLU_API_KEY, settings.NLU_URL, settings.NLU_VERSION,
+                settings.NLU_POOL_SIZE)
+
+    def _count_token_requests(self, token_manager):
+        """Wrap the token manager so every IAM token exchange is counted."""
+        request_token = token_manager.request_token
+
+        def counted_request_token(*args, **kwargs):
+            with self._lock:
+                self._counters["token_refreshes"] += 1
+            return request_token(*args, **kwargs)
+
+        token_manager.request_token = counted_request_token
+
+    def _build(self, config):
+        """Create the client, its authenticator and its pooled session."""
+        api_key, url, version, pool_size = config
+        if api_key:
+            authenticator = IAMAuthenticator(api_key)
+            self._count_token_requests(authenticator.token_manager)
+        else:
+            authenticator = NoAuthAuthenticator()
+
+        client = NaturalLanguageUnderstandingV1(version=version, authenticator=authenticator)
+        client.set_service_url(url)
+
+        session = CallTimeoutSession(self._local)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        client.set_http_client(session)
+
+        self._adapter = adapter
+        self._counters["clients_built"] += 1
+        return client
+
+    def get(self):
+        """
+        Return the shared NLU client, building it on first use.
+
+        Returns:
+            NaturalLanguageUnderstandingV1: A client safe to share between threads.
+            Bound its calls with `call_timeout` rather than mutating its http config.
+        """
+        config = self._current_config()
+        with self._lock:
+            if self._client is None or self._config != config:
+                self._client = self._build(config)
+                self._config = config
+            return self._client
+
+    @contextmanager
+    def call_timeout(self, timeout):
+        """
+        Apply `timeout` (seconds) to the NLU requests the calling thread makes in the block.
+
+        It bounds the connection and each read, as the ``timeout`` of requests does.
+        """
+        previous = getattr(self._local, 'timeout', None)
+        self._local.timeout = timeout
+        try:
+            yield
+        finally:
+            self._local.timeout = previous
+
+    def metrics(self):
+        """
+        Return how many clients, IAM token exchanges and connections this process made.
+
+        Returns:
+            dict: ``clients_built``, ``token_refreshes`` and ``connections`` counters.
+        """
+        with self._lock:
+            snapshot = dict(self._counters)
+            connections = 0
+            if self._adapter is not None:
+                pools = self._adapter.poolmanager.pools
+                for key in pools.keys():
+                    connections += pools[key].num_connections
+            snapshot["connections"] = connections
+        return snapshot
+
+    def reset(self):
+        """Drop the shared client so the next call builds a new one."""
+        with self._lock:
+            self._client = None
+            self._config = None
+            self._adapter = None
+
+
+# Process-wide client holder used by restapis
+nlu_client = NLUClientHolder()
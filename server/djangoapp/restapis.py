@@ -6,25 +6,105 @@ reviews for car dealerships. It also includes a function to analyze the sentimen
 using IBM Watson Natural Language Understanding.
 
 Functions:
+- get_session(): Return the shared, pooled keep-alive session used for every API call.
 - get_request(url, api_key=False, **kwargs): Make HTTP GET requests to the API.
+- JSONArrayDecoder: Push-style incremental decoder of a JSON array, fed chunk by chunk.
+- iter_json_array(chunks): Incrementally decode a JSON array from a stream of byte chunks.
+- iter_request(url, api_key=False, response_headers=None, **kwargs): Make an HTTP GET request
+  and yield the elements of its JSON array body as they arrive.
 - post_request(url, json_payload, **kwargs): Make HTTP POST requests to the API.
+- post_reviews_bulk(url, reviews, timeout=None, **kwargs): Send many reviews at once to
+  the bulk ingest endpoint as NDJSON.
+- objects_from_body(model, body): Build model objects from a list of documents or a
+  columnar response body.
 - get_dealers_from_cf(url, **kwargs): Get a list of dealerships from the function.
-- get_dealer_by_id(url, dealer_id, **kwargs): Get a specific dealership by ID from the function.
-- get_dealers_by_state(url, state, **kwargs): Get dealerships by state from the cloud function.
-- get_dealer_reviews_from_cf(url, dealer_id, **kwargs): Get reviews for a specific dealership
-  from the cloud function.
+- iter_dealers_from_cf(url, **kwargs): Yield dealerships from the function as they are parsed.
+- get_dealer_by_id(url, dealer_id, **kwargs): Get a specific dealership by ID from the
+  local dealership store.
+- get_dealers_by_state(url, state, **kwargs): Get dealerships by state from the local
+  dealership store.
+- get_nearest_dealers(url, lat, long, k=5, radius=None): Get the dealerships closest to a
+  location from the local dealership store.
+- score_reviews(results): Set the sentiment of the reviews stored without one.
+- get_dealer_reviews_from_cf(url, dealer_id, limit=None, **kwargs): Get reviews for a specific
+  dealership from the cloud function.
+- get_dealer_reviews_page_from_cf(url, dealer_id, page_size=None, bookmark=None, sort=None):
+  Get one page of reviews for a specific dealership, with the bookmark of the next page.
+- iter_dealer_reviews_from_cf(url, dealer_id, **kwargs): Yield the reviews of a dealership
+  as they are parsed.
+- get_dealer_review_summary(url, dealer_id): Get the precomputed review statistics of a
+  dealership.
 - analyze_review_sentiments(dealerreview): Analyze the sentiment of a review using
-  IBM Watson Natural Language Understanding.
+  IBM Watson Natural Language Understanding, or the local engine (see `sentiment`).
+- analyze_review_sentiments_batch(texts): Score many reviews concurrently under a shared
+  deadline, falling back to the fallback backend or "neutral" for the ones that miss it.
+- dealer_store: Read-through, TTL-refreshed copy of the dealer list indexed by id and state.
 Usage:
 - Import this module to use its functions for handling dealership reviews and sentiment analysis.
+- Async views use the async counterparts of the service calls in `async_restapis`.
 """
+import codecs
 import json
+import threading
+import time
+from itertools import islice
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-from ibm_watson import NaturalLanguageUnderstandingV1
-from ibm_watson.natural_language_understanding_v1 import Features, SentimentOptions
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from django.conf import settings
+from .dealer_store import DealerStore
 from .models import CarDealer, DealerReview
+from .sentiment import get_sentiment_backend
+from .sentiment_cache import sentiment_cache
+from .validator_cache import validator_cache
+
+# Shared session used by `get_request` and `post_request`, created on first use
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Return the process-wide HTTP session used to call the dealership and review services.
+
+    The session keeps connections alive between calls, so a dealer page no longer pays
+    a TCP and TLS handshake per fetch. Its adapter keeps up to ``settings.RESTAPI_POOL_SIZE``
+    connections per host and retries idempotent GETs with exponential backoff on
+    connection errors and 502/503/504 answers. POSTs are only retried when the
+    connection could not be established, so a review is never stored twice.
+
+    Responses are compressed by the services when the client accepts it: requests
+    sends ``Accept-Encoding: gzip, deflate`` and, with the ``brotli`` package
+    installed, ``br``, and decodes the body transparently.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(
+                total=settings.RESTAPI_GET_RETRIES,
+                backoff_factor=settings.RESTAPI_RETRY_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=settings.RESTAPI_POOL_HOSTS,
+                pool_maxsize=settings.RESTAPI_POOL_SIZE,
+                max_retries=retries,
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+def _request_timeout():
+    """Return the (connect, read) timeout applied to every API call."""
+    return (settings.RESTAPI_CONNECT_TIMEOUT, settings.RESTAPI_READ_TIMEOUT)
 
 # Create a `get_request` function to make HTTP GET requests
 def get_request(url,api_key=False, **kwargs):
@@ -49,33 +129,195 @@ def get_request(url,api_key=False, **kwargs):
 
     Note:
         This function handles network exceptions and returns None in case of an error.
+        Requests go through `get_session`, so connections are reused and transient
+        failures are retried. Tagged responses are revalidated with ``If-None-Match``
+        (see `validator_cache`); on a 304 the body parsed last time is returned, which
+        callers must not modify.
     """
-    if api_key:
-        try:
-            response = requests.get(url, headers={'Content-Type': 'application/json'},
-                                    params=kwargs, auth=HTTPBasicAuth('apikey', api_key)) 
-        except:
-            print('An error occured while making a get request')
-    else:
-        try:
-            # Call the get method of the requests library with URL and parameters
-            response = requests.get(url, headers={'Content-Type': 'application/json'}, params=kwargs)
-        except requests.exceptions.RequestException as request_exception:
-            # Handle network or request exceptions
-            print("Network exception occurred:", str(request_exception))
-            return None
-    
+    auth = HTTPBasicAuth('apikey', api_key) if api_key else None
+    headers = {'Content-Type': 'application/json'}
+    headers.update(validator_cache.request_headers(url, kwargs))
+    try:
+        # Call the get method of the shared session with URL and parameters
+        response = get_session().get(url, headers=headers,
+                                     params=kwargs, auth=auth, timeout=_request_timeout())
+    except requests.exceptions.RequestException as request_exception:
+        # Handle network or request exceptions
+        print("Network exception occurred:", str(request_exception))
+        return None
+
     status_code = response.status_code
     print("With status {} ".format(status_code))
-    
+
+    if status_code == 304:
+        # Our copy is current: reuse it rather than download and parse it again
+        cached = validator_cache.not_modified(url, kwargs)
+        if cached is not None:
+            return cached.body
     if response.status_code == 200:
         # Parse JSON response into a Python dictionary
         json_data = response.json()
+        validator_cache.store(url, kwargs, response.headers.get('ETag'), response.headers,
+                              json_data)
         return json_data
     else:
         print("Failed to fetch data. Status code:", status_code)
         return None
 
+# Whitespace and separators skipped between the elements of a streamed JSON array
+_ARRAY_FILLER = ' \t\r\n,'
+# Characters a JSON number may continue with
+_NUMBER_CHARACTERS = '0123456789.eE+-'
+
+class JSONArrayDecoder:
+    """
+    Push-style incremental decoder of a top-level JSON array.
+
+    Body chunks are fed as they are received and every element they complete is
+    returned at once. Only the undecoded tail of the body is kept in memory, so peak
+    memory depends on the size of one element rather than on the size of the whole
+    body. Used by `iter_json_array` and by the async client of `async_restapis`.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._started = False
+        self.finished = False
+
+    def feed(self, chunk, final=False):
+        """
+        Add a chunk of the body and return the elements it completed.
+
+        Args:
+            chunk (bytes): The next UTF-8 encoded chunk of the body.
+            final (bool, optional): True once the body has been fully received.
+
+        Returns:
+            list: The elements completed by this chunk, in order.
+
+        Raises:
+            ValueError: If the body is not a JSON array, or is truncated when `final`.
+        """
+        buffer = self._buffer + self._text_decoder.decode(chunk, final=final)
+        position = 0
+        elements = []
+        while not self.finished:
+            while position < len(buffer) and buffer[position] in _ARRAY_FILLER:
+                position += 1
+            if position == len(buffer):
+                break
+            if not self._started:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                self._started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                self.finished = True
+                break
+            try:
+                element, end = self._decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            # An element ending exactly at the buffer end may continue in the next chunk,
+            # and so may a number followed only by the start of a fraction or exponent
+            # ("-3." then "5")
+            if not final and (end == len(buffer) or (
+                    isinstance(element, (int, float)) and not isinstance(element, bool)
+                    and not buffer[end:].lstrip(_NUMBER_CHARACTERS))):
+                break
+            elements.append(element)
+            position = end
+        self._buffer = buffer[position:]
+        if final and not self.finished:
+            raise ValueError('Truncated JSON array')
+        return elements
+
+def iter_json_array(chunks):
+    """
+    Incrementally decode a top-level JSON array from a stream of byte chunks.
+
+    Args:
+        chunks (iterable): UTF-8 encoded byte chunks, for example ``response.iter_content()``.
+
+    Yields:
+        object: Each element of the array, as soon as it has been fully received.
+
+    Raises:
+        ValueError: If the body is not a JSON array or is truncated.
+    """
+    decoder = JSONArrayDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+        if decoder.finished:
+            return
+    yield from decoder.feed(b'', final=True)
+
+def iter_request(url, api_key=False, response_headers=None, **kwargs):
+    """
+    Make an HTTP GET request and yield the elements of its JSON array body as they arrive.
+
+    This is the streaming counterpart of `get_request`: the body is parsed while it is
+    downloaded instead of being loaded whole, and the caller may stop iterating at any
+    point, which closes the response.
+
+    Args:
+        url (str): The URL to send the GET request to.
+        api_key (str, optional): An API key for authentication (default is False).
+        response_headers (dict, optional): Filled with the response headers once they
+            have been received.
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Yields:
+        object: Each element of the JSON array returned by the URL. Nothing is yielded
+        if the request fails or does not return status 200. Like `get_request`, a
+        tagged body read to the end is revalidated next time, and on a 304 its elements
+        are yielded again, as read-only objects.
+    """
+    auth = HTTPBasicAuth('apikey', api_key) if api_key else None
+    headers = {'Content-Type': 'application/json'}
+    headers.update(validator_cache.request_headers(url, kwargs))
+    try:
+        response = get_session().get(url, headers=headers,
+                                     params=kwargs, auth=auth, timeout=_request_timeout(),
+                                     stream=True)
+    except requests.exceptions.RequestException as request_exception:
+        print("Network exception occurred:", str(request_exception))
+        return
+
+    try:
+        status_code = response.status_code
+        print("With status {} ".format(status_code))
+        cached = validator_cache.not_modified(url, kwargs) if status_code == 304 else None
+        if response_headers is not None:
+            if cached is not None:
+                response_headers.update(cached.headers)
+            response_headers.update(response.headers)
+        if cached is not None:
+            yield from cached.body
+            return
+        if status_code != 200:
+            print("Failed to fetch data. Status code:", status_code)
+            return
+        # Keep the elements of a tagged body, to reuse them when it is not modified
+        etag = response.headers.get('ETag')
+        elements = [] if etag else None
+        try:
+            for element in iter_json_array(
+                    response.iter_content(chunk_size=settings.RESTAPI_STREAM_CHUNK_SIZE)):
+                if elements is not None:
+                    elements.append(element)
+                yield element
+        except (ValueError, requests.exceptions.RequestException) as stream_exception:
+            print("An error occurred while streaming the response:", str(stream_exception))
+            return
+        # Only a body read to the end is kept
+        validator_cache.store(url, kwargs, etag, response.headers, elements)
+    finally:
+        response.close()
+
 # Function for making HTTP POST requests
 def post_request(url, json_payload, **kwargs):
     """
@@ -94,12 +336,61 @@ def post_request(url, json_payload, **kwargs):
         Response: An HTTP response object containing the server's response to the request.
     """
     try:
-        response = requests.post(url, params=kwargs, json=json_payload['review'])
+        response = get_session().post(url, params=kwargs, json=json_payload['review'],
+                                      timeout=_request_timeout())
         response.raise_for_status()
     except requests.exceptions.RequestException as request_exception:
         print("An error occurred while making POST request:", str(request_exception))
     return response
 
+def post_reviews_bulk(url, reviews, timeout=None, **kwargs):
+    """
+    Send many reviews to the bulk ingest endpoint of the cloud function.
+
+    The reviews are sent as NDJSON, one review per line, and the body is encoded while
+    it is being sent rather than built in memory first.
+
+    Args:
+        url (str): The URL of the ``post_reviews`` endpoint.
+        reviews (iterable): Review dictionaries to store.
+        timeout (float, optional): Seconds to wait for the response once the body is sent
+            (default is ``settings.RESTAPI_READ_TIMEOUT``).
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Returns:
+        dict or None: The ingest report (``received``, ``accepted`` and per-review
+        ``errors``), or None if the request fails.
+    """
+    body = (json.dumps(review).encode('utf-8') + b'\n' for review in reviews)
+    try:
+        response = get_session().post(
+            url, params=kwargs, data=body,
+            headers={'Content-Type': 'application/x-ndjson'},
+            timeout=(settings.RESTAPI_CONNECT_TIMEOUT, timeout or settings.RESTAPI_READ_TIMEOUT))
+        response.raise_for_status()
+    except requests.exceptions.RequestException as request_exception:
+        print("An error occurred while posting reviews:", str(request_exception))
+        return None
+    return response.json()
+
+def objects_from_body(model, body):
+    """
+    Build model objects from a parsed response body of the dealership or review services.
+
+    Args:
+        model: CarDealer or DealerReview.
+        body (list or dict): A list of documents, or a columnar body (format=columns),
+            which is decoded without building an intermediate dict per document.
+
+    Returns:
+        list: The model objects, empty if the body is None.
+    """
+    if body is None:
+        return []
+    if isinstance(body, list):
+        return model.from_dicts(body)
+    return model.from_columns(body)
+
 # Create a function `get_dealers_from_cf` to get dealers from a cloud function
 def get_dealers_from_cf(url, **kwargs):
     """
@@ -117,216 +408,313 @@ def get_dealers_from_cf(url, **kwargs):
         list: A list of CarDealer objects representing the dealers retrieved from the function.
 
     Note:
-        This function relies on the `get_request` function to make the HTTP GET request.
-    """
-
-    results = []
-    # Call get_request with a URL parameter
-    json_result = get_request(url)
-    if json_result:
-        # Iterate through the list of dealer dictionaries
-        for dealer_dict in json_result:
-            # Create a CarDealer object with values from the dealer dictionary
-            dealer_obj = CarDealer(
-                address=dealer_dict["address"],
-                city=dealer_dict["city"],
-                full_name=dealer_dict["full_name"],
-                id=dealer_dict["id"],
-                lat=dealer_dict["lat"],
-                long=dealer_dict["long"],
-                short_name=dealer_dict["short_name"],
-                st=dealer_dict["st"],
-                zip=dealer_dict["zip"]
-            )
-            results.append(dealer_obj)
-    return results
+        This function relies on the `iter_dealers_from_cf` function to stream the response,
+        unless ``settings.RESTAPI_RESPONSE_FORMAT`` is "columns": the compact columnar
+        list is then requested and decoded whole.
+    """
+    if settings.RESTAPI_RESPONSE_FORMAT == 'columns':
+        body = get_request(url, format='columns', fields=','.join(CarDealer.__slots__))
+        return objects_from_body(CarDealer, body)
+    # Build CarDealer objects while the list is streamed from the cloud function
+    return list(iter_dealers_from_cf(url))
+
+def iter_dealers_from_cf(url, **kwargs):
+    """
+    Yield dealers from a cloud function as they are parsed from the response.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Yields:
+        CarDealer: Each dealer returned by the function. Closing the generator early
+        closes the response.
+    """
+    documents = iter_request(url, **kwargs)
+    try:
+        yield from CarDealer.iter_from_dicts(documents)
+    finally:
+        documents.close()
+
+# Read-through store serving `get_dealer_by_id` and `get_dealers_by_state`
+dealer_store = DealerStore(get_dealers_from_cf)
 
 def get_dealer_by_id(url, dealer_id, **kwargs):
     """
-    Retrieve a dealer by ID from a cloud function using HTTP GET.
+    Retrieve a dealer by ID from the local dealership store.
 
-    This function sends an HTTP GET request to the specified URL with the `dealer_id` parameter
-    to retrieve details of a dealer with the given ID from a cloud function. It then processes
-    the JSON response and creates a CarDealer object representing the retrieved dealer.
+    The dealer is looked up in the id index of `dealer_store`, which is filled from the
+    cloud function by `get_dealers_from_cf` and refreshed every ``settings.DEALER_STORE_TTL``
+    seconds, so no request reaches the dealerships service while the store is fresh.
 
     Args:
-        url (str): The URL of the cloud function endpoint.
+        url (str): The URL of the cloud function endpoint. Any query string is ignored.
         dealer_id (int): The ID of the dealer to retrieve.
-        **kwargs: Additional keyword arguments to be passed to the `get_request` function.
+        **kwargs: Unused, kept for compatibility with the other helpers.
 
     Returns:
-        list: A list containing a single CarDealer object representing the retrieved dealer.
+        list: A list containing a single CarDealer object representing the retrieved dealer,
+        or an empty list if the dealer is unknown.
 
     Note:
-        This function relies on the `get_request` function to make the HTTP GET request.
-
-    """
-    results = []
-    # Define the URL with the dealerId parameter
-    url_with_id = f"{url}?id={int(dealer_id)}"
-    # Call get_request with the updated URL
-    json_result = get_request(url_with_id, **kwargs)
-    if json_result:
-        # Iterate through the list of dealer dictionaries
-        for dealer_dict in json_result:
-            # Create a CarDealer object with values from the dealer dictionary
-            dealer_obj = CarDealer(
-                address=dealer_dict["address"],
-                city=dealer_dict["city"],
-                full_name=dealer_dict["full_name"],
-                id=dealer_dict["id"],
-                lat=dealer_dict["lat"],
-                long=dealer_dict["long"],
-                short_name=dealer_dict["short_name"],
-                st=dealer_dict["st"],
-                zip=dealer_dict["zip"]
-            )
-            results.append(dealer_obj)
-    return results
+        This function relies on `dealer_store` to load and index the dealers.
+
+    """
+    dealer = dealer_store.get_by_id(url, dealer_id)
+    return [dealer] if dealer is not None else []
 
 def get_dealers_by_state(url, state, **kwargs):
     """
-    Retrieve a list of dealers in a specific state from a cloud function using HTTP GET.
+    Retrieve a list of dealers in a specific state from the local dealership store.
 
-    This function sends an HTTP GET request to the specified URL with the `state` parameter
-    to retrieve a list of dealers located in the given state from a cloud function. It then
-    processes the JSON response and creates CarDealer objects for each dealer in the list.
+    The dealers are looked up in the state index of `dealer_store`, which is filled from
+    the cloud function by `get_dealers_from_cf` and refreshed every
+    ``settings.DEALER_STORE_TTL`` seconds.
 
     Args:
-        url (str): The URL of the cloud function endpoint.
-        state (str): The name of the state for which to retrieve dealers.
-        **kwargs: Additional keyword arguments to be passed to the `get_request` function.
+        url (str): The URL of the cloud function endpoint. Any query string is ignored.
+        state (str): The two-letter code of the state (for example "TX").
+        **kwargs: Unused, kept for compatibility with the other helpers.
 
     Returns:
         list: A list containing CarDealer objects representing the dealers in the specified state.
 
     Note:
-        This function relies on the `get_request` function to make the HTTP GET request.
-    """
-    results = []
-    # Define the URL with the state parameter
-    url_with_state = f"{url}?state={state}"
-    # Call get_request with the updated URL
-    json_result = get_request(url_with_state, **kwargs) 
-    if json_result:
-        # Iterate through the list of dealer dictionaries
-        for dealer_dict in json_result:
-            # Create a CarDealer object with values from the dealer dictionary
-            dealer_obj = CarDealer(
-                address=dealer_dict["address"],
-                city=dealer_dict["city"],
-                full_name=dealer_dict["full_name"],
-                id=dealer_dict["id"],
-                lat=dealer_dict["lat"],
-                long=dealer_dict["long"],
-                short_name=dealer_dict["short_name"],
-                st=dealer_dict["st"],
-                zip=dealer_dict["zip"]
-            )
-            results.append(dealer_obj)
-    print('results', results)
+        This function relies on `dealer_store` to load and index the dealers.
+    """
+    return dealer_store.get_by_state(url, state)
+
+def get_nearest_dealers(url, lat, long, k=5, radius=None):
+    """
+    Retrieve the dealers closest to a location from the local dealership store.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        lat (float): Latitude of the location, in degrees.
+        long (float): Longitude of the location, in degrees.
+        k (int, optional): Maximum number of dealers to return (default is 5).
+        radius (float, optional): Only return dealers within this many kilometres.
+
+    Returns:
+        list: Up to `k` (CarDealer, distance in km) pairs, closest first.
+    """
+    return dealer_store.get_nearest(url, lat, long, k, radius)
+
+# Review document fields used to build a DealerReview
+REVIEW_FIELDS = DealerReview.FIELDS
+
+def score_reviews(results):
+    """
+    Set the sentiment of the reviews that were stored without one.
+
+    The reviews service labels new reviews when they are posted, so most reviews
+    arrive with their sentiment (or "pending") and are left as they are. Older
+    reviews are scored here, in one batch served mostly from the sentiment cache.
+    """
+    unscored = [review_obj for review_obj in results if review_obj.sentiment is None]
+    if unscored:
+        # Score every review on the page at once instead of one NLU round trip after another
+        sentiments = analyze_review_sentiments_batch(
+            [review_obj.review for review_obj in unscored])
+        for review_obj, sentiment in zip(unscored, sentiments):
+            review_obj.sentiment = sentiment
     return results
 
-# Create a function `get_dealers_from_cf` to get dealers from a cloud function
-def get_dealer_reviews_from_cf(url, dealer_id, **kwargs):
+# Create a function `get_dealer_reviews_from_cf` to get reviews from a cloud function
+def get_dealer_reviews_from_cf(url, dealer_id, limit=None, **kwargs):
     """
-    Retrieve a list of dealers in a specific state from a cloud function using HTTP GET.
+    Retrieve the reviews of a dealer from a cloud function using HTTP GET.
 
-    This function sends an HTTP GET request to the specified URL with the `state` parameter
-    to retrieve a list of dealers located in the given state from a cloud function. It then
-    processes the JSON response and creates CarDealer objects for each dealer in the list.
+    This function streams the reviews of the dealer with the given ID from the cloud
+    function, creates a DealerReview object for each of them and scores, in one batch,
+    those that were stored without a sentiment. With a `limit`, the response is closed as soon as enough reviews have
+    been read.
 
     Args:
         url (str): The URL of the cloud function endpoint.
-        state (str): The name of the state for which to retrieve dealers.
-        **kwargs: Additional keyword arguments to be passed to the `get_request` function.
+        dealer_id (int): The ID of the dealer whose reviews are requested.
+        limit (int, optional): Maximum number of reviews to read (default is all of them).
+        **kwargs: Additional keyword arguments sent as query parameters.
 
     Returns:
-        list: A list containing CarDealer objects representing the dealers in the specified state.
+        list: A list containing DealerReview objects with their sentiment set.
 
     Note:
-        This function relies on the `get_request` function to make the HTTP GET request.
+        This function relies on the `iter_dealer_reviews_from_cf` function to stream the
+        response.
+    """
+    # Read the reviews as they are streamed, stopping early once `limit` is reached
+    reviews = iter_dealer_reviews_from_cf(url, dealer_id, **kwargs)
+    try:
+        results = list(islice(reviews, limit))
+    finally:
+        reviews.close()
+    return score_reviews(results)
+
+def get_dealer_reviews_page_from_cf(url, dealer_id, page_size=None, bookmark=None, sort=None):
+    """
+    Retrieve one page of the reviews of a dealer from a cloud function.
+
+    Only the fields needed to build a DealerReview are requested, in the format set by
+    ``settings.RESTAPI_RESPONSE_FORMAT``, and the reviews of the page stored without a
+    sentiment are scored in one batch.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        dealer_id (int): The ID of the dealer whose reviews are requested.
+        page_size (int, optional): Number of reviews per page
+            (default is ``settings.REVIEWS_PAGE_SIZE``).
+        bookmark (str, optional): Bookmark returned with the previous page.
+        sort (str, optional): 'time' for oldest first or '-time' for newest first.
+
+    Returns:
+        tuple: The list of DealerReview objects of the page, and the bookmark of the next
+        page or None when this is the last one.
+    """
+    params = {
+        'limit': page_size or settings.REVIEWS_PAGE_SIZE,
+        'fields': ','.join(REVIEW_FIELDS),
+    }
+    if bookmark:
+        params['bookmark'] = bookmark
+    if sort:
+        params['sort'] = sort
+
+    if settings.RESTAPI_RESPONSE_FORMAT == 'columns':
+        body = get_request(f"{url}?id={dealer_id}", dealerId=dealer_id, format='columns',
+                           **params)
+        bookmark = body.get('bookmark') if isinstance(body, dict) else None
+        return score_reviews(objects_from_body(DealerReview, body)), bookmark
+
+    response_headers = CaseInsensitiveDict()
+    reviews = iter_dealer_reviews_from_cf(url, dealer_id, response_headers=response_headers,
+                                          **params)
+    try:
+        results = list(reviews)
+    finally:
+        reviews.close()
+    return score_reviews(results), response_headers.get('X-Bookmark')
+
+def iter_dealer_reviews_from_cf(url, dealer_id, response_headers=None, **kwargs):
+    """
+    Yield the reviews of a dealer as they are parsed from the cloud function response.
+
+    The reviews are not scored; their sentiment is the stored label, if any.
+
+    Args:
+        url (str): The URL of the cloud function endpoint.
+        dealer_id (int): The ID of the dealer whose reviews are requested.
+        response_headers (dict, optional): Filled with the response headers.
+        **kwargs: Additional keyword arguments sent as query parameters.
+
+    Yields:
+        DealerReview: Each review returned by the function. Closing the generator early
+        closes the response.
     """
-    results = []
     url_with_id = f"{url}?id={dealer_id}"
-    # Make a GET request to retrieve reviews for the specified dealer ID
-    json_result = get_request(url_with_id, dealerId=dealer_id)
-    if json_result:
-        # Iterate through the list of review dictionaries
-        for review_dict in json_result:
-            # Create a DealerReview object with values from the review dictionary
-            dealership=review_dict["dealership"]
-            name=review_dict["name"]
-            purchase=review_dict["purchase"]
-            review=review_dict["review"]
-            purchase_date=review_dict["purchase"]
-            try:
-                # These values may be missing
-                car_make = review_dict["car_make"]
-                car_model = review_dict["car_model"]
-                car_year = review_dict["car_year"]
-                purchase_date = review_dict["purchase_date"]
-
-                # Creating a review object
-                review_obj = DealerReview(dealership=dealership, name=name,
-                                          purchase=purchase, review=review, car_make=car_make,
-                                          car_model=car_model, car_year=car_year,
-                                          purchase_date=purchase_date
-                                          )
-
-            except KeyError:
-                # Creating a review object with some default values
-                review_obj = DealerReview(
-                    dealership=dealership, id=id, name=name, purchase=purchase, review=review)
-            review_obj.sentiment = analyze_review_sentiments(review_obj.review)['sentiment']['document']['label']
-            print(f"sentiment: {review_obj.sentiment}")
-            results.append(review_obj)
-    return results
+    documents = iter_request(url_with_id, response_headers=response_headers,
+                             dealerId=dealer_id, **kwargs)
+    try:
+        # The car and purchase date values may be missing
+        yield from DealerReview.iter_from_dicts(documents)
+    finally:
+        documents.close()
+
+# Get the review summary of a dealer from a cloud function
+def get_dealer_review_summary(url, dealer_id):
+    """
+    Retrieve the precomputed review summary of a dealer from the cloud function.
+
+    The summary is maintained as reviews are posted, so fetching it costs one document
+    read however many reviews the dealer has.
+
+    Args:
+        url (str): The URL of the review summary endpoint.
+        dealer_id (int): The ID of the dealer.
+
+    Returns:
+        dict or None: ``review_count``, ``purchase_ratio``, ``sentiments``, ``top_makes``,
+        ``top_models`` and ``latest_time``, or None if the request fails.
+    """
+    return get_request(url, id=dealer_id)
 
 # Calls the Watson NLU API and analyses the sentiment of a review
-def analyze_review_sentiments(dealerreview):
+def analyze_review_sentiments(dealerreview, timeout=None):
     """
-    Analyze the sentiment of a given review using the IBM Watson NLU service.
-    This function uses the IBM Watson NLU service to perform sentiment analysis
-    on a given review text. It requires an IBM API key and service URL to access the NLU service.
+    Analyze the sentiment of a given review using the configured sentiment backend.
+    By default this is the IBM Watson NLU service; with ``settings.SENTIMENT_BACKEND``
+    set to "local", the review is scored in process by the lexicon engine of
+    `sentiment`, which answers in the same shape.
 
     Args:
         dealerreview (str): The text of the review to be analyzed for sentiment.
+        timeout (float, optional): Seconds to wait for the NLU service before giving up
+            (default is ``settings.SENTIMENT_CALL_TIMEOUT``).
 
     Returns:
         dict: A dictionary containing sentiment analysis results.
-        The dictionary typically includes sentiment labels and scores.
+        The dictionary typically includes sentiment labels and scores. None if the
+        call failed or was refused at once because the NLU circuit breaker is open.
 
     Example:
         sentiment = analyze_review_sentiments("This is a positive review.")
-        print(sentiment)
+        label = sentiment["sentiment"]["document"]["label"] if sentiment else None
 
     Note:
-        To use this function, you need to have the IBM Watson NLU service set up
-        and provide your API key and
-        service URL in the function.
+        The NLU client comes from `nlu.nlu_client`, built once per process from
+        ``settings.NLU_API_KEY`` and ``settings.NLU_URL``. An empty API key skips IAM
+        authentication, which is what the local stub used by ``manage.py bench_sentiment``
+        expects.
     """
-    # Define your IBM Watson NLU API key and service URL
-    ibm_api_key = 'Zz6gG6Cnxeas-YNOqFvDuznFt1UU-IYcnZyO8ywowoRI'
-    ibm_service_url = 'https://api.us-south.natural-language-understanding.watson.cloud.ibm.com/instances/d3f3cb64-9a75-4cc2-9426-e4679e8d8981'
+    return get_sentiment_backend().analyze(dealerreview, timeout=timeout)
 
-    try:
-        # Initialize the IBM Watson NLU client
-        authenticator = IAMAuthenticator(ibm_api_key)
-        natural_language_understanding = NaturalLanguageUnderstandingV1(
-            version='2022-04-07',
-            authenticator=authenticator
-        )
-        natural_language_understanding.set_service_url(ibm_service_url)
-
-        # Analyze sentiment using the SDK
-        response = natural_language_understanding.analyze(
-            text=dealerreview,
-            features=Features(sentiment=SentimentOptions())
-        ).get_result()
-
-        return response
-
-    except Exception as exception:
-        print('An error occurred while analyzing sentiments:', str(exception))
-        return None
+def analyze_review_sentiments_batch(texts, timeout=None, deadline=None):
+    """
+    Analyze the sentiment of several reviews at once with the configured sentiment backend.
+
+    With the NLU backend, labels already in the sentiment cache are served from it.
+    Every remaining review is submitted to a bounded thread pool at once, so the time
+    taken grows with the slowest NLU call rather than with the sum of all calls, and
+    the fresh labels are written back to the cache. The local backend scores the
+    whole batch in process and skips the cache.
+
+    Args:
+        texts (list): The review texts to score.
+        timeout (float, optional): Per-call timeout in seconds
+            (default is ``settings.SENTIMENT_CALL_TIMEOUT``).
+        deadline (float, optional): Overall budget in seconds for the whole batch
+            (default is ``settings.SENTIMENT_DEADLINE``).
+
+    Returns:
+        list: One sentiment label per text, in the same order. Reviews that fail or
+        are still running when the deadline passes are labelled by
+        ``settings.SENTIMENT_FALLBACK_BACKEND`` if set, and otherwise get
+        ``settings.SENTIMENT_DEFAULT_LABEL``.
+    """
+    if not texts:
+        return []
+
+    started = time.monotonic()
+    backend = get_sentiment_backend()
+    cached = sentiment_cache.get_many(texts) if backend.cacheable else {}
+    pending = list(dict.fromkeys(text for text in texts if text not in cached))
+
+    scored = {text: label
+              for text, label in zip(pending, backend.labels(pending, timeout, deadline))
+              if label is not None}
+    if backend.cacheable:
+        # Only real answers are cached; the other reviews are retried on the next view
+        sentiment_cache.set_many(scored)
+
+    missed = [text for text in pending if text not in scored]
+    fallback = settings.SENTIMENT_FALLBACK_BACKEND
+    if missed and fallback and fallback != backend.name:
+        scored.update(zip(missed, get_sentiment_backend(fallback).labels(missed)))
+        print("{} of {} reviews labelled by the {} backend".format(
+            len(missed), len(texts), fallback))
+
+    labels = [cached.get(text) or scored.get(text) or settings.SENTIMENT_DEFAULT_LABEL
+              for text in texts]
+    print("Scored {} reviews ({} cached) in {:.3f}s".format(
+        len(texts), len(cached), time.monotonic() - started))
+    return labels
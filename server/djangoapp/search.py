@@ -0,0 +1,213 @@
+"""
+Module: search
+
+Full-text search over the reviews of every dealership.
+
+The reviews service can only list the reviews of one dealership. The search index
+keeps a local copy of every review in the ``ReviewDocument`` table, with an
+inverted index over the review text, car make and car model: an FTS5 table on
+SQLite, a tsvector column with a GIN index on PostgreSQL (see the
+``0002_review_search`` migration). A query reads the matching rows from the
+inverted index and ranks them, BM25 on SQLite and ``ts_rank`` on PostgreSQL, with
+matches on the car weighing more than matches in the text.
+
+The copy follows the reviews database through its change feed: `sync_review_index`
+applies the changes since the last sync (see the sync_review_index management
+command), and add_review indexes the review it posts straight away so that its
+author finds it at once.
+
+Usage:
+    from .search import search_reviews
+    reviews, has_more = search_reviews("battery range", state="TX", sentiment="positive")
+"""
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.utils import NotSupportedError
+from .models import ReviewDocument, ReviewFeedPosition
+from .restapis import dealer_store, get_request
+
+# Words of a query; anything else, FTS operators included, is ignored
+QUERY_TERM = re.compile(r'\w+')
+MAX_QUERY_TERMS = 16
+# BM25 weights of the review, car_make and car_model columns of the FTS5 table
+FTS_COLUMN_WEIGHTS = (1.0, 4.0, 4.0)
+
+
+def match_expression(query):
+    """
+    Return the FTS5 query matching the reviews that hold every word of a user query.
+
+    Each word is quoted, so that user input is never read as FTS5 syntax.
+
+    Returns:
+        str or None: The MATCH expression, or None if the query has no word.
+    """
+    terms = QUERY_TERM.findall(query.lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def _filter_clauses(dealer_id, state, sentiment):
+    """Return the SQL conditions and parameters restricting a search."""
+    clauses, params = '', []
+    if dealer_id is not None:
+        clauses += ' AND d.dealership = %s'
+        params.append(int(dealer_id))
+    if state:
+        clauses += ' AND d.state = %s'
+        params.append(state.upper())
+    if sentiment:
+        clauses += ' AND d.sentiment = %s'
+        params.append(sentiment)
+    return clauses, params
+
+
+def search_reviews(query, dealer_id=None, state=None, sentiment=None, limit=None, offset=0):
+    """
+    Return the indexed reviews best matching a query.
+
+    Args:
+        query (str): Words to look for in the review text, car make and car model.
+        dealer_id (int, optional): Only return reviews of this dealership.
+        state (str, optional): Only return reviews of dealerships in this state code.
+        sentiment (str, optional): Only return reviews with this sentiment label.
+        limit (int, optional): Maximum number of reviews to return
+            (default is ``settings.REVIEW_SEARCH_PAGE_SIZE``).
+        offset (int, optional): Number of best matches to skip (default is 0).
+
+    Returns:
+        tuple: The matching ReviewDocument objects, best first, each with its ``score``,
+        and whether more matches follow them.
+
+    Raises:
+        NotSupportedError: If the database is neither SQLite nor PostgreSQL.
+    """
+    limit = limit or settings.REVIEW_SEARCH_PAGE_SIZE
+    clauses, filter_params = _filter_clauses(dealer_id, state, sentiment)
+    if connection.vendor == 'sqlite':
+        match = match_expression(query)
+        if match is None:
+            return [], False
+        weights = ', '.join(str(weight) for weight in FTS_COLUMN_WEIGHTS)
+        # bm25() is lower for better matches
+        sql = (f"SELECT d.*, -bm25(djangoapp_reviewdocument_fts, {weights}) AS score "
+               "FROM djangoapp_reviewdocument_fts "
+               "JOIN djangoapp_reviewdocument d ON d.id = djangoapp_reviewdocument_fts.rowid "
+               f"WHERE djangoapp_reviewdocument_fts MATCH %s{clauses} "
+               "ORDER BY score DESC, d.id DESC LIMIT %s OFFSET %s")
+        params = [match]
+    elif connection.vendor == 'postgresql':
+        if not QUERY_TERM.search(query):
+            return [], False
+        sql = ("SELECT d.*, ts_rank(d.search_vector, query) AS score "
+               "FROM djangoapp_reviewdocument d, plainto_tsquery('english', %s) query "
+               f"WHERE d.search_vector @@ query{clauses} "
+               "ORDER BY score DESC, d.id DESC LIMIT %s OFFSET %s")
+        params = [query]
+    else:
+        raise NotSupportedError(f"Review search is not available on {connection.vendor}")
+
+    # One extra row tells whether there is a next page
+    reviews = list(ReviewDocument.objects.raw(sql, params + filter_params + [limit + 1, offset]))
+    return reviews[:limit], len(reviews) > limit
+
+
+def index_review(review_id, review, state=''):
+    """
+    Add a review to the search index, or update its copy.
+
+    Args:
+        review_id (str): Document id of the review in the reviews database.
+        review (dict): The review document.
+        state (str, optional): State code of the dealership of the review.
+    """
+    ReviewDocument.objects.update_or_create(review_id=review_id, defaults={
+        "dealership": int(review["dealership"]),
+        "state": (state or '').upper(),
+        "sentiment": review.get("sentiment"),
+        "name": review.get("name") or '',
+        "review": review.get("review") or '',
+        "car_make": str(review.get("car_make") or ''),
+        "car_model": str(review.get("car_model") or ''),
+        "car_year": str(review.get("car_year") or ''),
+        "purchase": bool(review.get("purchase")),
+        "time": str(review.get("time") or ''),
+    })
+
+
+def remove_review(review_id):
+    """Remove a review from the search index."""
+    ReviewDocument.objects.filter(review_id=review_id).delete()
+
+
+def apply_change(change, dealers_by_id):
+    """
+    Apply one change of the reviews database to the search index.
+
+    Args:
+        change (dict): A result of the get_review_changes endpoint.
+        dealers_by_id (dict): CarDealer objects by id, to look up the state of a review.
+
+    Returns:
+        bool: True if the change was applied, False if its document is not a review.
+    """
+    if change.get('deleted'):
+        remove_review(change['id'])
+        return True
+    review = change.get('doc') or {}
+    try:
+        dealer = dealers_by_id.get(int(review['dealership']))
+    except (KeyError, TypeError, ValueError):
+        return False
+    if 'review' not in review:
+        return False
+    index_review(change['id'], review, dealer.st if dealer is not None else '')
+    return True
+
+
+def sync_review_index(changes_url, dealers_url, batch_size=None):
+    """
+    Apply the changes of the reviews database since the last sync to the search index.
+
+    Changes are read in batches from the get_review_changes endpoint. Each batch is
+    applied in one transaction, together with the feed position, so an interrupted
+    sync resumes after the last batch applied.
+
+    Args:
+        changes_url (str): URL of the get_review_changes endpoint.
+        dealers_url (str): URL of the dealerships service, for the state of each review.
+        batch_size (int, optional): Changes read per call
+            (default is ``settings.REVIEW_INDEX_SYNC_BATCH``).
+
+    Returns:
+        int or None: The number of changes read, or None if the change feed could not
+        be read (batches applied before the failure are kept).
+    """
+    batch_size = batch_size or settings.REVIEW_INDEX_SYNC_BATCH
+    feed = changes_url.split('?', 1)[0]
+    position = ReviewFeedPosition.objects.filter(feed=feed).first()
+    since = position.seq if position is not None else '0'
+    dealers_by_id = dealer_store.index(dealers_url).by_id
+    read = 0
+    while True:
+        page = get_request(changes_url, since=since, limit=batch_size)
+        if page is None:
+            return None
+        with transaction.atomic():
+            for change in page['results']:
+                apply_change(change, dealers_by_id)
+            ReviewFeedPosition.objects.update_or_create(
+                feed=feed, defaults={"seq": str(page['last_seq'])})
+        read += len(page['results'])
+        since = page['last_seq']
+        if not page.get('pending'):
+            return read
+
+
+def reset_review_index():
+    """Empty the search index and forget the feed positions, before a full rebuild."""
+    with transaction.atomic():
+        ReviewDocument.objects.all().delete()
+        ReviewFeedPosition.objects.all().delete()
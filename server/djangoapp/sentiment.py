@@ -0,0 +1,402 @@
+"""
+Module: sentiment
+
+Engines scoring the sentiment of review texts, behind `analyze_review_sentiments`
+and `analyze_review_sentiments_batch` in restapis.
+
+Two backends are available:
+
+- ``nlu``: IBM Watson Natural Language Understanding, one remote analyze call per
+  review, run concurrently on a bounded thread pool under a shared deadline;
+- ``local``: a lexicon-based engine scoring whole batches in process with NumPy. It
+  needs no network and labels thousands of reviews per second, at the cost of
+  missing what a lexicon cannot see (sarcasm, domain phrases).
+
+``settings.SENTIMENT_BACKEND`` picks the backend of a deployment, and
+``settings.SENTIMENT_FALLBACK_BACKEND`` the one labelling the reviews the first
+could not score in time, instead of giving them ``settings.SENTIMENT_DEFAULT_LABEL``.
+A deployment without ``settings.NLU_URL`` scores every review with the local backend.
+
+Usage:
+    from .sentiment import get_sentiment_backend
+    labels = get_sentiment_backend('local').labels(["Great service", "Rude staff"])
+"""
+import abc
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import requests
+from django.conf import settings
+from ibm_watson.natural_language_understanding_v1 import Features, SentimentOptions
+from .circuit_breaker import OPEN, CircuitBreaker
+from .nlu import nlu_client
+
+# Words, with their apostrophes ("don't", "wasn't"), and the punctuation ending a sentence
+TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?|[.!?;]")
+SENTENCE_ENDS = frozenset('.!?;')
+# Words reversing the polarity of the words following them, up to the end of the sentence
+NEGATIONS = frozenset([
+    'not', 'no', 'never', 'none', 'nothing', 'nobody', 'neither', 'nor', 'without', 'hardly',
+    "don't", "doesn't", "didn't", "isn't", "wasn't", "aren't", "weren't", "won't", "wouldn't",
+    "can't", "couldn't", "shouldn't", "haven't", "hasn't", "hadn't", 'cannot',
+])
+# Number of words after a negation whose polarity it reverses, and by how much
+NEGATION_WINDOW = 3
+NEGATION_FACTOR = -0.74
+# Scores are squashed into [-1, 1] with score / sqrt(score ** 2 + NORMALIZATION)
+NORMALIZATION = 15.0
+# Scores beyond these thresholds are labelled positive or negative, others neutral
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+
+# Polarity of common review words, from -3 (very negative) to 3 (very positive)
+LEXICON = {
+    # Positive
+    'amazing': 3, 'awesome': 3, 'best': 3, 'excellent': 3, 'exceptional': 3, 'fantastic': 3,
+    'outstanding': 3, 'perfect': 3, 'superb': 3, 'wonderful': 3, 'love': 3, 'loved': 3,
+    'brilliant': 3, 'flawless': 3, 'incredible': 3, 'terrific': 3, 'delighted': 3,
+    'great': 3, 'impressed': 2, 'impressive': 2, 'enjoy': 2, 'enjoyed': 2, 'glad': 2,
+    'good': 2, 'happy': 2, 'helpful': 2, 'nice': 2, 'pleasant': 2, 'pleased': 2,
+    'recommend': 2, 'recommended': 2, 'satisfied': 2, 'smooth': 2, 'friendly': 2,
+    'honest': 2, 'knowledgeable': 2, 'professional': 2, 'reliable': 2, 'courteous': 2,
+    'thank': 2, 'thanks': 2, 'trustworthy': 2, 'easy': 1, 'fair': 1, 'fast': 1, 'quick': 1,
+    'efficient': 2, 'comfortable': 2, 'clean': 1, 'affordable': 1, 'like': 1, 'liked': 1,
+    'well': 1, 'worth': 1, 'polite': 2, 'patient': 2, 'attentive': 2, 'responsive': 2,
+    'transparent': 1, 'painless': 2, 'seamless': 2, 'superior': 2, 'favorite': 2,
+    'quality': 1, 'value': 1, 'bargain': 1, 'deal': 1, 'fun': 2, 'beautiful': 2,
+    'exceeded': 2, 'exceeds': 2, 'accommodating': 2, 'respectful': 2, 'prompt': 1,
+    'solid': 1, 'better': 1, 'improved': 1, 'innovative': 1, 'optimal': 1, 'robust': 1,
+    # Negative
+    'awful': -3, 'horrible': -3, 'terrible': -3, 'worst': -3, 'hate': -3, 'hated': -3,
+    'disgusting': -3, 'scam': -3, 'fraud': -3, 'nightmare': -3, 'useless': -3,
+    'pathetic': -3, 'dishonest': -3, 'liar': -3, 'lied': -3, 'lying': -3, 'ripoff': -3,
+    'bad': -2, 'poor': -2, 'rude': -2, 'disappointed': -2, 'disappointing': -2,
+    'unhappy': -2, 'unprofessional': -2, 'unhelpful': -2, 'broken': -2, 'broke': -2,
+    'problem': -2, 'problems': -2, 'issue': -1, 'issues': -1, 'complaint': -2,
+    'frustrating': -2, 'frustrated': -2, 'annoying': -2, 'annoyed': -2, 'angry': -3,
+    'pushy': -2, 'overpriced': -2, 'expensive': -1, 'slow': -1, 'late': -1, 'delay': -1,
+    'delayed': -1, 'waste': -2, 'wasted': -2, 'avoid': -2, 'mistake': -2,
+    'defective': -2, 'faulty': -2, 'dirty': -2, 'uncomfortable': -2, 'difficult': -1,
+    'hassle': -2, 'ignored': -2, 'misleading': -2, 'hidden': -1, 'refused': -2,
+    'regret': -2, 'sadly': -2, 'unfortunately': -2, 'worse': -2, 'fail': -2, 'failed': -2,
+    'failure': -2, 'noisy': -1, 'leak': -2, 'leaking': -2, 'stalled': -2, 'recall': -1,
+    'unreliable': -2, 'incompetent': -3, 'careless': -2, 'wrong': -2, 'cheated': -3,
+}
+
+
+def load_lexicon(path):
+    """
+    Read a lexicon file of tab-separated words and polarity scores (the AFINN format).
+
+    Args:
+        path (str): Path of the file; lines that do not hold a word and a number are skipped.
+
+    Returns:
+        dict: The polarity of each word.
+    """
+    lexicon = {}
+    with open(path, encoding='utf-8') as lexicon_file:
+        for line in lexicon_file:
+            word, _, score = line.rstrip('\n').rpartition('\t')
+            try:
+                lexicon[word.strip().lower()] = float(score)
+            except ValueError:
+                continue
+    return lexicon
+
+
+class LexiconSentimentEngine:
+    """
+    Vectorised lexicon scorer for batches of review texts.
+
+    The texts of a batch are split into words, which are mapped to vocabulary ids in
+    one flat NumPy array. The polarity of every word, reversed after a negation in
+    the same sentence, is then summed per text with a single ``bincount`` and
+    squashed into [-1, 1].
+
+    Args:
+        lexicon (dict, optional): Polarity of each word (default is ``LEXICON``).
+    """
+
+    def __init__(self, lexicon=None):
+        lexicon = LEXICON if lexicon is None else lexicon
+        # Id 0 stands for words outside the lexicon; negations and the punctuation
+        # ending a sentence get ids of their own
+        words = sorted(set(lexicon) | NEGATIONS | SENTENCE_ENDS)
+        self._ids = {word: index for index, word in enumerate(words, start=1)}
+        self._polarity = np.zeros(len(words) + 1)
+        self._is_negation = np.zeros(len(words) + 1, dtype=bool)
+        self._is_sentence_end = np.zeros(len(words) + 1, dtype=bool)
+        for word, index in self._ids.items():
+            self._polarity[index] = lexicon.get(word, 0.0)
+            self._is_negation[index] = word in NEGATIONS
+            self._is_sentence_end[index] = word in SENTENCE_ENDS
+
+    def scores(self, texts):
+        """
+        Return the compound score of each text, between -1 (negative) and 1 (positive).
+
+        Args:
+            texts (list): The review texts.
+
+        Returns:
+            numpy.ndarray: One score per text.
+        """
+        ids_of = self._ids.get
+        token_ids = [[ids_of(token, 0) for token in TOKEN.findall(text.lower())] for text in texts]
+        lengths = np.fromiter(map(len, token_ids), dtype=np.int64, count=len(texts))
+        ids = np.fromiter((token for tokens in token_ids for token in tokens),
+                          dtype=np.int64, count=int(lengths.sum()))
+        # Index of the text of every word, and position of the word in the flat array
+        text_of = np.repeat(np.arange(len(texts)), lengths)
+        positions = np.arange(len(ids))
+
+        # Position of the latest negation and sentence end at or before each word; a
+        # negation only reaches the words of its text and sentence
+        negation_at = np.where(self._is_negation[ids], positions, -1)
+        sentence_end_at = np.where(self._is_sentence_end[ids], positions, -1)
+        if len(ids):
+            latest_negation = np.maximum.accumulate(negation_at)
+            latest_sentence_end = np.maximum.accumulate(sentence_end_at)
+        else:
+            latest_negation, latest_sentence_end = negation_at, sentence_end_at
+        text_start = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        negated = ((latest_negation >= text_start) & (latest_negation < positions)
+                   & (latest_negation > latest_sentence_end)
+                   & (positions - latest_negation <= NEGATION_WINDOW))
+
+        weights = self._polarity[ids] * np.where(negated, NEGATION_FACTOR, 1.0)
+        totals = np.bincount(text_of, weights=weights, minlength=len(texts))
+        return totals / np.sqrt(totals * totals + NORMALIZATION)
+
+    def labels(self, texts):
+        """Return the sentiment label of each text: "positive", "negative" or "neutral"."""
+        scores = self.scores(texts)
+        labels = np.full(len(texts), 'neutral', dtype=object)
+        labels[scores >= POSITIVE_THRESHOLD] = 'positive'
+        labels[scores <= NEGATIVE_THRESHOLD] = 'negative'
+        return labels.tolist()
+
+
+class SentimentBackend(abc.ABC):
+    """
+    Interface of the sentiment backends.
+
+    Attributes:
+        name (str): Name of the backend in ``settings.SENTIMENT_BACKEND``.
+        cacheable (bool): Whether its labels are worth keeping in the sentiment cache,
+            which is only true of slow, remote backends.
+    """
+
+    name = None
+    cacheable = False
+
+    @abc.abstractmethod
+    def analyze(self, text, timeout=None):
+        """
+        Score one text.
+
+        Returns:
+            dict or None: A response shaped like the NLU one, holding the label and
+            score under ``['sentiment']['document']``, or None if the text could not
+            be scored.
+        """
+
+    @abc.abstractmethod
+    def labels(self, texts, timeout=None, deadline=None):
+        """
+        Label several texts.
+
+        Args:
+            texts (list): The texts to label.
+            timeout (float, optional): Seconds allowed per remote call.
+            deadline (float, optional): Seconds allowed for the whole batch.
+
+        Returns:
+            list: One label per text, in the same order, None for the texts that could
+            not be labelled in time.
+        """
+
+
+class NLUSentimentBackend(SentimentBackend):
+    """
+    Watson NLU, called concurrently on a process-wide thread pool.
+
+    Calls go through a circuit breaker configured by the ``SENTIMENT_BREAKER_*``
+    settings: while NLU keeps failing or answering slowly, reviews are not sent to
+    it at all and are left to the fallback backend, so a bad NLU day costs the dealer
+    pages nothing rather than a timeout per page.
+    """
+
+    name = 'nlu'
+    cacheable = True
+
+    def __init__(self):
+        self._executor = None
+        self._breaker = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Return the thread pool used for concurrent NLU calls, created on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.SENTIMENT_MAX_WORKERS,
+                    thread_name_prefix='sentiment',
+                )
+        return self._executor
+
+    @property
+    def breaker(self):
+        """The CircuitBreaker guarding the NLU calls, created on first use."""
+        with self._lock:
+            if self._breaker is None:
+                self._breaker = CircuitBreaker(
+                    'nlu',
+                    window=settings.SENTIMENT_BREAKER_WINDOW,
+                    min_calls=settings.SENTIMENT_BREAKER_MIN_CALLS,
+                    failure_rate=settings.SENTIMENT_BREAKER_FAILURE_RATE,
+                    slow_call=settings.SENTIMENT_BREAKER_SLOW_CALL,
+                    open_seconds=settings.SENTIMENT_BREAKER_OPEN_SECONDS,
+                    probes=settings.SENTIMENT_BREAKER_PROBES,
+                )
+            return self._breaker
+
+    def analyze(self, text, timeout=None):
+        if timeout is None:
+            timeout = settings.SENTIMENT_CALL_TIMEOUT
+        return self._analyze(text, timeout)
+
+    def _analyze(self, text, timeout, cut_short=False):
+        """
+        Score one text through the breaker.
+
+        Args:
+            cut_short (bool): Whether `timeout` is shorter than the usual call timeout,
+                to fit a batch budget. Timing out then says nothing of NLU's health, so
+                it is not reported to the breaker as a failure.
+        """
+        breaker = self.breaker
+        if not breaker.allow():
+            return None
+        started = time.monotonic()
+        try:
+            # Reuse the process-wide client, its IAM token and its pooled connections
+            with nlu_client.call_timeout(timeout):
+                response = nlu_client.get().analyze(
+                    text=text,
+                    features=Features(sentiment=SentimentOptions()),
+                ).get_result()
+        except Exception as exception:
+            if cut_short and isinstance(exception, requests.exceptions.Timeout):
+                breaker.release()
+            else:
+                breaker.record(False, time.monotonic() - started)
+                print('An error occurred while analyzing sentiments:', str(exception))
+            return None
+        breaker.record(True, time.monotonic() - started)
+        return response
+
+    def _label(self, text, timeout, ends_at):
+        """
+        Score one text within the batch budget and reduce the NLU response to its
+        document label, or None.
+
+        A call picked up by a worker with less than ``settings.SENTIMENT_MIN_CALL_TIME``
+        of the budget left is not made, and the others may only wait for the time left.
+        """
+        remaining = ends_at - time.monotonic()
+        if remaining < min(settings.SENTIMENT_MIN_CALL_TIME, timeout):
+            return None
+        response = self._analyze(text, min(timeout, remaining), cut_short=remaining < timeout)
+        try:
+            return response['sentiment']['document']['label']
+        except (KeyError, TypeError):
+            return None
+
+    def labels(self, texts, timeout=None, deadline=None):
+        if timeout is None:
+            timeout = settings.SENTIMENT_CALL_TIMEOUT
+        if deadline is None:
+            deadline = settings.SENTIMENT_DEADLINE
+        if self.breaker.state == OPEN:
+            # Nothing would be sent: leave every review to the fallback at once
+            return [None] * len(texts)
+        ends_at = time.monotonic() + deadline
+        executor = self._get_executor()
+        futures = [executor.submit(self._label, text, timeout, ends_at) for text in texts]
+        done, not_done = wait(futures, timeout=deadline)
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            print("Sentiment deadline reached, {} of {} reviews not scored".format(
+                len(not_done), len(texts)))
+        return [future.result() if future in done and future.exception() is None else None
+                for future in futures]
+
+
+class LocalSentimentBackend(SentimentBackend):
+    """
+    The lexicon engine, scoring in process.
+
+    The lexicon is ``LEXICON``, or the file named by ``settings.SENTIMENT_LEXICON_PATH``
+    (see `load_lexicon`), read on first use.
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self._engine = None
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        """The LexiconSentimentEngine of the backend."""
+        with self._lock:
+            if self._engine is None:
+                path = settings.SENTIMENT_LEXICON_PATH
+                self._engine = LexiconSentimentEngine(load_lexicon(path) if path else None)
+            return self._engine
+
+    def analyze(self, text, timeout=None):
+        score = float(self.engine.scores([text])[0])
+        if score >= POSITIVE_THRESHOLD:
+            label = 'positive'
+        elif score <= NEGATIVE_THRESHOLD:
+            label = 'negative'
+        else:
+            label = 'neutral'
+        return {"sentiment": {"document": {"score": round(score, 6), "label": label}}}
+
+    def labels(self, texts, timeout=None, deadline=None):
+        return self.engine.labels(texts)
+
+
+# Backends by name, one instance per process
+_backends = {backend.name: backend for backend in (NLUSentimentBackend(), LocalSentimentBackend())}
+
+
+def get_sentiment_backend(name=None):
+    """
+    Return a sentiment backend.
+
+    The NLU backend is replaced by the local one while ``settings.NLU_URL`` is not set.
+
+    Args:
+        name (str, optional): "nlu" or "local" (default is ``settings.SENTIMENT_BACKEND``).
+
+    Returns:
+        SentimentBackend: The backend.
+
+    Raises:
+        ValueError: If no backend has this name.
+    """
+    name = name or settings.SENTIMENT_BACKEND
+    if name == NLUSentimentBackend.name and not settings.NLU_URL:
+        name = LocalSentimentBackend.name
+    try:
+        return _backends[name]
+    except KeyError:
+        raise ValueError(f"Unknown sentiment backend {name!r}") from None
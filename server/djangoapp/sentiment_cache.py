@@ -0,0 +1,167 @@
+"""
+Module: sentiment_cache
+
+Content-addressed cache for review sentiment labels.
+
+Reviews are keyed by a SHA-256 hash of their text plus the NLU model version, so
+an unchanged review is scored once no matter how many times its dealer page is
+viewed. Lookups go through two tiers:
+
+- an in-process LRU with a size bound and a TTL, shared by the threads of a worker;
+- a persistent tier in the Django cache named by ``settings.SENTIMENT_CACHE_ALIAS``
+  (a database cache by default, whose table ``manage.py migrate`` creates),
+  shared by every worker and surviving restarts.
+
+Usage:
+    from .sentiment_cache import sentiment_cache
+    labels = sentiment_cache.get_many(texts)
+    sentiment_cache.set(text, "positive")
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+
+class SentimentCache:
+    """
+    Two-tier sentiment label cache with hit/miss counters.
+
+    Args:
+        max_entries (int, optional): Size of the in-process LRU tier
+            (default is ``settings.SENTIMENT_CACHE_MAX_ENTRIES``).
+        ttl (float, optional): Seconds an entry stays valid in either tier
+            (default is ``settings.SENTIMENT_CACHE_TTL``).
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"local_hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def max_entries(self):
+        """Size bound of the in-process tier."""
+        return self._max_entries or settings.SENTIMENT_CACHE_MAX_ENTRIES
+
+    @property
+    def ttl(self):
+        """Time to live of an entry, in seconds."""
+        return self._ttl or settings.SENTIMENT_CACHE_TTL
+
+    @staticmethod
+    def key(text):
+        """Return the cache key for a review text under the current NLU model version."""
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"sentiment:{settings.NLU_VERSION}:{digest}"
+
+    def _get_local(self, key, now):
+        """Look a key up in the LRU tier, dropping it if it has expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        label, expires_at = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return label
+
+    def _set_local(self, key, label, now):
+        """Store a key in the LRU tier, evicting the least recently used entries."""
+        self._entries[key] = (label, now + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def get_many(self, texts):
+        """
+        Look up the cached labels of several review texts.
+
+        Args:
+            texts (list): Review texts to look up.
+
+        Returns:
+            dict: Mapping of text to label for every text found in either tier.
+        """
+        now = time.monotonic()
+        keys = {text: self.key(text) for text in texts}
+        found = {}
+        missing = {}
+        with self._lock:
+            for text, key in keys.items():
+                label = self._get_local(key, now)
+                if label is None:
+                    missing[key] = text
+                else:
+                    found[text] = label
+                    self._counters["local_hits"] += 1
+
+        if missing:
+            try:
+                persisted = caches[settings.SENTIMENT_CACHE_ALIAS].get_many(list(missing))
+            except Exception as exception:
+                print('An error occurred while reading the sentiment cache:', str(exception))
+                persisted = {}
+            with self._lock:
+                for key, text in missing.items():
+                    if key in persisted:
+                        found[text] = persisted[key]
+                        self._set_local(key, persisted[key], now)
+                        self._counters["persistent_hits"] += 1
+                    else:
+                        self._counters["misses"] += 1
+        return found
+
+    def get(self, text):
+        """Return the cached label of a review text, or None."""
+        return self.get_many([text]).get(text)
+
+    def set_many(self, labels):
+        """
+        Store freshly computed labels in both tiers.
+
+        Args:
+            labels (dict): Mapping of review text to sentiment label.
+        """
+        if not labels:
+            return
+        now = time.monotonic()
+        entries = {self.key(text): label for text, label in labels.items()}
+        with self._lock:
+            for key, label in entries.items():
+                self._set_local(key, label, now)
+        try:
+            caches[settings.SENTIMENT_CACHE_ALIAS].set_many(entries, timeout=self.ttl)
+        except Exception as exception:
+            print('An error occurred while writing the sentiment cache:', str(exception))
+
+    def set(self, text, label):
+        """Store the label of a single review text."""
+        self.set_many({text: label})
+
+    def stats(self):
+        """Return a snapshot of the hit/miss counters and the in-process tier size."""
+        with self._lock:
+            snapshot = dict(self._counters)
+            snapshot["local_entries"] = len(self._entries)
+        lookups = snapshot["local_hits"] + snapshot["persistent_hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = (
+            (snapshot["local_hits"] + snapshot["persistent_hits"]) / lookups if lookups else 0.0)
+        return snapshot
+
+    def clear(self):
+        """Empty the in-process tier and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+# Process-wide cache used by restapis
+sentiment_cache = SentimentCache()
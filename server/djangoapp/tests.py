@@ -1,3 +1,1056 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from . import async_restapis
+from .catalog import CarCatalog, car_catalog
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from .db import check_connections
+from .dealer_store import DealerStore, build_index
+from .fragment_cache import fragment_cache
+from .geo import DealerGeoIndex, haversine_km
+from .models import CarDealer, CarMake, CarModel, DealerReview, iter_rows_from_columns
+from .nlu import nlu_client
+from .restapis import (JSONArrayDecoder, analyze_review_sentiments_batch, dealer_store,
+                       get_request, iter_json_array, iter_request)
+from .search import index_review, search_reviews
+from .sentiment import (LexiconSentimentEngine, NLUSentimentBackend, SentimentBackend,
+                        get_sentiment_backend)
+from .sentiment_cache import SentimentCache, sentiment_cache
+from .validator_cache import ValidatorCache, validator_cache
 
 # Create your tests here.
+
+DEALER_ID = 15
+OTHER_DEALER_ID = 16
+
+
+def add_cars(make, dealer_id, count):
+    """Create `count` cars of a make sold by a dealer."""
+    return [CarModel.objects.create(make=make, dealer_id=dealer_id, name=f"Model {i}", year=2020)
+            for i in range(count)]
+
+
+class CarCatalogTests(TestCase):
+    """The car catalog reads a dealer's cars in one query and then serves them from the cache."""
+
+    def setUp(self):
+        car_catalog.cache.clear()
+        self.audi = CarMake.objects.create(name="Audi", description="German")
+        self.kia = CarMake.objects.create(name="Kia", description="Korean")
+        self.cars = add_cars(self.audi, DEALER_ID, 20) + add_cars(self.kia, DEALER_ID, 20)
+        self.other_car = CarModel.objects.create(make=self.kia, dealer_id=OTHER_DEALER_ID,
+                                                 name="Rio", year=2018)
+        self.any_dealer_car = CarModel.objects.create(make=self.audi, name="A4", year=2019)
+
+    def test_catalog_is_read_in_one_query(self):
+        # Plus the lookup of the catalog generation
+        with self.assertNumQueries(2):
+            cars = car_catalog.cars(DEALER_ID)
+            labels = {f"{car.make} {car.make_description}" for car in cars}
+        self.assertEqual(labels, {"Audi German", "Kia Korean"})
+
+    def test_catalog_lists_the_dealer_cars_and_the_cars_of_no_dealer(self):
+        ids = [car.id for car in car_catalog.cars(DEALER_ID)]
+        self.assertEqual(ids, [car.id for car in self.cars] + [self.any_dealer_car.id])
+
+    def test_cached_catalog_costs_only_the_generation_lookup(self):
+        car_catalog.cars(DEALER_ID)
+        with self.assertNumQueries(1):
+            car = car_catalog.get_car(DEALER_ID, self.cars[0].id)
+        self.assertEqual((car.make, car.name), ("Audi", "Model 0"))
+
+    def test_get_car_ignores_cars_of_other_dealers(self):
+        self.assertIsNone(car_catalog.get_car(DEALER_ID, self.other_car.id))
+        self.assertIsNotNone(car_catalog.get_car(OTHER_DEALER_ID, self.other_car.id))
+
+    def test_saving_a_car_invalidates_the_catalog(self):
+        car_catalog.cars(DEALER_ID)
+        new_car = CarModel.objects.create(make=self.kia, dealer_id=DEALER_ID, name="EV6",
+                                          year=2023)
+        with self.assertNumQueries(2):
+            self.assertIsNotNone(car_catalog.get_car(DEALER_ID, new_car.id))
+
+    def test_saving_a_make_invalidates_the_catalog(self):
+        car_catalog.cars(DEALER_ID)
+        self.audi.name = "Audi AG"
+        self.audi.save()
+        self.assertEqual(car_catalog.get_car(DEALER_ID, self.cars[0].id).make, "Audi AG")
+
+    def test_deleting_a_car_invalidates_the_catalog(self):
+        car_catalog.cars(DEALER_ID)
+        car_id = self.cars[0].id
+        self.cars[0].delete()
+        self.assertIsNone(car_catalog.get_car(DEALER_ID, car_id))
+
+    @override_settings(CACHES=dict(settings.CACHES, other_worker={
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'other-worker'}))
+    def test_changes_reach_the_catalogs_of_other_workers(self):
+        # A worker that did not handle the change, with catalogs of its own
+        other_worker = CarCatalog(alias='other_worker')
+        other_worker.cars(DEALER_ID)
+        new_car = CarModel.objects.create(make=self.kia, dealer_id=DEALER_ID, name="EV6",
+                                          year=2023)
+        self.assertIsNotNone(other_worker.get_car(DEALER_ID, new_car.id))
+
+
+class AddReviewPageTests(TestCase):
+    """The add review page costs as many queries with one car as with many."""
+
+    def setUp(self):
+        car_catalog.cache.clear()
+        self.make = CarMake.objects.create(name="Audi", description="German")
+        self.user = User.objects.create_user("reviewer", password="secret")
+        dealer = CarDealer("3 Nova Court", "El Paso", "Holdlamis Car Dealership", DEALER_ID,
+                           31.6948, -106.3, "Holdlamis", "TX", "88563")
+        # The page reads the dealer from the local store rather than from the service
+        dealer_store.install(f"{settings.DEALERSHIPS_SERVICE_URL}/api/dealerships/", [dealer])
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        dealer_store.invalidate()
+
+    def page_queries(self):
+        """Return the number of queries made to render the page, with a cold catalog."""
+        car_catalog.cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/djangoapp/dealer/{DEALER_ID}/add_review/",
+                                       HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_the_catalog(self):
+        add_cars(self.make, DEALER_ID, 1)
+        with_one_car = self.page_queries()
+        add_cars(self.make, DEALER_ID, 50)
+        self.assertEqual(self.page_queries(), with_one_car)
+
+
+class ColumnsBodyTests(SimpleTestCase):
+    """Columnar service responses are turned back into model objects."""
+
+    def test_empty_page_has_no_rows(self):
+        body = {"fields": list(DealerReview.FIELDS), "columns": [[] for _ in DealerReview.FIELDS],
+                "count": 0}
+        self.assertEqual(DealerReview.from_columns(body), [])
+        self.assertEqual(CarDealer.from_columns(dict(body, fields=list(CarDealer.__slots__))), [])
+
+    def test_empty_page_without_count_has_no_rows(self):
+        self.assertEqual(list(iter_rows_from_columns({"fields": ["name"], "columns": [[]]},
+                                                     ("name", "review"))), [])
+
+    def test_missing_fields_are_none(self):
+        body = {"fields": ["dealership", "name", "purchase", "review"],
+                "columns": [[15, 15], ["Ann", "Bob"], [True, False], ["Great", "Poor"]],
+                "count": 2}
+        reviews = DealerReview.from_columns(body)
+        self.assertEqual([(review.name, review.review) for review in reviews],
+                         [("Ann", "Great"), ("Bob", "Poor")])
+        self.assertEqual([(review.car_make, review.sentiment) for review in reviews],
+                         [(None, None), (None, None)])
+
+
+def random_dealers(rng, count, lats, longs):
+    """Return `count` dealers placed uniformly within latitude and longitude ranges."""
+    return [CarDealer("", "", f"Dealer {i}", i, rng.uniform(*lats), rng.uniform(*longs),
+                      f"D{i}", "", "")
+            for i in range(count)]
+
+
+class DealerGeoIndexTests(SimpleTestCase):
+    """The grid index finds the same dealers as a linear scan of all of them."""
+
+    def assert_matches_linear_scan(self, dealers, queries, k, radius=None):
+        index = DealerGeoIndex(dealers)
+        lats = np.array([dealer.lat for dealer in dealers])
+        longs = np.array([dealer.long for dealer in dealers])
+        for lat, long in queries:
+            distances = np.sort(haversine_km(lat, long, lats, longs))
+            if radius is not None:
+                distances = distances[distances <= radius]
+            found = [distance for _, distance in index.nearest(lat, long, k=k, radius=radius)]
+            np.testing.assert_allclose(found, distances[:k], err_msg=f"query {lat}, {long}")
+
+    def test_worldwide(self):
+        rng = random.Random(7)
+        dealers = random_dealers(rng, 1000, (-90, 90), (-180, 180))
+        queries = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(100)]
+        self.assert_matches_linear_scan(dealers, queries, k=5)
+        self.assert_matches_linear_scan(dealers, queries, k=10, radius=500)
+
+    def test_across_the_antimeridian(self):
+        # Dense enough for cells of about 4.4 degrees, which do not divide 360 evenly
+        rng = random.Random(0)
+        dealers = (random_dealers(rng, 1500, (20, 40), (175, 180))
+                   + random_dealers(rng, 1500, (20, 40), (-180, -175)))
+        queries = [(rng.uniform(20, 40), rng.choice((-1, 1)) * rng.uniform(175, 180))
+                   for _ in range(200)] + [(30, -179.9), (30, 179.9)]
+        self.assert_matches_linear_scan(dealers, queries, k=20)
+
+    def test_near_the_poles(self):
+        rng = random.Random(13)
+        dealers = (random_dealers(rng, 500, (80, 90), (-180, 180))
+                   + random_dealers(rng, 500, (-90, -80), (-180, 180)))
+        queries = [(90, 0), (-90, 0)] + [
+            (rng.choice((-1, 1)) * rng.uniform(80, 90), rng.uniform(-180, 180))
+            for _ in range(100)]
+        self.assert_matches_linear_scan(dealers, queries, k=5)
+
+    def test_dealers_without_location_are_left_out(self):
+        dealers = random_dealers(random.Random(17), 3, (0, 1), (0, 1))
+        dealers[0].lat = None
+        dealers[1].long = "n/a"
+        self.assertEqual([dealer for dealer, _ in DealerGeoIndex(dealers).nearest(0, 0, k=5)],
+                         [dealers[2]])
+
+
+class FakeClock:
+    """Monotonic clock moved forward by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """The breaker opens on bad calls, probes after its cool-down and closes on success."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('test', window=30, min_calls=4, failure_rate=0.5,
+                                      slow_call=2.0, open_seconds=10, probes=1,
+                                      clock=self.clock)
+
+    def calls(self, *outcomes, latency=0.1):
+        """Make and report one call per outcome."""
+        for ok in outcomes:
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(ok, latency)
+
+    def test_stays_closed_below_the_failure_rate(self):
+        self.calls(True, True, True, False, True)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_stays_closed_before_min_calls(self):
+        self.calls(False, False, False)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_opens_at_the_failure_rate(self):
+        self.calls(True, True, False, False)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.stats()["short_circuited"], 1)
+
+    def test_slow_calls_count_as_bad(self):
+        self.calls(True, True, True, True, latency=2.5)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_old_calls_leave_the_window(self):
+        self.calls(False, False, False)
+        self.clock.now += 31
+        self.calls(False, True, True, True)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.calls(False, False, False, False)
+        self.clock.now += 10
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_probe_closes(self):
+        self.calls(False, False, False, False)
+        self.clock.now += 10
+        self.calls(True)
+        self.assertEqual(self.breaker.state, CLOSED)
+        # With a clean window
+        self.calls(False, False, False)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.calls(False, False, False, False)
+        self.clock.now += 10
+        self.calls(False)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.stats()["opened"], 2)
+        self.clock.now += 9
+        self.assertFalse(self.breaker.allow())
+
+    def test_released_probe_frees_its_slot(self):
+        self.calls(False, False, False, False)
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+
+class NLUBudgetTests(SimpleTestCase):
+    """Calls cut short by the batch budget do not count against NLU."""
+
+    def setUp(self):
+        self.backend = NLUSentimentBackend()
+        self.client = mock.Mock()
+        patcher = mock.patch('djangoapp.sentiment.nlu_client')
+        patcher.start().get.return_value = self.client
+        self.addCleanup(patcher.stop)
+
+    def test_timeout_cut_short_by_the_budget_is_not_a_failure(self):
+        self.client.analyze.side_effect = requests.exceptions.Timeout()
+        ends_at = time.monotonic() + 1
+        self.assertIsNone(self.backend._label("Great car", 3, ends_at))
+        self.assertEqual(self.backend.breaker.stats()["calls"], 0)
+
+    def test_timeout_of_a_full_call_is_a_failure(self):
+        self.client.analyze.side_effect = requests.exceptions.Timeout()
+        ends_at = time.monotonic() + 10
+        self.assertIsNone(self.backend._label("Great car", 3, ends_at))
+        self.assertEqual(self.backend.breaker.stats()["failure_rate"], 1.0)
+
+    def test_no_call_with_too_little_budget_left(self):
+        ends_at = time.monotonic() + settings.SENTIMENT_MIN_CALL_TIME / 2
+        self.assertIsNone(self.backend._label("Great car", 3, ends_at))
+        self.client.analyze.assert_not_called()
+
+
+class SlowNLUHandler(BaseHTTPRequestHandler):
+    """NLU stub answering every analyze call positively after `delay` seconds."""
+
+    delay = 0
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        body = json.dumps({"sentiment": {"document": {"label": "positive"}}}).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # The client gave up
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class NLUCallTimeoutTests(SimpleTestCase):
+    """The timeout of an NLU call bounds the request itself, through the shared client."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), SlowNLUHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+
+    def setUp(self):
+        url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        settings_override = override_settings(NLU_URL=url, NLU_API_KEY="")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        nlu_client.reset()
+        self.addCleanup(nlu_client.reset)
+        self.backend = NLUSentimentBackend()
+
+    def test_fast_call_is_scored(self):
+        SlowNLUHandler.delay = 0
+        self.assertEqual(self.backend._label("Great car", 2, time.monotonic() + 2), "positive")
+
+    def test_slow_call_is_cut_off_at_the_deadline(self):
+        SlowNLUHandler.delay = 3
+        started = time.monotonic()
+        self.assertIsNone(self.backend._label("Great car", 5, started + 0.6))
+        self.assertLess(time.monotonic() - started, 1.5)
+        # Cut short by the budget, the call is not held against NLU
+        self.assertEqual(self.backend.breaker.stats()["calls"], 0)
+
+
+class LexiconSentimentEngineTests(SimpleTestCase):
+    """The local engine reverses the words a negation reaches, within its sentence."""
+
+    def setUp(self):
+        self.engine = LexiconSentimentEngine()
+
+    def test_labels(self):
+        self.assertEqual(self.engine.labels(["Great service", "Rude staff", "We bought a car"]),
+                         ["positive", "negative", "neutral"])
+
+    def test_negation_reverses_the_following_words(self):
+        self.assertEqual(self.engine.labels(["The staff was not helpful"]), ["negative"])
+
+    def test_negation_stops_at_the_end_of_its_sentence(self):
+        self.assertEqual(self.engine.labels(["I did not like it. Great car though",
+                                             "Not cheap; great car"]),
+                         ["positive", "positive"])
+
+    def test_negation_does_not_reach_the_next_text(self):
+        scores = self.engine.scores(["It was not", "good"])
+        self.assertGreater(scores[1], 0)
+
+    def test_never_is_only_a_negation(self):
+        self.assertEqual(self.engine.labels(["Never again", "Never had a problem"]),
+                         ["neutral", "positive"])
+
+    def test_empty_batch(self):
+        self.assertEqual(self.engine.labels([]), [])
+        self.assertEqual(self.engine.labels([""]), ["neutral"])
+
+    def test_backends_must_implement_the_interface(self):
+        with self.assertRaises(TypeError):
+            SentimentBackend()  # pylint: disable=abstract-class-instantiated
+
+
+def make_dealer(dealer_id, state="TX", lat=32.0, long=-96.0):
+    """Return a CarDealer with the given id, state and location."""
+    return CarDealer("1 Main St", "Dallas", f"Dealer {dealer_id}", dealer_id, lat, long,
+                     f"D{dealer_id}", state, "75001")
+
+
+def age_index(store, url, seconds):
+    """Make the list a store holds for a service look `seconds` old."""
+    key = store._key(url)  # pylint: disable=protected-access
+    index = store._indexes[key]  # pylint: disable=protected-access
+    store._indexes[key] = index._replace(  # pylint: disable=protected-access
+        loaded_at=time.monotonic() - seconds)
+
+
+class DealerStoreTests(SimpleTestCase):
+    """The dealer store loads a service once, then serves its copy within the TTLs."""
+
+    URL = "http://dealers.test/api/dealerships/"
+
+    def setUp(self):
+        self.loads = []
+        self.dealers = [make_dealer(1), make_dealer(2, "CA")]
+        self.store = DealerStore(self.load, ttl=60, hard_ttl=600)
+
+    def load(self, url):
+        self.loads.append(url)
+        return list(self.dealers)
+
+    def test_lookups_by_id_and_state(self):
+        self.assertEqual(self.store.get_by_id(self.URL, 2).st, "CA")
+        self.assertEqual([dealer.id for dealer in self.store.get_by_state(self.URL, "tx")], [1])
+        self.assertIsNone(self.store.get_by_id(self.URL, 3))
+        self.assertEqual(len(self.loads), 1)
+
+    def test_query_string_does_not_make_another_service(self):
+        self.store.get_all(self.URL)
+        self.store.get_all(self.URL + "?state=TX")
+        self.assertEqual(self.loads, [self.URL])
+
+    def test_concurrent_cold_loads_are_single_flight(self):
+        release = threading.Event()
+
+        def slow_load(url):
+            release.wait(5)
+            return self.load(url)
+
+        store = DealerStore(slow_load, ttl=60, hard_ttl=600)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(store.get_all(self.URL)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(self.loads), 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_reloads_after_the_ttl(self):
+        self.store.get_all(self.URL)
+        age_index(self.store, self.URL, 61)
+        self.dealers.append(make_dealer(3))
+        self.assertEqual(len(self.store.get_all(self.URL)), 3)
+        self.assertEqual(len(self.loads), 2)
+
+    def test_unchanged_reload_keeps_the_indexes(self):
+        geo = self.store.index(self.URL).geo
+        age_index(self.store, self.URL, 61)
+        self.assertIs(self.store.index(self.URL).geo, geo)
+        self.assertEqual(self.store.stats()["unchanged_loads"], 1)
+
+    def test_failed_reload_keeps_the_previous_copy(self):
+        self.store.get_all(self.URL)
+        age_index(self.store, self.URL, 61)
+        self.dealers = []
+        self.assertEqual(len(self.store.get_all(self.URL)), 2)
+
+    def test_no_copy_is_served_past_the_hard_ttl(self):
+        self.store.get_all(self.URL)
+        age_index(self.store, self.URL, 601)
+        self.dealers = []
+        self.assertEqual(self.store.get_all(self.URL), [])
+        self.assertEqual(self.store.get_all(self.URL, stale_while_revalidate=True), [])
+
+    def test_stale_copy_is_served_while_revalidating(self):
+        self.store.get_all(self.URL)
+        age_index(self.store, self.URL, 61)
+        release = threading.Event()
+        self.dealers.append(make_dealer(3))
+
+        def slow_load(url):
+            release.wait(5)
+            return self.load(url)
+
+        self.store._loader = slow_load  # pylint: disable=protected-access
+        # Served at once, although the loader is blocked
+        self.assertEqual(len(self.store.get_all(self.URL, stale_while_revalidate=True)), 2)
+        self.assertEqual(len(self.store.get_all(self.URL, stale_while_revalidate=True)), 2)
+        release.set()
+        # peek only returns a fresh copy, without starting refreshes of its own
+        for _ in range(500):
+            if self.store.peek(self.URL) is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.store.get_all(self.URL)), 3)
+        # One background refresh for the two stale reads
+        self.assertEqual(self.store.stats()["background_refreshes"], 1)
+        self.assertEqual(len(self.loads), 2)
+
+
+class FakeResponse:
+    """Just enough of a requests response for the service calls of restapis."""
+
+    def __init__(self, status_code, body=None, headers=None, chunk_size=7):
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+        self._body = json.dumps(body).encode('utf-8') if body is not None else b''
+        self._chunk_size = chunk_size
+        self.json_calls = 0
+        self.chunks_read = 0
+        self.closed = False
+
+    def json(self):
+        self.json_calls += 1
+        return json.loads(self._body)
+
+    def iter_content(self, chunk_size=None):  # pylint: disable=unused-argument
+        for start in range(0, len(self._body), self._chunk_size):
+            self.chunks_read += 1
+            yield self._body[start:start + self._chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServiceTestCase(SimpleTestCase):
+    """Serves the responses of `self.responses` to the service calls of restapis, in order."""
+
+    def setUp(self):
+        validator_cache.clear()
+        self.addCleanup(validator_cache.clear)
+        self.responses = []
+        self.sent_headers = []
+        session = mock.Mock()
+        session.get.side_effect = self.fake_get
+        patcher = mock.patch('djangoapp.restapis.get_session', return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_get(self, url, headers=None, **kwargs):  # pylint: disable=unused-argument
+        self.sent_headers.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+
+class JSONArrayDecoderTests(FakeServiceTestCase):
+    """JSON arrays are decoded whatever the chunk boundaries, and streams may stop early."""
+
+    ARRAY = [{"name": "Zoë", "review": "Great, [really] \"good\" car"}, 12, -3.5e2, "]",
+             [1, [2, {}]], True, None, "日本"]
+
+    def test_every_split_point(self):
+        body = json.dumps(self.ARRAY, ensure_ascii=False).encode('utf-8')
+        for split in range(len(body) + 1):
+            decoder = JSONArrayDecoder()
+            elements = decoder.feed(body[:split]) + decoder.feed(body[split:], final=True)
+            self.assertEqual(elements, self.ARRAY, f"split at byte {split}")
+
+    def test_byte_by_byte(self):
+        body = json.dumps(self.ARRAY, ensure_ascii=False).encode('utf-8')
+        chunks = [body[i:i + 1] for i in range(len(body))]
+        self.assertEqual(list(iter_json_array(chunks)), self.ARRAY)
+
+    def test_number_at_a_chunk_end_waits_for_the_next_chunk(self):
+        decoder = JSONArrayDecoder()
+        self.assertEqual(decoder.feed(b'[12'), [])
+        self.assertEqual(decoder.feed(b'34]', final=True), [1234])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([b' [ ', b' ] '])), [])
+
+    def test_truncated_body_is_an_error(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'[1, 2, {"a":']))
+
+    def test_body_that_is_not_an_array_is_an_error(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"error": "not found"}']))
+
+    def test_chunks_after_the_array_are_not_read(self):
+        read = []
+
+        def chunks():
+            for chunk in (b'[1, 2', b']', b'trailing'):
+                read.append(chunk)
+                yield chunk
+
+        self.assertEqual(list(iter_json_array(chunks())), [1, 2])
+        self.assertEqual(read, [b'[1, 2', b']'])
+
+    def test_stopping_early_closes_the_response(self):
+        response = FakeResponse(200, list(range(1000)), {"ETag": '"v1"'})
+        self.responses.append(response)
+        elements = iter_request("http://reviews.test/api/get_reviews")
+        self.assertEqual([next(elements) for _ in range(3)], [0, 1, 2])
+        elements.close()
+        self.assertTrue(response.closed)
+        self.assertLess(response.chunks_read, 10)
+        # A body not read to the end is not kept for revalidation
+        self.assertIsNone(validator_cache.get("http://reviews.test/api/get_reviews", {}))
+
+
+class ValidatorCacheTests(FakeServiceTestCase):
+    """Tagged responses are revalidated, and a 304 reuses the body parsed last time."""
+
+    URL = "http://dealers.test/api/dealerships/"
+
+    def test_not_modified_reuses_the_parsed_body(self):
+        self.responses.append(FakeResponse(200, [{"id": 1}], {"ETag": '"v1"'}))
+        first = get_request(self.URL, state="TX")
+        not_modified = FakeResponse(304)
+        self.responses.append(not_modified)
+        self.assertIs(get_request(self.URL, state="TX"), first)
+        self.assertEqual(self.sent_headers[1]["If-None-Match"], '"v1"')
+        self.assertEqual(not_modified.json_calls, 0)
+        self.assertEqual(validator_cache.stats()["not_modified"], 1)
+
+    def test_streamed_body_is_reused(self):
+        self.responses.append(FakeResponse(200, [1, 2, 3], {"ETag": '"v1"'}))
+        self.assertEqual(list(iter_request(self.URL)), [1, 2, 3])
+        self.responses.append(FakeResponse(304))
+        self.assertEqual(list(iter_request(self.URL)), [1, 2, 3])
+
+    def test_parameters_are_part_of_the_key(self):
+        self.responses.append(FakeResponse(200, [1], {"ETag": '"tx"'}))
+        get_request(self.URL, state="TX")
+        self.responses.append(FakeResponse(200, [2], {"ETag": '"ca"'}))
+        get_request(self.URL, state="CA")
+        self.assertNotIn("If-None-Match", self.sent_headers[1])
+
+    def test_untagged_response_is_not_kept(self):
+        self.responses.append(FakeResponse(200, [1], {"ETag": '"v1"'}))
+        get_request(self.URL)
+        self.responses.append(FakeResponse(200, [2]))
+        get_request(self.URL)
+        self.responses.append(FakeResponse(200, [3]))
+        self.assertEqual(get_request(self.URL), [3])
+        self.assertNotIn("If-None-Match", self.sent_headers[2])
+
+    def test_least_recently_used_response_is_evicted(self):
+        cache = ValidatorCache(max_entries=2)
+        for number in range(3):
+            cache.store(self.URL, {"page": number}, f'"{number}"', {}, [number])
+        self.assertIsNone(cache.get(self.URL, {"page": 0}))
+        self.assertEqual(cache.get(self.URL, {"page": 2}).body, [2])
+
+
+class ReviewSearchTests(TestCase):
+    """Review search ranks matches on the car first, filters, and reads queries as words."""
+
+    def setUp(self):
+        reviews = [
+            ("r1", 15, "TX", "positive", "Battery range is great", "Tesla", "Model 3"),
+            ("r2", 15, "TX", "negative", "The Tesla I test drove had a weak battery",
+             "Kia", "EV6"),
+            ("r3", 16, "CA", "positive", "Great battery and range", "Nissan", "Leaf"),
+            ("r4", 16, "CA", "neutral", "Friendly staff", "Audi", "A4"),
+        ]
+        for review_id, dealership, state, sentiment, text, make, model in reviews:
+            index_review(review_id, {"dealership": dealership, "sentiment": sentiment,
+                                     "review": text, "car_make": make, "car_model": model},
+                         state)
+
+    def ids(self, query, **filters):
+        reviews, _ = search_reviews(query, **filters)
+        return [review.review_id for review in reviews]
+
+    def test_every_word_must_match(self):
+        self.assertEqual(sorted(self.ids("battery range")), ["r1", "r3"])
+
+    def test_car_matches_rank_first(self):
+        self.assertEqual(self.ids("tesla"), ["r1", "r2"])
+
+    def test_filters(self):
+        self.assertEqual(self.ids("battery", dealer_id=16), ["r3"])
+        self.assertEqual(sorted(self.ids("battery", state="tx")), ["r1", "r2"])
+        self.assertEqual(self.ids("battery", sentiment="negative"), ["r2"])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(sorted(self.ids('battery" OR staff')), [])
+        self.assertEqual(self.ids('friendly* (staff'), ["r4"])
+        self.assertEqual(self.ids('"'), [])
+        self.assertEqual(search_reviews(""), ([], False))
+
+    def test_pages(self):
+        first, has_more = search_reviews("battery", limit=2)
+        self.assertTrue(has_more)
+        rest, has_more = search_reviews("battery", limit=2, offset=2)
+        self.assertFalse(has_more)
+        self.assertEqual(len({review.review_id for review in first + rest}), 3)
+
+    def test_reindexing_a_review_replaces_it(self):
+        index_review("r4", {"dealership": 16, "review": "Rude staff"}, "CA")
+        self.assertEqual(self.ids("friendly"), [])
+        self.assertEqual(self.ids("rude"), ["r4"])
+
+
+@override_settings(DATABASE_HEALTH_CHECKS=True, DATABASE_HEALTH_CHECK_INTERVAL=30)
+class ConnectionHealthCheckTests(SimpleTestCase):
+    """Persistent connections are probed at most once per interval, and closed when broken."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.connection = mock.Mock(spec=['connection', 'settings_dict', 'in_atomic_block',
+                                          'is_usable', 'close'])
+        self.connection.settings_dict = {'CONN_MAX_AGE': 600}
+        self.connection.in_atomic_block = False
+        self.connection.is_usable.return_value = True
+        patches = [mock.patch('djangoapp.db.time.monotonic', self.clock),
+                   mock.patch('djangoapp.db.connections.all', return_value=[self.connection])]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_probed_once_per_interval(self):
+        check_connections()
+        self.clock.now += 10
+        check_connections()
+        self.assertEqual(self.connection.is_usable.call_count, 1)
+        self.clock.now += 25
+        check_connections()
+        self.assertEqual(self.connection.is_usable.call_count, 2)
+
+    def test_broken_connection_is_closed(self):
+        self.connection.is_usable.return_value = False
+        check_connections()
+        self.connection.close.assert_called_once_with()
+
+    @override_settings(DATABASE_HEALTH_CHECKS=False)
+    def test_off_by_setting(self):
+        check_connections()
+        self.connection.is_usable.assert_not_called()
+
+
+class FakeDealerServices:
+    """In-memory stand-ins for the async_restapis calls of the dealer views."""
+
+    def __init__(self, test):
+        self.dealers = [make_dealer(DEALER_ID)]
+        self.reviews = [DealerReview(DEALER_ID, "Ann", True, "Great car", sentiment="positive")]
+        self.summary = {"review_count": 1, "latest_time": "2026-10-01T10:00:00"}
+        self.reviews_delay = 0
+        for name in ("get_dealer_index", "get_dealer_by_id", "get_dealer_reviews_page_from_cf",
+                     "get_dealer_review_summary", "post_request"):
+            patcher = mock.patch(f"djangoapp.async_restapis.{name}", getattr(self, name))
+            patcher.start()
+            test.addCleanup(patcher.stop)
+
+    async def get_dealer_index(self, url, stale_while_revalidate=False):
+        return build_index(self.dealers, time.monotonic())
+
+    async def get_dealer_by_id(self, url, dealer_id):
+        return [dealer for dealer in self.dealers if dealer.id == int(dealer_id)]
+
+    async def get_dealer_reviews_page_from_cf(self, url, dealer_id, bookmark=None):
+        await asyncio.sleep(self.reviews_delay)
+        return list(self.reviews), None
+
+    async def get_dealer_review_summary(self, url, dealer_id):
+        return dict(self.summary)
+
+    async def post_request(self, url, json_payload, **kwargs):
+        review = json_payload["review"]
+        # The summary is left as it was, as when its update lags behind the post
+        self.reviews.append(DealerReview(review["dealership"], review["name"],
+                                         review["purchase"], review["review"]))
+        return mock.Mock(status_code=201, json=mock.Mock(return_value={"id": "posted"}))
+
+
+class ConditionalPageTests(TestCase):
+    """Dealer pages answer 304 to clients holding the current copy, and posts refresh them."""
+
+    def setUp(self):
+        fragment_cache.cache.clear()
+        self.services = FakeDealerServices(self)
+
+    def get(self, path, **headers):
+        return self.client.get(path, HTTP_HOST="localhost", **headers)
+
+    def test_dealer_list_is_revalidated_by_etag(self):
+        response = self.get("/djangoapp/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertEqual(self.get("/djangoapp/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.services.dealers.append(make_dealer(OTHER_DEALER_ID))
+        response = self.get("/djangoapp/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_dealer_page_is_revalidated_by_etag_and_last_modified(self):
+        response = self.get(f"/djangoapp/dealer/{DEALER_ID}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Last-Modified"], "Thu, 01 Oct 2026 10:00:00 GMT")
+        not_modified = self.get(f"/djangoapp/dealer/{DEALER_ID}/",
+                                HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        self.assertEqual(self.get(f"/djangoapp/dealer/{DEALER_ID}/",
+                                  HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code,
+                         304)
+        # A new review moves the summary on, and with it the validators
+        self.services.summary = {"review_count": 2, "latest_time": "2026-10-02T10:00:00"}
+        self.assertEqual(self.get(f"/djangoapp/dealer/{DEALER_ID}/",
+                                  HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_posted_review_shows_on_the_dealer_page(self):
+        user = User.objects.create_user("reviewer", password="secret")
+        self.client.force_login(user)
+        make = CarMake.objects.create(name="Audi", description="German")
+        car = CarModel.objects.create(make=make, dealer_id=DEALER_ID, name="A4", year=2020)
+        first = self.get(f"/djangoapp/dealer/{DEALER_ID}/")
+        self.assertNotContains(first, "Smooth ride")
+
+        response = self.client.post(f"/djangoapp/dealer/{DEALER_ID}/add_review/",
+                                    {"content": "Smooth ride", "car": car.id},
+                                    HTTP_HOST="localhost")
+        self.assertRedirects(response, f"/djangoapp/dealer/{DEALER_ID}/",
+                             fetch_redirect_response=False)
+        # Same summary, but the cached page was dropped by the post
+        page = self.get(f"/djangoapp/dealer/{DEALER_ID}/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(page.status_code, 200)
+        self.assertContains(page, "Smooth ride")
+
+
+class DealerDetailsDeadlineTests(TestCase):
+    """The dealer page is rendered without the reviews that miss its deadline."""
+
+    def setUp(self):
+        fragment_cache.cache.clear()
+        self.services = FakeDealerServices(self)
+
+    @override_settings(DEALER_DETAILS_DEADLINE=0.2)
+    async def test_late_reviews_leave_the_dealer_with_a_notice(self):
+        self.services.reviews_delay = 5
+        started = time.monotonic()
+        response = await self.async_client.get(f"/djangoapp/dealer/{DEALER_ID}/")
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertContains(response, f"Dealer {DEALER_ID}")
+        self.assertContains(response, "Reviews are unavailable")
+        self.assertNotIn("ETag", response)
+        # The incomplete page was not cached
+        self.services.reviews_delay = 0
+        response = await self.async_client.get(f"/djangoapp/dealer/{DEALER_ID}/")
+        self.assertContains(response, "Great car")
+
+    async def test_missing_dealer_is_not_found(self):
+        response = await self.async_client.get(f"/djangoapp/dealer/{OTHER_DEALER_ID}/")
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncDealerIndexTests(SimpleTestCase):
+    """Each event loop loads a dealer list once for all its waiting requests, with its client."""
+
+    URL = "http://dealers.test/api/dealerships/"
+
+    def setUp(self):
+        dealer_store.invalidate()
+        self.addCleanup(dealer_store.invalidate)
+        self.fetches = 0
+        patcher = mock.patch('djangoapp.async_restapis.get_dealers_from_cf', self.fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def fetch(self, url, **kwargs):
+        self.fetches += 1
+        await asyncio.sleep(0.05)
+        return [make_dealer(1), make_dealer(2, "CA")]
+
+    async def test_concurrent_callers_share_one_fetch(self):
+        indexes = await asyncio.gather(*[async_restapis.get_dealer_index(self.URL)
+                                         for _ in range(10)])
+        self.assertEqual(self.fetches, 1)
+        self.assertTrue(all(index is indexes[0] for index in indexes))
+        self.assertEqual(sorted(indexes[0].by_id), [1, 2])
+
+    def test_each_event_loop_has_its_own_client_and_locks(self):
+        async def load():
+            client = async_restapis.get_client()
+            self.assertIs(async_restapis.get_client(), client)
+            index = await async_restapis.get_dealer_index(self.URL)
+            await client.aclose()
+            return client, index
+
+        first_client, first_index = asyncio.run(load())
+        dealer_store.invalidate()
+        # The load lock of the first loop is not reused by the second one
+        second_client, second_index = asyncio.run(load())
+        self.assertIsNot(first_client, second_client)
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(first_index.version, second_index.version)
+
+
+@override_settings(NLU_URL="http://nlu.test")
+class SentimentBatchTests(TestCase):
+    """A batch is scored within its deadline; the rest falls back locally, then to the default."""
+
+    def setUp(self):
+        sentiment_cache.clear()
+        caches[settings.SENTIMENT_CACHE_ALIAS].clear()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        patchers = [
+            mock.patch.dict('djangoapp.sentiment._backends', {'nlu': NLUSentimentBackend()}),
+            mock.patch('djangoapp.sentiment.nlu_client'),
+        ]
+        for patcher in patchers:
+            started = patcher.start()
+            self.addCleanup(patcher.stop)
+        self.analyze = started.get.return_value.analyze
+        self.analyze.side_effect = self.fake_analyze
+
+    def fake_analyze(self, text, **kwargs):
+        """Answer positive at once, except for slow reviews and failing ones."""
+        if "slow" in text:
+            self.release.wait(5)
+        if "fail" in text:
+            raise requests.exceptions.ConnectionError("NLU unreachable")
+        return mock.Mock(get_result=mock.Mock(
+            return_value={"sentiment": {"document": {"label": "positive"}}}))
+
+    @override_settings(SENTIMENT_BACKEND='nlu', SENTIMENT_FALLBACK_BACKEND='local',
+                       SENTIMENT_MIN_CALL_TIME=0.1)
+    def test_reviews_late_for_the_deadline_are_labelled_locally(self):
+        started = time.monotonic()
+        labels = analyze_review_sentiments_batch(
+            ["Good enough", "slow and terrible service"], timeout=3, deadline=0.3)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(labels, ["positive", "negative"])
+        # Only the NLU answer is cached; the late review is scored again next time
+        self.assertEqual(sentiment_cache.get("Good enough"), "positive")
+        self.assertIsNone(sentiment_cache.get("slow and terrible service"))
+
+    @override_settings(SENTIMENT_BACKEND='nlu', SENTIMENT_FALLBACK_BACKEND='local')
+    def test_failed_reviews_are_labelled_locally(self):
+        self.assertEqual(analyze_review_sentiments_batch(["fail, rude staff"]), ["negative"])
+
+    @override_settings(SENTIMENT_BACKEND='nlu', SENTIMENT_FALLBACK_BACKEND='',
+                       SENTIMENT_DEFAULT_LABEL='neutral')
+    def test_without_a_fallback_failed_reviews_get_the_default_label(self):
+        self.assertEqual(analyze_review_sentiments_batch(["fail, rude staff", "Nice car"]),
+                         ["neutral", "positive"])
+
+    @override_settings(SENTIMENT_BACKEND='nlu', NLU_URL='')
+    def test_without_an_nlu_service_reviews_are_labelled_locally(self):
+        self.assertEqual(get_sentiment_backend().name, 'local')
+        self.assertEqual(analyze_review_sentiments_batch(["Rude staff"]), ["negative"])
+        self.analyze.assert_not_called()
+
+    @override_settings(SENTIMENT_BACKEND='nlu')
+    def test_cached_labels_are_not_scored_again(self):
+        analyze_review_sentiments_batch(["Nice car", "Nice car"])
+        self.assertEqual(self.analyze.call_count, 1)
+        sentiment_cache.clear()
+        # Served by the persistent tier
+        self.assertEqual(analyze_review_sentiments_batch(["Nice car"]), ["positive"])
+        self.assertEqual(self.analyze.call_count, 1)
+
+
+class SentimentCacheTests(TestCase):
+    """Labels are kept in a bounded in-process tier in front of the `sentiment` cache."""
+
+    def setUp(self):
+        caches[settings.SENTIMENT_CACHE_ALIAS].clear()
+        self.clock = FakeClock()
+        patcher = mock.patch('djangoapp.sentiment_cache.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = SentimentCache(max_entries=2, ttl=60)
+
+    def stats(self, *names):
+        snapshot = self.cache.stats()
+        return [snapshot[name] for name in names]
+
+    def test_labels_are_stored_in_both_tiers(self):
+        self.cache.set("Great car", "positive")
+        self.assertEqual(self.cache.get("Great car"), "positive")
+        persistent = caches[settings.SENTIMENT_CACHE_ALIAS]
+        self.assertEqual(persistent.get(SentimentCache.key("Great car")), "positive")
+        self.assertEqual(self.stats("local_hits", "persistent_hits", "misses"), [1, 0, 0])
+
+    def test_persistent_tier_refills_the_local_tier(self):
+        self.cache.set("Great car", "positive")
+        # A new worker, or one that restarted
+        other = SentimentCache(max_entries=2, ttl=60)
+        self.assertEqual(other.get("Great car"), "positive")
+        self.assertEqual(other.get("Great car"), "positive")
+        snapshot = other.stats()
+        self.assertEqual([snapshot["persistent_hits"], snapshot["local_hits"]], [1, 1])
+
+    def test_least_recently_used_labels_are_evicted(self):
+        self.cache.set_many({"a": "positive", "b": "negative"})
+        self.cache.get("a")
+        self.cache.set("c", "neutral")
+        self.assertEqual(self.stats("evictions", "local_entries"), [1, 2])
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]),
+                         {"a": "positive", "b": "negative", "c": "neutral"})
+        # "b" was evicted from the local tier and came back from the persistent one
+        self.assertEqual(self.stats("persistent_hits"), [1])
+
+    def test_expired_local_entries_are_dropped(self):
+        self.cache.set("Great car", "positive")
+        self.clock.now += 61
+        self.cache.get("Great car")
+        self.assertEqual(self.stats("local_hits", "persistent_hits"), [0, 1])
+
+    def test_misses_and_hit_ratio(self):
+        self.cache.set("Great car", "positive")
+        self.assertEqual(self.cache.get_many(["Great car", "Rude staff"]),
+                         {"Great car": "positive"})
+        self.assertEqual(self.stats("misses", "hit_ratio"), [1, 0.5])
+
+    def test_labels_depend_on_the_model_version(self):
+        self.cache.set("Great car", "positive")
+        self.cache.clear()
+        with override_settings(NLU_VERSION="2099-01-01"):
+            self.assertIsNone(self.cache.get("Great car"))
+
+    def test_unavailable_persistent_tier_counts_as_misses(self):
+        failing = mock.Mock()
+        failing.get_many.side_effect = DatabaseError("no such table")
+        with mock.patch('djangoapp.sentiment_cache.caches',
+                        {settings.SENTIMENT_CACHE_ALIAS: failing}):
+            self.assertEqual(self.cache.get_many(["Great car"]), {})
+        self.assertEqual(self.stats("misses"), [1])
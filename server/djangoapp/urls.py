@@ -30,6 +30,12 @@ urlpatterns = [
 
     path(route='', view=views.get_dealerships, name='index'),
 
+    # path for the dealers closest to a location
+    path(route='dealer/nearest/', view=views.get_nearest_dealerships, name='nearest_dealers'),
+
+    # path for the full-text search of reviews
+    path(route='reviews/search/', view=views.search_reviews, name='search_reviews'),
+
     # path for dealer reviews view
     path(route='dealer/<int:dealer_id>/', view=views.get_dealer_details, name='dealer_details'),
 
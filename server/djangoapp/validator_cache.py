@@ -0,0 +1,105 @@
+"""
+Module: validator_cache
+
+Entity tags and parsed bodies of the last responses of the dealership and review
+services, for conditional GET requests.
+
+Most fetches of the dealer list and of review pages return what the previous fetch
+did. The services tag their responses with an ``ETag`` derived from the revisions
+of the documents returned. `get_request` and `iter_request` (sync and async) keep
+the tag, the response headers and the parsed body of each URL, send the tag back
+in ``If-None-Match``, and on a ``304 Not Modified`` reuse the parsed body instead
+of downloading and decoding it again.
+
+Bodies are shared between callers and must be treated as read-only.
+
+Usage:
+    from .validator_cache import validator_cache
+    headers = validator_cache.request_headers(url, params)
+    entry = validator_cache.get(url, params)  # after a 304
+    validator_cache.store(url, params, response.headers.get('etag'), headers, body)
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+
+# What is kept of a response: its ETag, its headers (lowercase names) and its parsed body
+CachedResponse = namedtuple('CachedResponse', ['etag', 'headers', 'body'])
+
+
+class ValidatorCache:
+    """
+    Bounded LRU of tagged responses, keyed by URL and query parameters.
+
+    Args:
+        max_entries (int, optional): Number of responses kept
+            (default is ``settings.RESTAPI_VALIDATOR_CACHE_ENTRIES``).
+    """
+
+    def __init__(self, max_entries=None):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {"not_modified": 0, "stored": 0}
+
+    @staticmethod
+    def _key(url, params):
+        """Identify a request by its URL and sorted query parameters."""
+        return url, tuple(sorted((name, str(value)) for name, value in params.items()))
+
+    def get(self, url, params):
+        """Return the CachedResponse of a request, or None."""
+        key = self._key(url, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def request_headers(self, url, params):
+        """Return the conditional headers to send with a request: If-None-Match, if tagged."""
+        entry = self.get(url, params)
+        return {'If-None-Match': entry.etag} if entry is not None else {}
+
+    def not_modified(self, url, params):
+        """
+        Return the cached response of a request the service answered with a 304.
+
+        Returns:
+            CachedResponse or None: The cached response, or None if it was evicted
+            since the request was sent.
+        """
+        entry = self.get(url, params)
+        if entry is not None:
+            with self._lock:
+                self._counters["not_modified"] += 1
+        return entry
+
+    def store(self, url, params, etag, headers, body):
+        """Keep the tag, headers and parsed body of a 200 response; untagged ones are not kept."""
+        key = self._key(url, params)
+        with self._lock:
+            if not etag:
+                self._entries.pop(key, None)
+                return
+            headers = {name.lower(): value for name, value in headers.items()}
+            self._entries[key] = CachedResponse(etag, headers, body)
+            self._entries.move_to_end(key)
+            self._counters["stored"] += 1
+            max_entries = self._max_entries or settings.RESTAPI_VALIDATOR_CACHE_ENTRIES
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return a snapshot of the 304 and stored response counters."""
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries))
+
+    def clear(self):
+        """Forget every cached response."""
+        with self._lock:
+            self._entries.clear()
+
+
+# Process-wide cache shared by restapis and async_restapis
+validator_cache = ValidatorCache()
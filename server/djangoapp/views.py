@@ -9,23 +9,115 @@ submitting reviews, and more.
 Author: Oumaima TOUIl
 Date: September 26, 2023
 """
-from datetime import datetime
+import asyncio
+from datetime import datetime, timezone
+import hashlib
 import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.safestring import mark_safe
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
-from .models import CarModel
-from .restapis import (
-    get_dealers_from_cf,
-    get_dealer_reviews_from_cf,
-    get_dealer_by_id,
-    post_request,
-)
+from .models import CarDealer, CarModel
+from . import async_restapis, search
+from .catalog import car_catalog
+from .dealer_store import dealer_version
+from .fragment_cache import fragment_cache
+from .restapis import dealer_store
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+# Sentiment labels reviews can be filtered by
+SENTIMENT_LABELS = ("positive", "neutral", "negative")
+
+
+def authenticated_user(request):
+    """
+    Return the logged-in user of a request, or None.
+
+    Loading the user reads the session and the database, so async views call this
+    through ``sync_to_async``; afterwards ``request.user`` can be used anywhere.
+    """
+    return request.user if request.user.is_authenticated else None
+
+
+def car_fields(dealer_id, car_id):
+    """
+    Return the make, model and year fields of a review for a car of a dealer's catalog.
+
+    Raises:
+        CarModel.DoesNotExist: If the dealer does not sell a car with this ID.
+    """
+    car = car_catalog.get_car(dealer_id, car_id)
+    if car is None:
+        raise CarModel.DoesNotExist(f"Dealer {dealer_id} has no car {car_id}")
+    return {"car_make": car.make, "car_model": car.name, "car_year": str(car.year)}
+
+
+def cached_fragment(name, scope, version):
+    """
+    Look up a rendered fragment in the fragment cache.
+
+    Returns:
+        tuple: The cache key of this version of the fragment, and the fragment or None.
+    """
+    key = fragment_cache.key(name, scope, version)
+    return key, fragment_cache.get(key)
+
+
+def render_fragment(request, key, template_name, context):
+    """Render a fragment and store it under `key`, or only render it if `key` is None."""
+    html = render_to_string(template_name, context, request)
+    if key is None:
+        return mark_safe(html)
+    return fragment_cache.set(key, html)
+
+
+def entity_tag(*parts):
+    """Return a strong entity tag for a page built from the given parts."""
+    return quote_etag(hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32])
+
+
+def review_timestamp(value):
+    """Return the POSIX timestamp of a review time, or None if it is missing or invalid."""
+    try:
+        moment = datetime.fromisoformat(str(value).rstrip('Z'))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+    Add the headers letting browsers and caches revalidate a page instead of fetching it.
+
+    The pages show who is logged in, so caches keep one copy per session cookie and
+    check it with the server before every use.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+
+
+def not_modified(request, etag, last_modified=None):
+    """Return a 304 response if the copy of the page the client holds is current, or None."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
 
 # Create your views here.
 
@@ -178,41 +270,203 @@ def registration_request(request):
     return render(request, 'djangoapp/registration.html', context)
 
 # Update the `get_dealerships` view to render the index page with a list of dealerships
-def get_dealerships(request):
+async def get_dealerships(request):
     """
     Get a list of dealerships and render the index page.
 
-    This view handles a GET request to fetch a list of dealerships from an external URL
-    and then renders the 'index' page with the list of dealerships in the context.
+    This view handles a GET request to fetch a list of dealerships from the local dealership
+    store, which reads through to an external URL, and then renders the 'index' page with
+    the list of dealerships in the context. The store runs in stale-while-revalidate mode
+    here, so the page never waits on the dealerships service once a copy has been loaded.
+    The view is async: while the list is being loaded, the worker serves other requests.
+    The dealer table is rendered once per version of the dealer list and taken from the
+    fragment cache afterwards; only the navbar is rendered for every request.
 
     Args:
         request (HttpRequest): The HTTP request object.
 
     Returns:
         HttpResponse: The HTTP response that renders the 'index' page with the list of
-        dealerships in the context.
+        dealerships in the context. Its ``Age`` header gives the age in seconds of the
+        dealer list served, and a ``Warning: 110`` header marks a list past its TTL.
+        The page carries an ``ETag``, and a request whose ``If-None-Match`` matches it
+        gets an empty 304 response.
     """
     if request.method == "GET":
-        url = (
-            "https://oumaimatouil-3000.theiadocker-1-labs-prod-"
-            "theiak8s-4-tor01.proxy.cognitiveclass.ai/api/dealerships/")
+        url = f"{settings.DEALERSHIPS_SERVICE_URL}/api/dealerships/"
+
+        # Get dealers from the store, loading them from the URL when needed
+        index = await async_restapis.get_dealer_index(url, stale_while_revalidate=True)
+        user = await sync_to_async(authenticated_user)(request)
+        # An empty list means the service is down: nothing is cached then
+        etag = entity_tag(index.version, user.pk if user else None) if index.dealers else None
+        if etag is not None:
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
 
-        # Get dealers from the URL
-        dealerships = get_dealers_from_cf(url)
         # Create an empty context dictionary
         context = {}
-        # Add the dealerships list to the context
-        context['dealerships'] = dealerships
-        return render(request, 'djangoapp/index.html', context)
+        # Add the dealerships table to the context
+        key, dealer_table = None, None
+        if index.dealers:
+            key, dealer_table = await sync_to_async(cached_fragment)(
+                'dealer_table', 'all', index.version)
+        if dealer_table is None:
+            dealer_table = await sync_to_async(render_fragment)(
+                request, key, 'djangoapp/dealer_table.html', {'dealerships': index.dealers})
+        context['dealer_table'] = dealer_table
+        # Rendering reads the session and the user, which is sync only
+        response = await sync_to_async(render)(request, 'djangoapp/index.html', context)
+
+        if etag is not None:
+            set_validators(response, etag)
+        age = dealer_store.age(index)
+        if age is not None:
+            response['Age'] = str(int(age))
+            if age >= dealer_store.ttl:
+                response['Warning'] = '110 - "Response is Stale"'
+        return response
+
+
+def parse_nearest_query(params):
+    """
+    Validate the query parameters of `get_nearest_dealerships`.
+
+    Returns:
+        tuple: The latitude, longitude, number of dealers and radius (None if absent).
+
+    Raises:
+        ValueError: With a message for the caller if a parameter is invalid.
+    """
+    try:
+        lat, long = float(params['lat']), float(params['long'])
+    except (KeyError, ValueError) as error:
+        raise ValueError("'lat' and 'long' parameters must be numbers") from error
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        raise ValueError("'lat' and 'long' parameters are out of range")
+    try:
+        k = int(params.get('k', settings.NEAREST_DEALERS_DEFAULT_K))
+        radius = float(params['radius']) if params.get('radius') else None
+    except ValueError as error:
+        raise ValueError("'k' must be an integer and 'radius' a number") from error
+    if not 1 <= k <= settings.NEAREST_DEALERS_MAX_K:
+        raise ValueError(f"'k' parameter must be between 1 and {settings.NEAREST_DEALERS_MAX_K}")
+    if radius is not None and radius <= 0:
+        raise ValueError("'radius' parameter must be positive")
+    return lat, long, k, radius
+
+
+async def get_nearest_dealerships(request):
+    """
+    Return the dealerships closest to a location as JSON.
+
+    The dealers come from the local dealership store, whose grid index answers the query
+    without looking at every dealer.
+
+    Query parameters:
+        lat, long: The location, in degrees.
+        k: Number of dealerships to return (default ``settings.NEAREST_DEALERS_DEFAULT_K``).
+        radius: Only return dealerships within this many kilometres.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The dealerships closest first, each with its ``distance_km``, or an
+        error message with status 400 if a parameter is invalid.
+    """
+    try:
+        lat, long, k, radius = parse_nearest_query(request.GET)
+    except ValueError as value_error:
+        return JsonResponse({"error": str(value_error)}, status=400)
 
+    url = f"{settings.DEALERSHIPS_SERVICE_URL}/api/dealerships/"
+    nearest = await async_restapis.get_nearest_dealers(url, lat, long, k, radius)
+    dealerships = []
+    for dealer, distance in nearest:
+        dealership = {field: getattr(dealer, field) for field in CarDealer.__slots__}
+        dealership["distance_km"] = round(distance, 3)
+        dealerships.append(dealership)
+    return JsonResponse({"dealerships": dealerships})
 
-def get_dealer_details(request, dealer_id):
+
+def search_reviews(request):
+    """
+    Search the reviews of every dealership and render the search page.
+
+    The query is answered by the local full-text index of reviews (see `search`), never
+    by reading the reviews themselves, and the best matches come first.
+
+    Query parameters:
+        q: Words to look for in the review text, car make and car model.
+        dealer: Only show reviews of this dealership ID.
+        state: Only show reviews of dealerships in this state code.
+        sentiment: Only show reviews with this sentiment ("positive", "neutral", "negative").
+        page: Page of ``settings.REVIEW_SEARCH_PAGE_SIZE`` results to show (default is 1).
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        HttpResponse: The HTTP response that renders the 'search' page with the matching
+        reviews in the context.
+    """
+    params = request.GET
+    query = params.get('q', '').strip()
+    try:
+        dealer_id = int(params['dealer']) if params.get('dealer') else None
+    except ValueError:
+        dealer_id = None
+    try:
+        page = max(int(params.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    state = params.get('state', '').strip().upper()
+    sentiment = params.get('sentiment', '')
+    if sentiment not in SENTIMENT_LABELS:
+        sentiment = ''
+
+    reviews, has_more = [], False
+    if query:
+        page_size = settings.REVIEW_SEARCH_PAGE_SIZE
+        reviews, has_more = search.search_reviews(
+            query, dealer_id=dealer_id, state=state, sentiment=sentiment,
+            limit=page_size, offset=(page - 1) * page_size)
+    context = {
+        "query": query,
+        "dealer_id": dealer_id,
+        "state": state,
+        "sentiment": sentiment,
+        "sentiments": SENTIMENT_LABELS,
+        "reviews": reviews,
+        "page": page,
+        "has_more": has_more,
+    }
+    return render(request, 'djangoapp/search.html', context)
+
+
+async def get_dealer_details(request, dealer_id):
     """
     Get dealer details and render the dealer details page.
 
     This view handles a GET request to fetch dealer details, including reviews, from external URLs
-    based on the provided `dealer_id`. It then renders the 'dealer_details' page with the
-    dealer information and reviews in the context.
+    based on the provided `dealer_id`. The services are called concurrently from the event
+    loop, so the page waits for the slowest of them rather than their sum, and the worker
+    serves other requests meanwhile. If the reviews are not back within
+    ``settings.DEALER_DETAILS_DEADLINE`` seconds, the page is rendered with the dealer
+    information and a "reviews unavailable" notice.
+
+    Reviews are shown one page of ``settings.REVIEWS_PAGE_SIZE`` at a time; the
+    ``bookmark`` query parameter selects the page following the one that returned it.
+    The dealer's review summary (count, purchase ratio, sentiments, top cars) is fetched
+    alongside under the same deadline and left out of the page if it is late.
+
+    The summary also versions the page: the dealer information, summary and review cards
+    are rendered once per dealer, summary and page of reviews, and taken from the
+    fragment cache afterwards without waiting for the reviews. The page carries an
+    ``ETag`` and a ``Last-Modified`` time (of the latest review), so clients holding the
+    current copy get an empty 304 response.
 
     Args:
         request (HttpRequest): The HTTP request object.
@@ -221,29 +475,123 @@ def get_dealer_details(request, dealer_id):
     Returns:
         HttpResponse: The HTTP response that renders the 'dealer_details' page with dealer
         information and reviews in the context.
+
+    Raises:
+        Http404: If the dealership service does not return the dealer in time.
     """
     context = {}
     if request.method == "GET":
-        url = (
-            'https://oumaimatouil-5000.theiadocker-1-labs-prod-'
-            'theiak8s-4-tor01.proxy.cognitiveclass.ai/api/get_reviews')
-        url_2 = (
-            'https://oumaimatouil-3000.theiadocker-1-labs-prod-'
-            'theiak8s-4-tor01.proxy.cognitiveclass.ai/api/dealerships/')
-
-        dealership = get_dealer_by_id(url_2, dealer_id)
-        print("len dealership", len(dealership))
-        reviews = get_dealer_reviews_from_cf(url, dealer_id=dealer_id)
+        url = f"{settings.REVIEWS_SERVICE_URL}/api/get_reviews"
+        url_2 = f"{settings.DEALERSHIPS_SERVICE_URL}/api/dealerships/"
+        url_3 = f"{settings.REVIEWS_SERVICE_URL}/api/get_review_summary"
+
+        bookmark = request.GET.get('bookmark')
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.DEALER_DETAILS_DEADLINE
+        dealer_task = asyncio.ensure_future(async_restapis.get_dealer_by_id(url_2, dealer_id))
+        reviews_task = asyncio.ensure_future(async_restapis.get_dealer_reviews_page_from_cf(
+            url, dealer_id, bookmark=bookmark))
+        summary_task = asyncio.ensure_future(
+            async_restapis.get_dealer_review_summary(url_3, dealer_id))
+
+        await asyncio.wait([dealer_task], timeout=settings.DEALER_DETAILS_DEADLINE)
+        if dealer_task.done():
+            dealership = dealer_task.result()
+        else:
+            logger.warning("Dealer %s not fetched within the deadline", dealer_id)
+            dealership = []
+        if not dealership:
+            for task in (dealer_task, reviews_task, summary_task):
+                task.cancel()
+            raise Http404(f"Dealer {dealer_id} is not available")
+        dealer = dealership[0]
+
+        await asyncio.wait([summary_task], timeout=max(deadline - loop.time(), 0))
+        if summary_task.done():
+            summary = summary_task.result()
+        else:
+            logger.warning("Review summary of dealer %s not fetched within the deadline",
+                           dealer_id)
+            summary_task.cancel()
+            summary = None
+
+        # Without a summary there is no version to cache the page under
+        user = await sync_to_async(authenticated_user)(request)
+        key, dealer_reviews, etag, last_modified = None, None, None, None
+        if summary is not None:
+            key, dealer_reviews = await sync_to_async(cached_fragment)(
+                'dealer_reviews', dealer_id, (dealer_version(dealer), summary, bookmark))
+            etag = entity_tag(key, user.pk if user else None)
+            last_modified = review_timestamp(summary.get('latest_time'))
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                reviews_task.cancel()
+                return response
+
+        if dealer_reviews is not None:
+            reviews_task.cancel()
+        else:
+            await asyncio.wait([reviews_task], timeout=max(deadline - loop.time(), 0))
+            reviews_unavailable = False
+            if reviews_task.done():
+                reviews, next_bookmark = reviews_task.result()
+            else:
+                logger.warning("Reviews for dealer %s not fetched within the deadline",
+                               dealer_id)
+                reviews_task.cancel()
+                reviews, next_bookmark = [], None
+                reviews_unavailable = True
+                # A page missing its reviews is neither cached nor revalidated
+                key = etag = last_modified = None
+
+            fragment_context = {
+                "reviews":  reviews,
+                "reviews_unavailable": reviews_unavailable,
+                "next_bookmark": next_bookmark,
+                "summary": summary,
+                "dealer": dealer,
+            }
+            dealer_reviews = await sync_to_async(render_fragment)(
+                request, key, 'djangoapp/dealer_reviews.html', fragment_context)
+
         context = {
-            "reviews":  reviews, 
+            "dealer_reviews": dealer_reviews,
             "dealer_id": dealer_id,
-            "dealer":dealership[0]
+            "dealer": dealer,
         }
-        return render(request, 'djangoapp/dealer_details.html', context)
+        response = await sync_to_async(render)(request, 'djangoapp/dealer_details.html', context)
+        if etag is not None:
+            set_validators(response, etag, last_modified)
+        return response
+
+
+async def index_posted_review(result, review):
+    """
+    Add a review just posted to the search index, ahead of the next sync of the index.
+
+    Failures are only logged: the review is stored, and the next sync indexes it.
+
+    Args:
+        result (httpx.Response): The response of the reviews service to the post.
+        review (dict): The review posted.
+    """
+    try:
+        review_id = result.json().get("id")
+    except ValueError:
+        review_id = None
+    if not review_id:
+        return
+    url = f"{settings.DEALERSHIPS_SERVICE_URL}/api/dealerships/"
+    dealers = await async_restapis.get_dealer_by_id(url, review["dealership"])
+    state = dealers[0].st if dealers else ''
+    try:
+        await sync_to_async(search.index_review)(review_id, review, state)
+    except DatabaseError as database_error:
+        logger.warning("Review %s not indexed: %s", review_id, database_error)
 
 
 # Create a `add_review` view to submit a review
-def add_review(request, dealer_id):
+async def add_review(request, dealer_id):
     """
     Add or retrieve a review for a dealer and render the add review page.
 
@@ -254,6 +602,8 @@ def add_review(request, dealer_id):
     and posts the review to an external API.
     If successful, it redirects to the 'dealer_details' page; otherwise, it stays on
     the 'add_review' page with an error message.
+    The view is async; the user, the cars and the template, which need the sync-only ORM,
+    are handled through ``sync_to_async``.
 
     Args:
         request (HttpRequest): The HTTP request object.
@@ -267,7 +617,8 @@ def add_review(request, dealer_id):
     """
 
     # Check if the user is authenticated
-    if not request.user.is_authenticated:
+    user = await sync_to_async(authenticated_user)(request)
+    if user is None:
         # Redirect to the login page or handle it as needed
         return redirect("/djangoapp/login")
     try:
@@ -277,18 +628,18 @@ def add_review(request, dealer_id):
         print("Invalid dealer ID")
     # Print the dealer ID before rendering th
     if request.method == "GET":
-        url = (
-                f"https://oumaimatouil-3000.theiadocker-1-labs-prod-"
-                f"theiak8s-4-tor01.proxy.cognitiveclass.ai/api/dealerships/?id={dealer_id}")
+        url = f"{settings.DEALERSHIPS_SERVICE_URL}/api/dealerships/?id={dealer_id}"
 
-        dealers = get_dealer_by_id(url, dealer_id=dealer_id)
+        dealers = await async_restapis.get_dealer_by_id(url, dealer_id=dealer_id)
+        if not dealers:
+            raise Http404(f"Dealer {dealer_id} is not available")
         dealer=dealers[0]
-        cars = CarModel.objects.all()
+        cars = await sync_to_async(car_catalog.cars)(dealer_id)
         context = {
             "cars": cars,
             "dealer": dealer,  # Include the 'dealer' object in the context
         }
-        return render(request, 'djangoapp/add_review.html', context)
+        return await sync_to_async(render)(request, 'djangoapp/add_review.html', context)
 
     if request.method == "POST":
         form = request.POST
@@ -297,7 +648,7 @@ def add_review(request, dealer_id):
         else:
             purchase = True
         review = {
-            "name": f"{request.user.first_name} {request.user.last_name}",
+            "name": f"{user.first_name} {user.last_name}",
             "dealership": dealer_id,
             "review": form["content"],
             "purchase": purchase,
@@ -305,10 +656,7 @@ def add_review(request, dealer_id):
         }
         try:
             car_id = int(form["car"])
-            car = CarModel.objects.get(pk=car_id)
-            review["car_make"] = car.make.name
-            review["car_model"] = car.name
-            review["car_year"] = str(car.year)
+            review.update(await sync_to_async(car_fields)(dealer_id, car_id))
         except (ValueError, CarModel.DoesNotExist):
             # Handle invalid car ID (You can customize this error message)
             print("Invalid car ID")
@@ -322,16 +670,17 @@ def add_review(request, dealer_id):
                     # Handle invalid purchase date format (You can customize this error message)
                     print("Invalid purchase date format")
 
-        url = (
-                "https://oumaimatouil-5000.theiadocker-1-labs-prod-"
-                "theiak8s-4-tor01.proxy.cognitiveclass.ai/api/post_review")
+        url = f"{settings.REVIEWS_SERVICE_URL}/api/post_review"
 
         json_payload = {"review": review}
-        result = post_request(url, json_payload, dealerId=dealer_id)
-        if int(result.status_code) == 201:
+        result = await async_restapis.post_request(url, json_payload, dealerId=dealer_id)
+        if result is not None and int(result.status_code) == 201:
+            # The dealer page must show the new review
+            await sync_to_async(fragment_cache.invalidate)('dealer_reviews', dealer_id)
+            await index_posted_review(result, review)
             return redirect("djangoapp:dealer_details", dealer_id=dealer_id)
         else:
-            print(int(result.status_code))
+            print(result.status_code if result is not None else "Review service unreachable")
             return redirect("djangoapp:add_review", dealer_id=dealer_id)
 
     return redirect("/djangoapp/login")
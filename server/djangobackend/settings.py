@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -76,13 +77,66 @@ WSGI_APPLICATION = 'djangobackend.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
+# DATABASE_PROFILE picks the database of a deployment (see djangoapp.db):
+# - "sqlite": the bundled db.sqlite3 with Django's defaults, for development;
+# - "sqlite-wal": an SQLite file in WAL mode with the pragmas below and persistent
+#   connections, so readers no longer wait for writers;
+# - "postgres": PostgreSQL set up by the DATABASE_* variables, with persistent
+#   connections checked before reuse. To pool connections across workers, point
+#   DATABASE_HOST at PgBouncer in transaction mode and set DATABASE_POOLER=pgbouncer.
+
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+# Seconds a connection is kept open for later requests (0 closes it after each request)
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 600))
+# Check persistent connections when a request starts, and drop the broken ones (see
+# djangoapp.db). Each check is a `SELECT 1` round trip to the database, paid by the
+# request, so it is off by default and runs at most once per interval and connection.
+DATABASE_HEALTH_CHECKS = os.environ.get('DATABASE_HEALTH_CHECKS', '0') == '1'
+DATABASE_HEALTH_CHECK_INTERVAL = float(os.environ.get('DATABASE_HEALTH_CHECK_INTERVAL', 30))
+# Run on every new connection of the sqlite-wal profile
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # Durable across application crashes; a power loss may lose the last commits
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,  # KiB
+    'temp_store': 'MEMORY',
+    'mmap_size': 128 * 1024 * 1024,
+}
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'djangobackend'),
+            'USER': os.environ.get('DATABASE_USER', 'djangobackend'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            # Server-side cursors do not survive PgBouncer's transaction pooling
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DATABASE_POOLER') == 'pgbouncer',
+            'OPTIONS': {'connect_timeout': 5},
+        }
     }
-}
+elif DATABASE_PROFILE == 'sqlite-wal':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            # Seconds a write waits for the lock before "database is locked"
+            'OPTIONS': {'timeout': 20},
+        }
+    }
+elif DATABASE_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_PROFILE {DATABASE_PROFILE!r}")
 
 
 # Password validation
@@ -125,3 +179,124 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(STATIC_ROOT, 'media')
 MEDIA_URL = '/media/'
+
+
+# Watson Natural Language Understanding
+# https://cloud.ibm.com/apidocs/natural-language-understanding
+
+# Credentials come from the environment only. Without NLU_URL, reviews are scored by
+# the local engine (see djangoapp.sentiment.get_sentiment_backend); an empty API key
+# skips IAM authentication, for local stubs.
+NLU_API_KEY = os.environ.get('NLU_API_KEY', '')
+NLU_URL = os.environ.get('NLU_URL', '')
+NLU_VERSION = '2022-04-07'
+
+# Review sentiment scoring (see djangoapp.restapis.analyze_review_sentiments_batch)
+SENTIMENT_MAX_WORKERS = int(os.environ.get('SENTIMENT_MAX_WORKERS', 8))
+SENTIMENT_CALL_TIMEOUT = float(os.environ.get('SENTIMENT_CALL_TIMEOUT', 3))
+SENTIMENT_DEADLINE = float(os.environ.get('SENTIMENT_DEADLINE', 5))
+# Calls with less of the deadline left than this are not made (see djangoapp.sentiment)
+SENTIMENT_MIN_CALL_TIME = float(os.environ.get('SENTIMENT_MIN_CALL_TIME', 0.5))
+SENTIMENT_DEFAULT_LABEL = 'neutral'
+# Sentiment engines, "nlu" or "local" (see djangoapp.sentiment). The fallback labels the
+# reviews the backend could not score in time; empty to give them the default label.
+SENTIMENT_BACKEND = os.environ.get('SENTIMENT_BACKEND', 'nlu')
+SENTIMENT_FALLBACK_BACKEND = os.environ.get('SENTIMENT_FALLBACK_BACKEND', 'local')
+# Tab-separated word and polarity file replacing the built-in lexicon of the local engine
+SENTIMENT_LEXICON_PATH = os.environ.get('SENTIMENT_LEXICON_PATH', '')
+# Circuit breaker around NLU (see djangoapp.circuit_breaker): it opens when, among at least
+# MIN_CALLS calls of the last WINDOW seconds, FAILURE_RATE of them failed or took over
+# SLOW_CALL seconds, and probes NLU again after OPEN_SECONDS.
+SENTIMENT_BREAKER_WINDOW = float(os.environ.get('SENTIMENT_BREAKER_WINDOW', 30))
+SENTIMENT_BREAKER_MIN_CALLS = int(os.environ.get('SENTIMENT_BREAKER_MIN_CALLS', 10))
+SENTIMENT_BREAKER_FAILURE_RATE = float(os.environ.get('SENTIMENT_BREAKER_FAILURE_RATE', 0.5))
+SENTIMENT_BREAKER_SLOW_CALL = float(os.environ.get('SENTIMENT_BREAKER_SLOW_CALL', 2))
+SENTIMENT_BREAKER_OPEN_SECONDS = float(os.environ.get('SENTIMENT_BREAKER_OPEN_SECONDS', 30))
+SENTIMENT_BREAKER_PROBES = 1
+# Keep-alive connections the shared NLU client may hold open (see djangoapp.nlu)
+NLU_POOL_SIZE = SENTIMENT_MAX_WORKERS
+
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# The tables of the database caches are created by `python manage.py migrate`
+# (djangoapp migration 0004); run `python manage.py createcachetable` after adding one.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sentiment': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'djangoapp_sentiment_cache',
+        'TIMEOUT': 60 * 60 * 24 * 30,
+        'OPTIONS': {'MAX_ENTRIES': 500000},
+    },
+    # Shared by the workers, for the little state they must agree on
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'djangoapp_shared_cache',
+        'TIMEOUT': None,
+    },
+    # Per worker; with a cache shared by the workers (memcached for instance),
+    # add_review also invalidates the fragments held for the other workers
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Sentiment label cache (see djangoapp.sentiment_cache)
+SENTIMENT_CACHE_ALIAS = 'sentiment'
+SENTIMENT_CACHE_MAX_ENTRIES = int(os.environ.get('SENTIMENT_CACHE_MAX_ENTRIES', 10000))
+SENTIMENT_CACHE_TTL = int(os.environ.get('SENTIMENT_CACHE_TTL', 60 * 60 * 24 * 30))
+
+# Rendered template fragments (see djangoapp.fragment_cache)
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 300))
+# Per-dealer car catalogs of the add review page, held by each worker, and the
+# generation of the catalogs, shared by the workers (see djangoapp.catalog)
+CAR_CATALOG_CACHE_ALIAS = 'default'
+CAR_CATALOG_GENERATION_CACHE_ALIAS = 'shared'
+CAR_CATALOG_TTL = int(os.environ.get('CAR_CATALOG_TTL', 60 * 60))
+
+# Dealership and review services
+DEALERSHIPS_SERVICE_URL = os.environ.get(
+    'DEALERSHIPS_SERVICE_URL',
+    'https://oumaimatouil-3000.theiadocker-1-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai')
+REVIEWS_SERVICE_URL = os.environ.get(
+    'REVIEWS_SERVICE_URL',
+    'https://oumaimatouil-5000.theiadocker-1-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai')
+
+# Dealership and review service calls (see djangoapp.restapis.get_session)
+RESTAPI_POOL_HOSTS = 4
+RESTAPI_POOL_SIZE = int(os.environ.get('RESTAPI_POOL_SIZE', 10))
+RESTAPI_CONNECT_TIMEOUT = float(os.environ.get('RESTAPI_CONNECT_TIMEOUT', 3.05))
+RESTAPI_READ_TIMEOUT = float(os.environ.get('RESTAPI_READ_TIMEOUT', 10))
+RESTAPI_GET_RETRIES = int(os.environ.get('RESTAPI_GET_RETRIES', 2))
+RESTAPI_RETRY_BACKOFF = 0.3
+# Bytes read at a time when streaming a JSON array (see restapis.iter_request)
+RESTAPI_STREAM_CHUNK_SIZE = 64 * 1024
+# Connections the async client may hold open across all hosts (see async_restapis.get_client)
+RESTAPI_ASYNC_MAX_CONNECTIONS = int(os.environ.get('RESTAPI_ASYNC_MAX_CONNECTIONS', 100))
+# Tagged responses kept for conditional requests (see djangoapp.validator_cache)
+RESTAPI_VALIDATOR_CACHE_ENTRIES = int(os.environ.get('RESTAPI_VALIDATOR_CACHE_ENTRIES', 1000))
+# "documents" streams dealer lists and review pages as JSON arrays; "columns" asks the
+# services for their compact columnar form instead (see djangoapp.restapis.objects_from_body)
+RESTAPI_RESPONSE_FORMAT = os.environ.get('RESTAPI_RESPONSE_FORMAT', 'documents')
+
+# Dealer details page (see djangoapp.views.get_dealer_details)
+DEALER_DETAILS_DEADLINE = float(os.environ.get('DEALER_DETAILS_DEADLINE', 6))
+REVIEWS_PAGE_SIZE = int(os.environ.get('REVIEWS_PAGE_SIZE', 25))
+
+# Nearest dealers endpoint (see djangoapp.views.get_nearest_dealerships)
+NEAREST_DEALERS_DEFAULT_K = 5
+NEAREST_DEALERS_MAX_K = int(os.environ.get('NEAREST_DEALERS_MAX_K', 50))
+
+# Review search (see djangoapp.search)
+REVIEW_SEARCH_PAGE_SIZE = int(os.environ.get('REVIEW_SEARCH_PAGE_SIZE', 20))
+REVIEW_INDEX_SYNC_BATCH = int(os.environ.get('REVIEW_INDEX_SYNC_BATCH', 500))
+
+# Dealer list cache (see djangoapp.dealer_store)
+DEALER_STORE_TTL = float(os.environ.get('DEALER_STORE_TTL', 300))
+DEALER_STORE_HARD_TTL = float(os.environ.get('DEALER_STORE_HARD_TTL', 60 * 60 * 24))
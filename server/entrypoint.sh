@@ -0,0 +1,7 @@
+#!/bin/bash
+set -e
+
+# Apply the migrations, which also create the tables of the database caches
+python manage.py migrate --noinput
+
+exec "$@"